@@ -0,0 +1,265 @@
+# answer_cache.py
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import bindparam, func, update
+
+logger = logging.getLogger(__name__)
+
+# SQL backend: hits are written back in batches of up to TOUCH_BATCH keys, at least every
+# TOUCH_INTERVAL seconds. The table size is recounted when the running total passes the cap,
+# and at least every EVICT_INTERVAL seconds to catch entries other workers have added. Eviction
+# goes down to EVICT_TO of the cap, so a full cache is not recounted on every set
+TOUCH_BATCH = 100
+TOUCH_INTERVAL = 30
+EVICT_INTERVAL = 60
+EVICT_TO = 0.9
+
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+def content_version(text):
+    """Short hash identifying a version of program content"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def make_key(program, question, version, model, context=""):
+    """
+    Cache key for (program, normalized question, content version, model). A
+    non-empty context (e.g. a digest of the conversation so far) keys answers
+    that depend on more than the question.
+    """
+    parts = [program, normalize_question(question), version, model]
+    if context:
+        parts.append(context)
+    raw = "\x1f".join(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CacheStats:
+    """Thread-safe hit/miss/eviction counters"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def record(self, name, count=1):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + count)
+
+    def to_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+class MemoryAnswerCache:
+    """In-process LRU cache with TTL and a total size cap in bytes"""
+
+    backend = "memory"
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (answer, size, created_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.time() - entry[2] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.stats.record("misses")
+                return None
+            self._entries.move_to_end(key)
+        self.stats.record("hits")
+        return entry[0]
+
+    def set(self, key, answer, program=None):
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (answer, size, time.time())
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats.record("evictions")
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def info(self):
+        with self._lock:
+            usage = {"entries": len(self._entries), "bytes": self._bytes}
+        return dict(self.stats.to_dict(), backend=self.backend, max_bytes=self.max_bytes, ttl=self.ttl, **usage)
+
+
+class SQLAnswerCache:
+    """
+    Answer cache stored in the shared database so every worker sees the same
+    entries. A hit only marks the entry as used in memory; the marks are
+    written in one UPDATE per batch. Each worker keeps a running total of the
+    bytes it knows about, so a set() only recounts the table and evicts when
+    the total passes max_bytes or EVICT_INTERVAL has gone by.
+    """
+
+    backend = "sql"
+
+    def __init__(self, session_factory, model, max_bytes, ttl, touch_batch=TOUCH_BATCH,
+                 touch_interval=TOUCH_INTERVAL, evict_interval=EVICT_INTERVAL, evict_to=EVICT_TO):
+        self.session_factory = session_factory
+        self.model = model
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.touch_batch = touch_batch
+        self.touch_interval = touch_interval
+        self.evict_interval = evict_interval
+        self.evict_to = evict_to
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._touched = {}  # key -> time of its latest hit, not yet written
+        self._touched_at = time.time()
+        self._bytes = None  # bytes in the table as of the last count plus what this worker added since
+        self._evicted_at = 0.0
+
+    def get(self, key):
+        CachedAnswer = self.model
+        db = self.session_factory()
+        try:
+            now = time.time()
+            entry = db.query(CachedAnswer.answer, CachedAnswer.created_at).filter(CachedAnswer.key == key).first()
+            if entry and now - entry.created_at > self.ttl:
+                db.query(CachedAnswer).filter(CachedAnswer.key == key).delete(synchronize_session=False)
+                db.commit()
+                entry = None
+            if entry is None:
+                self.stats.record("misses")
+                return None
+            with self._lock:
+                self._touched[key] = now
+                due = len(self._touched) >= self.touch_batch or now - self._touched_at >= self.touch_interval
+            if due:
+                self._write_touches(db)
+            self.stats.record("hits")
+            return entry.answer
+        except Exception as e:
+            db.rollback()
+            logger.error("Answer cache read error: %s", str(e))
+            return None
+        finally:
+            db.close()
+
+    def _write_touches(self, db):
+        """Write the buffered hit times in one batched UPDATE"""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touched_at = time.time()
+        if not touched:
+            return
+        table = self.model.__table__
+        db.execute(update(table).where(table.c.key == bindparam("touched_key")).values(
+            last_used_at=bindparam("touched_at")),
+            [{"touched_key": key, "touched_at": used_at} for key, used_at in touched.items()])
+        db.commit()
+
+    def set(self, key, answer, program=None):
+        CachedAnswer = self.model
+        size = len(answer.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        db = self.session_factory()
+        try:
+            now = time.time()
+            db.merge(CachedAnswer(key=key, program=program, answer=answer, size=size,
+                                  created_at=now, last_used_at=now))
+            db.commit()
+            with self._lock:
+                # A replaced entry is counted twice until the next recount, which only makes it sooner
+                if self._bytes is not None:
+                    self._bytes += size
+                due = (self._bytes is None or self._bytes > self.max_bytes
+                       or now - self._evicted_at >= self.evict_interval)
+            if due:
+                self._evict(db)
+        except Exception as e:
+            db.rollback()
+            logger.error("Answer cache write error: %s", str(e))
+        finally:
+            db.close()
+
+    def _evict(self, db):
+        """Drop expired entries, then least recently used ones until under evict_to of the size cap"""
+        CachedAnswer = self.model
+        # Pending hits first, so entries that were just used are not taken for the oldest
+        self._write_touches(db)
+        now = time.time()
+        expired = db.query(CachedAnswer).filter(CachedAnswer.created_at < now - self.ttl).delete(
+            synchronize_session=False)
+        total = db.query(func.coalesce(func.sum(CachedAnswer.size), 0)).scalar()
+        evicted = expired
+        target = self.max_bytes * self.evict_to if total > self.max_bytes else total
+        while total > target:
+            oldest = db.query(CachedAnswer.key, CachedAnswer.size).order_by(CachedAnswer.last_used_at).limit(50).all()
+            if not oldest:
+                break
+            keys = []
+            for row in oldest:
+                if total <= target:
+                    break
+                keys.append(row.key)
+                total -= row.size
+            db.query(CachedAnswer).filter(CachedAnswer.key.in_(keys)).delete(synchronize_session=False)
+            evicted += len(keys)
+        db.commit()
+        with self._lock:
+            self._bytes = total
+            self._evicted_at = now
+        if evicted:
+            self.stats.record("evictions", evicted)
+
+    def info(self):
+        CachedAnswer = self.model
+        usage = {}
+        db = self.session_factory()
+        try:
+            entries, total = db.query(func.count(CachedAnswer.key),
+                                      func.coalesce(func.sum(CachedAnswer.size), 0)).one()
+            usage = {"entries": entries, "bytes": int(total)}
+        except Exception as e:
+            logger.error("Answer cache stats error: %s", str(e))
+        finally:
+            db.close()
+        return dict(self.stats.to_dict(), backend=self.backend, max_bytes=self.max_bytes, ttl=self.ttl, **usage)
+
+
+def create_answer_cache(backend, max_bytes, ttl, session_factory=None, model=None):
+    """Create the configured cache backend ('memory', 'sql' or 'none')"""
+    if backend == "none":
+        return None
+    if backend == "sql":
+        return SQLAnswerCache(session_factory, model, max_bytes, ttl)
+    return MemoryAnswerCache(max_bytes, ttl)
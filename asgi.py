@@ -0,0 +1,262 @@
+# asgi.py
+import asyncio
+import contextlib
+import logging
+import os
+import time
+
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import main
+from llm_client import LLMUnavailable
+from log_config import new_request_id, request_id_var
+from single_flight import AsyncSingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Upstream model calls in flight per worker; the rest wait here without holding a thread
+upstream_slots = asyncio.Semaphore(int(os.getenv("LLM_MAX_CONCURRENCY", 100)))
+
+async_flights = AsyncSingleFlight(timeout=main.chat_flights.timeout, db_lock=main.chat_flights.db_lock)
+
+
+def load_flask_session(request):
+    """Read the Flask session cookie, so logins made through the Flask routes carry over"""
+    flask_app = main.app
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if not cookie:
+        return {}
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+async def generate_reply(program, snapshot, user_message, cache_key, history):
+    """Async counterpart of main.generate_reply"""
+    prompt = main.build_chat_prompt(program, snapshot, user_message, history)
+    with main.request_metrics.span("llm_queue"):
+        await upstream_slots.acquire()
+    try:
+        started = time.perf_counter()
+        with main.request_metrics.span("llm"):
+            completion = await main.llm_client.acomplete(program.model, prompt.messages, prompt.max_output_tokens)
+    finally:
+        upstream_slots.release()
+    # Caching can touch the database, so keep it off the event loop
+    return await asyncio.to_thread(main.finish_reply, program, prompt, completion, cache_key,
+                                   time.perf_counter() - started)
+
+
+async def chat(request):
+    """/chat with the model call awaited; same behaviour and responses as the Flask route"""
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    request_id_token = request_id_var.set(request_id)
+    token = main.request_metrics.start("/chat")
+    try:
+        response = await handle_chat(request)
+        main.request_metrics.finish(token, response.status_code, request.method)
+    finally:
+        request_id_var.reset(request_id_token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+async def handle_chat(request):
+    flask_session = load_flask_session(request)
+    if 'user_id' not in flask_session:
+        logger.warning("User not logged in, redirecting to login")
+        return JSONResponse({"reply": "Session expired. Please log in again."}, status_code=401)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    user_message = data.get("message") if isinstance(data, dict) else None
+    if not user_message:
+        return JSONResponse({"error": "A question is required."}, status_code=400)
+
+    program = main.program_for_code(flask_session.get('current_program'))
+    current_program = program.code
+    snapshot = program.snapshot
+    user_id = flask_session['user_id']
+
+    with main.request_metrics.span("quota"):
+        allowed, _ = await asyncio.to_thread(main.chat_limiter.consume, user_id, current_program)
+    if not allowed:
+        return JSONResponse({"reply": "You have used all your quota for today."})
+
+    try:
+        # History and cache lookups can touch the database
+        history = await asyncio.to_thread(main.load_history, user_id, current_program)
+        cache_key, chatbot_reply, source = await asyncio.to_thread(main.get_cached_reply, program, snapshot,
+                                                                   user_message, history)
+        chunk_ids = []
+        if chatbot_reply is None:
+            (chatbot_reply, chunk_ids), shared = await async_flights.do(
+                cache_key,
+                lambda: generate_reply(program, snapshot, user_message, cache_key, history),
+                lookup=lambda: main.lookup_shared_reply(cache_key)
+            )
+            source = "coalesced" if shared else "llm"
+
+        # Queues the Smartsheet row and stores the turn, which may be a database write
+        await asyncio.to_thread(main.record_chat, user_id, current_program, snapshot.version, user_message,
+                                chatbot_reply, chunk_ids, source)
+        return JSONResponse({"reply": chatbot_reply})
+
+    except LLMUnavailable as e:
+        logger.error("Chat model unavailable: %s", str(e))
+        return JSONResponse({"reply": main.LLM_UNAVAILABLE_REPLY}, status_code=503)
+    except Exception as e:
+        logger.exception("Chat error: %s", str(e))
+        return JSONResponse({"error": "Something went wrong. Please try again."}, status_code=500)
+
+
+async def stream_reply(program, snapshot, user_message, cache_key, history):
+    """Async counterpart of main.stream_reply: yields SSE delta events, then (reply, chunk_ids) as the last item"""
+    prompt = main.build_chat_prompt(program, snapshot, user_message, history)
+    with main.request_metrics.span("llm_queue"):
+        await upstream_slots.acquire()
+    try:
+        started = time.perf_counter()
+        stream = await main.llm_client.astream(program.model, prompt.messages, prompt.max_output_tokens)
+        truncator = main.ReplyTruncator()
+        try:
+            async for delta in stream:
+                ready = truncator.feed(delta)
+                if ready:
+                    yield main.sse_event({"delta": ready})
+                if truncator.over_limit:
+                    break
+        finally:
+            await stream.aclose()
+    finally:
+        upstream_slots.release()
+    rest = truncator.finish()
+    if rest:
+        yield main.sse_event({"delta": rest})
+
+    chatbot_reply = truncator.reply
+    output_tokens = main.count_tokens(chatbot_reply) if chatbot_reply else 0
+    main.llm_usage.record(program.code, program.model, prompt.input_tokens, output_tokens)
+    main.request_metrics.record_llm(program.code, time.perf_counter() - started, prompt.input_tokens, output_tokens)
+    await asyncio.to_thread(main.store_reply, program, prompt, chatbot_reply, cache_key)
+    yield chatbot_reply, prompt.chunk_ids
+
+
+async def chat_stream(request):
+    """/chat/stream with the model's stream relayed from the event loop, so a slow reply doesn't hold a thread"""
+    request_id = new_request_id(request.headers.get("x-request-id"))
+    request_id_token = request_id_var.set(request_id)
+    token = main.request_metrics.start("/chat/stream")
+    try:
+        response = await handle_chat_stream(request)
+        main.request_metrics.finish(token, response.status_code, request.method)
+    finally:
+        request_id_var.reset(request_id_token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+
+async def handle_chat_stream(request):
+    flask_session = load_flask_session(request)
+    if 'user_id' not in flask_session:
+        logger.warning("User not logged in, redirecting to login")
+        return JSONResponse({"reply": "Session expired. Please log in again."}, status_code=401)
+
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    user_message = data.get("message") if isinstance(data, dict) else None
+    if not user_message:
+        return JSONResponse({"error": "A question is required."}, status_code=400)
+
+    program = main.program_for_code(flask_session.get('current_program'))
+    current_program = program.code
+    snapshot = program.snapshot
+    user_id = flask_session['user_id']
+
+    with main.request_metrics.span("quota"):
+        allowed, _ = await asyncio.to_thread(main.chat_limiter.consume, user_id, current_program)
+    if not allowed:
+        return JSONResponse({"reply": "You have used all your quota for today."})
+
+    async def generate():
+        try:
+            history = await asyncio.to_thread(main.load_history, user_id, current_program)
+            cache_key, chatbot_reply, source = await asyncio.to_thread(main.get_cached_reply, program, snapshot,
+                                                                       user_message, history)
+            chunk_ids = []
+            if chatbot_reply is None:
+                # Wait for an identical question that is already streaming instead of starting another
+                future, leader = async_flights.begin(cache_key)
+                if leader:
+                    result = None
+                    error = None
+                    try:
+                        async for item in stream_reply(program, snapshot, user_message, cache_key, history):
+                            if isinstance(item, tuple):
+                                result = item
+                            else:
+                                yield item
+                    except Exception as e:
+                        error = e
+                        raise
+                    finally:
+                        if result is None and error is None:
+                            error = RuntimeError("The identical request was cancelled before it finished")
+                        async_flights.finish(cache_key, future, result=result, error=error)
+                    chatbot_reply, chunk_ids = result
+                    source = "llm"
+                else:
+                    chatbot_reply, _ = await async_flights.wait(future)
+                    source = "coalesced"
+                    yield main.sse_event({"delta": chatbot_reply})
+            else:
+                yield main.sse_event({"delta": chatbot_reply})
+
+            await asyncio.to_thread(main.record_chat, user_id, current_program, snapshot.version, user_message,
+                                    chatbot_reply, chunk_ids, source)
+            yield main.sse_event({"reply": chatbot_reply}, event="done")
+
+        except LLMUnavailable as e:
+            logger.error("Streaming chat model unavailable: %s", str(e))
+            yield main.sse_event({"reply": main.LLM_UNAVAILABLE_REPLY}, event="done")
+        except Exception as e:
+            logger.exception("Streaming chat error: %s", str(e))
+            yield main.sse_event({"error": "Something went wrong. Please try again."}, event="error")
+
+    # Timed and traced until the last event, like the Flask route
+    body = main.request_metrics.atraced(main.request_metrics.defer(), generate(), 200, request.method)
+    return StreamingResponse(body, media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Per worker process, after any fork
+    main.content_watcher.ensure_started()
+    main.start_warm_up()
+    yield
+
+
+# /chat and /chat/stream are served natively; every other route is the Flask app, run in a thread pool
+app = Starlette(
+    routes=[
+        Route("/chat", chat, methods=["POST"]),
+        Route("/chat/stream", chat_stream, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(main.app))
+    ],
+    lifespan=lifespan
+)
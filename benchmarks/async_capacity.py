@@ -0,0 +1,107 @@
+"""
+Concurrent /chat (or /chat/stream) capacity of the threaded WSGI server and the
+ASGI app against a fake model that takes --latency seconds to answer.
+
+    python benchmarks/async_capacity.py [--route /chat/stream] [--concurrency 200] [--latency 1.0]
+        [--threads 8] [--json]
+
+Each mode runs `serve.py` as a single process on a temporary SQLite database,
+with the answer cache off and a distinct question per request so every request
+reaches the model. Reports wall time, throughput, latency percentiles (to the
+last byte, so the whole stream for /chat/stream) and the server's resident
+memory after the run.
+"""
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+
+from harness import client_session, free_port, rss_mb, start_server, stop_server, summarize, wait_until_up
+
+
+async def drive(base_url, concurrency, route="/chat"):
+    """Log in once, then send `concurrency` distinct questions at the same time"""
+    async with client_session(base_url) as client:
+        user = {"last_name": "Bench", "email": "bench@example.org"}
+        await (await client.post("/register", data=user)).release()
+        await (await client.post("/login", data=user)).release()
+        await (await client.get("/set_program/BCC")).release()
+
+        async def ask(i):
+            started = time.perf_counter()
+            async with client.post(route, json={"message": f"question number {i} about coaching"}) as response:
+                body = await response.read()
+                # A stream that fails after it has started still has status 200
+                status = 500 if b"event: error" in body else response.status
+                return status, time.perf_counter() - started
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(ask(i) for i in range(concurrency)))
+        return results, time.perf_counter() - started
+
+
+def run_mode(mode, args, workdir):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(mode, port, workdir,
+                          LLM_FAKE_LATENCY=args.latency,
+                          LLM_TIMEOUT=args.latency * 20 + 30,
+                          LLM_MAX_CONCURRENCY=args.concurrency,
+                          WSGI_THREADS=args.threads,
+                          ANSWER_CACHE_BACKEND="none",
+                          CHAT_QUOTA_PER_DAY=1000000,
+                          CHAT_QUOTA_LIMITS="")
+    try:
+        asyncio.run(wait_until_up(base_url))
+        idle_rss = rss_mb(server.pid)
+        results, wall = asyncio.run(drive(base_url, args.concurrency, args.route))
+        peak_rss = rss_mb(server.pid)
+    finally:
+        stop_server(server)
+
+    latency = summarize([seconds for _, seconds in results])
+    ok = sum(1 for status, _ in results if status == 200)
+    return {
+        "mode": mode,
+        "route": args.route,
+        "concurrency": args.concurrency,
+        "model_latency": args.latency,
+        "ok": ok,
+        "errors": len(results) - ok,
+        "wall_seconds": round(wall, 3),
+        "requests_per_second": round(len(results) / wall, 1),
+        "p50_seconds": round(latency["p50_ms"] / 1000, 3),
+        "p95_seconds": round(latency["p95_ms"] / 1000, 3),
+        "max_seconds": round(latency["max_ms"] / 1000, 3),
+        "idle_rss_mb": idle_rss,
+        "rss_mb": peak_rss
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--route", default="/chat", choices=["/chat", "/chat/stream"])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake model latency in seconds")
+    parser.add_argument("--threads", type=int, default=8, help="WSGI server threads")
+    parser.add_argument("--modes", default="wsgi,asgi")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    results = [run_mode(mode, args, workdir) for mode in args.modes.split(",")]
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.concurrency} concurrent {args.route} requests, fake model latency {args.latency}s, "
+          f"{args.threads} WSGI threads")
+    print(f"{'mode':6} {'ok':>5} {'wall s':>8} {'req/s':>7} {'p50 s':>7} {'p95 s':>7} {'RSS MB':>7}")
+    for r in results:
+        print(f"{r['mode']:6} {r['ok']:>5} {r['wall_seconds']:>8} {r['requests_per_second']:>7} "
+              f"{r['p50_seconds']:>7} {r['p95_seconds']:>7} {r['rss_mb']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Registering and deleting a cohort of users: one request per user through
+/register and /delete_registration, against one /import_users upload and one
+/bulk_delete_users request.
+
+    python benchmarks/bulk_users_bench.py [--users 20000] [--per-row-users 2000] [--chunk-size 1000]
+
+Runs the Flask app in process with the test client. Uses DATABASE_URL when set
+(e.g. a local Postgres), otherwise a temporary SQLite file. The per-row paths
+are timed on --per-row-users users and scaled up to --users.
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from harness import ROOT
+
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ.update(AUTH_USERNAME="bench", AUTH_PASSWORD="bench", LLM_BACKEND="fake", LOG_LEVEL="WARNING",
+                  CONTENT_RELOAD_INTERVAL="0", WARM_UP_ENABLED="false")
+
+import models  # noqa: E402
+
+models.init_db()
+
+from main import app  # noqa: E402
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"bench:bench").decode()}
+
+
+def cohort(prefix, count):
+    return [(f"{prefix}{i}", f"{prefix.lower()}{i}@example.org") for i in range(count)]
+
+
+def per_row(client, users):
+    started = time.perf_counter()
+    for last_name, email in users:
+        client.post("/register", data={"last_name": last_name, "email": email})
+    registered = time.perf_counter() - started
+    started = time.perf_counter()
+    for last_name, email in users:
+        client.post("/delete_registration", headers=AUTH, json={"last_name": last_name, "email": email})
+    return registered, time.perf_counter() - started
+
+
+def bulk(client, users, chunk_size):
+    body = "last_name,email\n" + "".join(f"{last_name},{email}\n" for last_name, email in users)
+    started = time.perf_counter()
+    response = client.post("/import_users", headers=AUTH, query_string={"chunk_size": chunk_size},
+                           data={"file": (io.BytesIO(body.encode()), "cohort.csv")},
+                           content_type="multipart/form-data")
+    summary = json.loads(response.data.decode().splitlines()[-1])
+    assert summary["inserted"] == len(users), summary
+    imported = time.perf_counter() - started
+    started = time.perf_counter()
+    response = client.post("/bulk_delete_users", headers=AUTH, query_string={"chunk_size": chunk_size},
+                           json={"emails": [email for _, email in users], "confirm": len(users)})
+    summary = json.loads(response.data.decode().splitlines()[-1])
+    assert summary["deleted"] == len(users), summary
+    return imported, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--per-row-users", type=int, default=2000, help="Users timed on the per-row paths")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    client = app.test_client()
+    registered, deleted = per_row(client, cohort("Row", args.per_row_users))
+    scale = args.users / args.per_row_users
+    imported, bulk_deleted = bulk(client, cohort("Bulk", args.users), args.chunk_size)
+
+    print(f"Database: {models.engine.url.get_backend_name()}, {args.users} users, chunks of {args.chunk_size}")
+    print(f"{'path':34} {'register s':>11} {'delete s':>9}")
+    label = f"per row (scaled from {args.per_row_users})"
+    print(f"{label:34} {registered * scale:>11.2f} {deleted * scale:>9.2f}")
+    print(f"{'bulk':34} {imported:>11.2f} {bulk_deleted:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Helpers shared by the benchmarks that boot the app: start `serve.py` on a free
+port against a temporary SQLite database, the fake model and the Smartsheet
+stub, wait for it, and measure its memory.
+"""
+import asyncio
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ADMIN_USERNAME = "bench"
+ADMIN_PASSWORD = "bench"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    """Resident memory of a process in MB (Linux /proc, or psutil when installed)"""
+    try:
+        import psutil
+        return round(psutil.Process(pid).memory_info().rss / 1048576, 1)
+    except ImportError:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def start_server(mode, port, workdir, root=ROOT, **settings):
+    """Run serve.py (from `root`, the app's directory) in a subprocess; settings are extra environment variables"""
+    env = dict(os.environ,
+               SERVER_MODE=mode,
+               PORT=str(port),
+               HOST="127.0.0.1",
+               DATABASE_URL="sqlite:///" + os.path.join(workdir, f"{mode}.db"),
+               AUTH_USERNAME=ADMIN_USERNAME,
+               AUTH_PASSWORD=ADMIN_PASSWORD,
+               LLM_BACKEND="fake",
+               SMARTSHEET_STUB="true",
+               SMARTSHEET_JOURNAL_PATH=os.path.join(workdir, "journal.jsonl"),
+               CONTENT_RELOAD_INTERVAL="0",
+               UVICORN_LOG_LEVEL="warning",
+               FLASK_SECRET_KEY="benchmark",
+               DB_INIT_ON_START="true")
+    env.update({name: str(value) for name, value in settings.items()})
+    return subprocess.Popen([sys.executable, "serve.py"], cwd=root, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait(timeout=10)
+
+
+async def wait_until_up(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as client:
+        while time.monotonic() < deadline:
+            try:
+                async with client.get(base_url + "/login") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not start")
+
+
+def client_session(base_url):
+    """An aiohttp session with its own cookie jar, i.e. one browser"""
+    return aiohttp.ClientSession(
+        base_url=base_url,
+        connector=aiohttp.TCPConnector(limit=0),
+        timeout=aiohttp.ClientTimeout(total=None),
+        # unsafe=True: accept the session cookie from a bare IP address
+        cookie_jar=aiohttp.CookieJar(unsafe=True)
+    )
+
+
+def admin_headers():
+    return {"Authorization": aiohttp.BasicAuth(ADMIN_USERNAME, ADMIN_PASSWORD).encode()}
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+def summarize(latencies):
+    """count, mean and p50/p95/p99/max of a list of seconds"""
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "mean_ms": round(statistics.fmean(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0
+    }
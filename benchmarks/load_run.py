@@ -0,0 +1,315 @@
+"""
+Load test: boots the app against SQLite, the fake model and the Smartsheet stub,
+then runs a mix of register/login/set_program/chat/export traffic from
+--concurrency simulated users for --duration seconds. chat_stream (POST
+/chat/stream) can be added to the mix, e.g. chat=35,chat_stream=35,...
+
+    python benchmarks/load_run.py [--mode asgi] [--concurrency 20] [--duration 20]
+        [--mix chat=70,login=10,set_program=10,register=5,export=5]
+        [--llm-latency 0.8] [--llm-error-rate 0.0]
+        [--smartsheet-latency 0.2] [--smartsheet-error-rate 0.0]
+        [--output results.json] [--compare baseline.json]
+
+Reports throughput, p50/p95/p99 latency per operation, database queries per
+request and server memory. --output writes the results as JSON, tagged with the
+current commit; --compare prints the change against an earlier results file
+and exits with status 1 when throughput or a p95 latency is more than
+--max-regression worse.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+from harness import (ROOT, admin_headers, client_session, free_port, rss_mb, start_server, stop_server,
+                     summarize, wait_until_up)
+
+PROGRAM_CODES = ["BCC", "MI", "Safety"]
+
+QUESTION_TOPICS = [
+    "the GROW model", "giving feedback", "reflective listening", "open-ended questions",
+    "change talk", "safety planning", "risk assessment", "coaching presence",
+    "setting goals", "resistance", "summarizing", "supervision"
+]
+
+
+def parse_mix(value):
+    """Parse operation weights like 'chat=70,login=10'"""
+    mix = {}
+    for item in value.split(","):
+        name, weight = item.split("=", 1)
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class VirtualUser:
+    """One browser session working through randomly chosen operations"""
+
+    def __init__(self, number, client, rng, questions):
+        self.number = number
+        self.client = client
+        self.rng = rng
+        self.questions = questions
+        self.registrations = 0
+        self.credentials = {"last_name": f"Load{number}", "email": f"load{number}@example.org"}
+
+    async def setup(self):
+        await (await self.client.post("/register", data=self.credentials)).release()
+        await (await self.client.post("/login", data=self.credentials)).release()
+        await (await self.client.get("/set_program/BCC")).release()
+
+    async def chat(self):
+        question = self.rng.choice(self.questions)
+        async with self.client.post("/chat", json={"message": question}) as response:
+            await response.read()
+            return response.status
+
+    async def chat_stream(self):
+        question = self.rng.choice(self.questions)
+        async with self.client.post("/chat/stream", json={"message": question}) as response:
+            body = await response.read()
+            # An error event still arrives with a 200, once the stream has started
+            return response.status if b"event: error" not in body else 500
+
+    async def login(self):
+        async with self.client.post("/login", data=self.credentials) as response:
+            await response.read()
+            return response.status
+
+    async def register(self):
+        self.registrations += 1
+        data = {"last_name": f"New{self.number}x{self.registrations}",
+                "email": f"new{self.number}x{self.registrations}@example.org"}
+        async with self.client.post("/register", data=data) as response:
+            await response.read()
+            return response.status
+
+    async def set_program(self):
+        async with self.client.get(f"/set_program/{self.rng.choice(PROGRAM_CODES)}") as response:
+            await response.read()
+            return response.status
+
+    async def export(self):
+        async with self.client.get("/export_users", headers=admin_headers()) as response:
+            await response.read()
+            return response.status
+
+
+OPERATIONS = ["chat", "chat_stream", "login", "register", "set_program", "export"]
+
+
+async def admin_stats(base_url):
+    stats = {}
+    async with client_session(base_url) as client:
+        for name in ("db_stats", "llm_stats", "cache_stats", "smartsheet_stats"):
+            async with client.get(f"/{name}", headers=admin_headers()) as response:
+                stats[name] = await response.json() if response.status == 200 else None
+    return stats
+
+
+async def run_load(base_url, args, mix):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    # A small pool of questions, so repeats hit the answer cache as they would in real traffic
+    questions = [f"What does the program say about {QUESTION_TOPICS[i % len(QUESTION_TOPICS)]}? ({i // len(QUESTION_TOPICS)})"
+                 for i in range(args.questions)]
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    statuses = defaultdict(int)
+
+    async def user_loop(user, deadline):
+        while time.monotonic() < deadline:
+            name = user.rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                status = await getattr(user, name)()
+            except Exception:
+                status = "exception"
+            latencies[name].append(time.perf_counter() - started)
+            statuses[f"{name} {status}"] += 1
+            if status != 200:
+                errors[name] += 1
+
+    async with contextlib.AsyncExitStack() as stack:
+        users = []
+        for number in range(args.concurrency):
+            client = await stack.enter_async_context(client_session(base_url))
+            users.append(VirtualUser(number, client, random.Random(args.seed + number), questions))
+        # Every user registers and logs in before the clock starts
+        await asyncio.gather(*(user.setup() for user in users))
+
+        before = await admin_stats(base_url)
+        started = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*(user_loop(user, deadline) for user in users))
+        elapsed = time.perf_counter() - started
+        after = await admin_stats(base_url)
+    return latencies, errors, statuses, elapsed, before, after
+
+
+def build_results(args, mix, latencies, errors, statuses, elapsed, before, after, memory):
+    total = sum(len(values) for values in latencies.values())
+    queries = None
+    if before.get("db_stats") and after.get("db_stats"):
+        queries = after["db_stats"]["queries"] - before["db_stats"]["queries"]
+    operations = {}
+    for name in sorted(latencies):
+        operations[name] = dict(summarize(latencies[name]), errors=errors[name])
+    return {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            "mode": args.mode,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "mix": mix,
+            "questions": args.questions,
+            "answer_cache": args.answer_cache,
+            "llm_latency": args.llm_latency,
+            "llm_error_rate": args.llm_error_rate,
+            "smartsheet_latency": args.smartsheet_latency,
+            "smartsheet_error_rate": args.smartsheet_error_rate,
+            "seed": args.seed
+        },
+        "total": dict(summarize([v for values in latencies.values() for v in values]),
+                      errors=sum(errors.values()),
+                      seconds=round(elapsed, 3),
+                      requests_per_second=round(total / elapsed, 2) if elapsed else 0.0),
+        "operations": operations,
+        "statuses": dict(sorted(statuses.items())),
+        "db": {
+            "queries": queries,
+            "queries_per_request": round(queries / total, 2) if queries is not None and total else None
+        },
+        "memory": memory,
+        "server": after
+    }
+
+
+def print_results(results):
+    config = results["config"]
+    print(f"{config['mode']} server, {config['concurrency']} users for {config['duration']} s, "
+          f"commit {results['commit']}")
+    print(f"{'operation':12} {'count':>7} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(results["operations"].items()) + [("total", results["total"])]
+    for name, stats in rows:
+        print(f"{name:12} {stats['count']:>7} {stats['errors']:>7} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['p99_ms']:>9}")
+    print(f"Throughput: {results['total']['requests_per_second']} requests/s")
+    print(f"DB queries per request: {results['db']['queries_per_request']}")
+    memory = results["memory"]
+    print(f"Server memory: {memory['idle_rss_mb']} MB idle, {memory['rss_mb']} MB after the run")
+
+
+def compare(results, baseline, max_regression):
+    """Print changes against a baseline; returns True when something regressed past max_regression"""
+    regressed = False
+    print(f"Compared with {baseline.get('commit')} ({baseline.get('timestamp')}):")
+    if baseline.get("config") != results["config"]:
+        print("  Note: the runs used different settings, so the numbers may not be comparable")
+
+    def line(label, old, new, higher_is_better):
+        nonlocal regressed
+        if not old:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        flag = ""
+        if worse > max_regression:
+            regressed = True
+            flag = "  REGRESSION"
+        print(f"  {label:28} {old:>10} -> {new:>10} ({change:+.1%}){flag}")
+
+    line("requests/s", baseline["total"]["requests_per_second"], results["total"]["requests_per_second"], True)
+    for name, stats in results["operations"].items():
+        old = baseline["operations"].get(name)
+        if old:
+            line(f"{name} p95 ms", old["p95_ms"], stats["p95_ms"], False)
+    old_queries = baseline["db"].get("queries_per_request")
+    if old_queries and results["db"]["queries_per_request"] is not None:
+        line("DB queries/request", old_queries, results["db"]["queries_per_request"], False)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="asgi", choices=["asgi", "wsgi"])
+    parser.add_argument("--concurrency", type=int, default=20, help="Simulated users")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load")
+    parser.add_argument("--mix", default="chat=70,login=10,set_program=10,register=5,export=5")
+    parser.add_argument("--questions", type=int, default=30, help="Distinct questions in the pool")
+    parser.add_argument("--answer-cache", default="memory", choices=["memory", "sql", "none"])
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--smartsheet-latency", type=float, default=0.2)
+    parser.add_argument("--smartsheet-error-rate", type=float, default=0.0)
+    parser.add_argument("--threads", type=int, default=8, help="WSGI server threads")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results as JSON to this file ('-' for stdout)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative slowdown before --compare fails (default 0.2)")
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp()
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    server = start_server(args.mode, port, workdir,
+                          LLM_FAKE_LATENCY=args.llm_latency,
+                          LLM_FAKE_ERROR_RATE=args.llm_error_rate,
+                          SMARTSHEET_STUB_LATENCY=args.smartsheet_latency,
+                          SMARTSHEET_STUB_ERROR_RATE=args.smartsheet_error_rate,
+                          ANSWER_CACHE_BACKEND=args.answer_cache,
+                          CHAT_QUOTA_PER_DAY=1000000,
+                          CHAT_QUOTA_LIMITS="",
+                          WSGI_THREADS=args.threads,
+                          LLM_MAX_CONCURRENCY=max(args.concurrency, 1))
+    try:
+        asyncio.run(wait_until_up(base_url))
+        idle_rss = rss_mb(server.pid)
+        outcome = asyncio.run(run_load(base_url, args, mix))
+        memory = {"idle_rss_mb": idle_rss, "rss_mb": rss_mb(server.pid)}
+    finally:
+        stop_server(server)
+
+    results = build_results(args, mix, *outcome, memory=memory)
+    if args.output == "-":
+        print(json.dumps(results, indent=2))
+    else:
+        print_results(results)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(results, f, indent=2)
+            print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Time that logging adds to a request thread, with the old setup (a synchronous
+stream handler at DEBUG) against the queue-based setup in log_config.py.
+
+    python benchmarks/logging_overhead.py [--threads 8] [--requests 2000]
+        [--debug-lines 6] [--sink-latency 0.0002] [--queue-size N] [--json]
+
+Each simulated request makes the log calls of a /chat request: --debug-lines
+DEBUG records plus one INFO record, with a list of chunk ids and a question as
+arguments. Records are written to a sink that takes --sink-latency seconds per
+write, like a stdout pipe that a log collector drains slowly. Reports the
+per-request time spent in logging calls (mean, p50, p99), how long the
+listener took to drain the queue afterwards, and how many records a full
+queue dropped. A run that dropped records did less work than the others, so
+it is only listed, not compared. By default the queue holds every record of a
+run; --queue-size 10000 (the LOG_QUEUE_SIZE default) shows what a slow sink
+drops in production.
+"""
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+
+from harness import ROOT, percentile
+
+sys.path.insert(0, ROOT)
+
+from log_config import configure_logging, log_stats, request_id_var, stop_logging  # noqa: E402
+
+logger = logging.getLogger("main")
+
+
+class SlowSink:
+    """A stream that discards what it gets after waiting `latency` seconds per write"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.writes = 0
+        self._devnull = open(os.devnull, "w")
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        self.writes += 1
+        return self._devnull.write(text)
+
+    def flush(self):
+        self._devnull.flush()
+
+
+def simulated_request(number, debug_lines, eager):
+    chunk_ids = list(range(number % 7, number % 7 + 5))
+    question = f"What does the program say about giving feedback? ({number})"
+    started = time.perf_counter()
+    for i in range(debug_lines):
+        if eager:
+            logger.debug(f"Step {i}: chunks {chunk_ids} for question {question!r}")
+        else:
+            logger.debug("Step %d: chunks %s for question %r", i, chunk_ids, question)
+    logger.info("Answered chat for program %s in %.1f ms", "BCC", 812.5)
+    return time.perf_counter() - started
+
+
+def run_config(name, setup, args, eager=False):
+    sink = SlowSink(args.sink_latency)
+    setup(sink)
+    timings = []
+    lock = threading.Lock()
+
+    def worker(offset):
+        local = []
+        for n in range(args.requests):
+            token = request_id_var.set(f"req-{offset}-{n}")
+            local.append(simulated_request(offset * args.requests + n, args.debug_lines, eager))
+            request_id_var.reset(token)
+        with lock:
+            timings.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    requests_done = time.perf_counter() - started
+
+    dropped = log_stats()["dropped"] if name.startswith("queue") else 0
+    drain_started = time.perf_counter()
+    # Wait for the whole queue, however long the slow sink takes
+    stop_logging(timeout=3600)
+    for handler in list(logging.getLogger().handlers):
+        handler.flush()
+    drained = time.perf_counter() - drain_started
+
+    timings.sort()
+    return {
+        "config": name,
+        "requests": len(timings),
+        "mean_us": round(statistics.fmean(timings) * 1e6, 1),
+        "p50_us": round(percentile(timings, 0.50) * 1e6, 1),
+        "p99_us": round(percentile(timings, 0.99) * 1e6, 1),
+        "requests_seconds": round(requests_done, 3),
+        "drain_seconds": round(drained, 3),
+        "lines_written": sink.writes,
+        "dropped": dropped
+    }
+
+
+def synchronous(level):
+    """The old setup: logging.basicConfig(level=DEBUG) writing from the request thread"""
+    def setup(sink):
+        stop_logging()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(level)
+    return setup
+
+
+def queued(level, queue_size):
+    def setup(sink):
+        configure_logging(level=level, fmt="json", stream=sink, queue_size=queue_size)
+    return setup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per thread")
+    parser.add_argument("--debug-lines", type=int, default=6, help="DEBUG records per request")
+    parser.add_argument("--sink-latency", type=float, default=0.0002, help="Seconds per write to the log sink")
+    parser.add_argument("--queue-size", type=int, help="Log queue size (default: every record of a run)")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+    if args.queue_size is None:
+        args.queue_size = args.threads * args.requests * (args.debug_lines + 1)
+
+    results = [
+        run_config("sync DEBUG (before)", synchronous("DEBUG"), args),
+        run_config("queue DEBUG", queued("DEBUG", args.queue_size), args),
+        run_config("queue INFO, eager f-strings", queued("INFO", args.queue_size), args, eager=True),
+        run_config("queue INFO (default)", queued("INFO", args.queue_size), args)
+    ]
+
+    baseline = results[0]["mean_us"]
+    for r in results:
+        r["speedup"] = round(baseline / r["mean_us"], 1) if not r["dropped"] and r["mean_us"] else None
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.threads} threads x {args.requests} requests, {args.debug_lines} DEBUG + 1 INFO records each, "
+          f"sink latency {args.sink_latency * 1e6:.0f} us/write, queue size {args.queue_size}")
+    print(f"{'config':30} {'mean us':>9} {'p50 us':>9} {'p99 us':>9} {'run s':>7} {'drain s':>8} "
+          f"{'written':>8} {'dropped':>8} {'vs sync':>8}")
+    for r in results:
+        speedup = f"{r['speedup']}x" if r["speedup"] is not None else "n/a"
+        print(f"{r['config']:30} {r['mean_us']:>9} {r['p50_us']:>9} {r['p99_us']:>9} {r['requests_seconds']:>7} "
+              f"{r['drain_seconds']:>8} {r['lines_written']:>8} {r['dropped']:>8} {speedup:>8}")
+    if any(r["dropped"] for r in results):
+        print("Runs that dropped records wrote less than the others and are not compared (n/a)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Round trips and latency of the login and set_program hot paths, before and after
+switching to single-statement updates.
+
+    python benchmarks/login_roundtrips.py [--users 2000] [--logins 2000]
+
+Uses DATABASE_URL when set (e.g. a local Postgres), otherwise a temporary SQLite file.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+if not os.getenv("DATABASE_URL"):
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from sqlalchemy import event  # noqa: E402
+
+from models import User, SessionLocal, engine, init_db  # noqa: E402
+
+statement_count = 0
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def count_statement(conn, cursor, statement, parameters, context, executemany):
+    global statement_count
+    statement_count += 1
+
+
+def login_before(db, last_name, email):
+    """The original login path: SELECT, increment in Python, commit"""
+    user = User.get_by_credentials(db, last_name, email)
+    user.visit_count += 1
+    user_data = user.to_dict()
+    db.commit()
+    return user_data
+
+
+def login_after(db, last_name, email):
+    return User.record_login(db, last_name, email)
+
+
+def set_program_before(db, user_id, program):
+    user = User.get_by_id(db, user_id)
+    user.current_program = program
+    db.commit()
+
+
+def set_program_after(db, user_id, program):
+    User.set_current_program(db, user_id, program)
+
+
+def run(name, fn, args_list):
+    global statement_count
+    timings = []
+    statement_count = 0
+    for args in args_list:
+        db = SessionLocal()
+        started = time.perf_counter()
+        fn(db, *args)
+        timings.append((time.perf_counter() - started) * 1000)
+        db.close()
+    timings.sort()
+    return {
+        "name": name,
+        "statements_per_call": statement_count / len(args_list),
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--logins", type=int, default=2000)
+    args = parser.parse_args()
+
+    init_db()
+    db = SessionLocal()
+    db.query(User).filter(User.email.like("bench-%")).delete(synchronize_session=False)
+    db.add_all([User(last_name=f"Bench{i}", email=f"bench-{i}@example.org", visit_count=0)
+                for i in range(args.users)])
+    db.commit()
+    ids = [row.id for row in db.query(User.id).filter(User.email.like("bench-%"))]
+    db.close()
+
+    logins = [(f"Bench{i % args.users}", f"bench-{i % args.users}@example.org") for i in range(args.logins)]
+    programs = [(ids[i % len(ids)], ("BCC", "MI", "Safety")[i % 3]) for i in range(args.logins)]
+
+    results = [
+        run("login (before)", login_before, logins),
+        run("login (after)", login_after, logins),
+        run("set_program (before)", set_program_before, programs),
+        run("set_program (after)", set_program_after, programs),
+    ]
+
+    print(f"Database: {engine.url.get_backend_name()}, {args.users} users, {args.logins} calls each")
+    print(f"{'path':<24}{'stmts/call':>12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for r in results:
+        print(f"{r['name']:<24}{r['statements_per_call']:>12.2f}{r['mean_ms']:>10.3f}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}")
+
+    db = SessionLocal()
+    db.query(User).filter(User.email.like("bench-%")).delete(synchronize_session=False)
+    db.commit()
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
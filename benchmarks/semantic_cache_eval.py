@@ -0,0 +1,132 @@
+"""
+Offline evaluation of the semantic answer cache on a question log.
+
+    python benchmarks/semantic_cache_eval.py [log] [--thresholds 0.7,0.8,0.9]
+        [--dim 512] [--capacity 1000] [--show-hits 0.8] [--json]
+
+The log is JSONL with "question", and optionally "program" and "intent",
+fields, or a CSV with those columns (a Smartsheet export works: a leading
+"[BCC]" tag in the question gives the program). The default is a labelled
+sample in benchmarks/data. Questions are replayed in order against a fresh
+cache per threshold. A miss stores the question with its intent as the
+"answer", so a hit is false when it returns another intent's answer.
+
+Reports, per threshold:
+- hit rate: hits / questions
+- false-hit rate: wrong answers / hits
+- recall: correct hits / questions whose intent had been asked before, i.e. the hits a perfect cache would get
+
+The exact-key cache's hit rate is shown for comparison. Without intent labels
+only the hit rate is known; use --show-hits to review the matched pairs.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+from harness import ROOT
+
+sys.path.insert(0, ROOT)
+
+from answer_cache import normalize_question  # noqa: E402
+from faq import read_question_log  # noqa: E402
+from program_registry import ProgramRegistry  # noqa: E402
+from semantic_cache import SemanticCache, program_aliases  # noqa: E402
+
+SAMPLE_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "questions_sample.jsonl")
+
+
+def read_log(path):
+    return [{"program": program or "default", "question": question, "intent": intent}
+            for program, question, intent in read_question_log(path, fields=("intent",))]
+
+
+def replay(rows, threshold, dim, capacity, aliases):
+    cache = SemanticCache(threshold=threshold, capacity=capacity, dim=dim, aliases=aliases)
+    labelled = all(row["intent"] for row in rows)
+    seen_intents = set()
+    hits = false_hits = possible = 0
+    pairs = []
+    started = time.perf_counter()
+    for row in rows:
+        program, question, intent = row["program"], row["question"], row["intent"]
+        answer = cache.get(program, "eval", question)
+        if labelled and (program, intent) in seen_intents:
+            possible += 1
+        if answer is not None:
+            hits += 1
+            stored_question, stored_intent = answer.split("\x1f")
+            if labelled and stored_intent != intent:
+                false_hits += 1
+            pairs.append((question, stored_question, labelled and stored_intent != intent))
+        else:
+            cache.set(program, "eval", question, f"{question}\x1f{intent or ''}")
+        seen_intents.add((program, intent))
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "threshold": threshold,
+        "questions": len(rows),
+        "hits": hits,
+        "hit_rate": round(hits / len(rows), 4) if rows else 0.0,
+        "us_per_question": round(elapsed / len(rows) * 1e6, 1) if rows else 0.0
+    }
+    if labelled:
+        result.update(false_hits=false_hits,
+                      false_hit_rate=round(false_hits / hits, 4) if hits else 0.0,
+                      recall=round((hits - false_hits) / possible, 4) if possible else 0.0)
+    return result, pairs
+
+
+def exact_hit_rate(rows):
+    seen = set()
+    hits = 0
+    for row in rows:
+        key = (row["program"], normalize_question(row["question"]))
+        hits += key in seen
+        seen.add(key)
+    return round(hits / len(rows), 4) if rows else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("log", nargs="?", default=SAMPLE_LOG)
+    parser.add_argument("--thresholds", default="0.5,0.6,0.7,0.75,0.8,0.85,0.9,0.95")
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--capacity", type=int, default=1000)
+    parser.add_argument("--manifest", default=os.path.join(ROOT, "programs.json"),
+                        help="Programs manifest, for acronym aliases like MI")
+    parser.add_argument("--show-hits", type=float, help="Print the matched question pairs at this threshold")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    aliases = program_aliases(ProgramRegistry.from_manifest(args.manifest)) if args.manifest else {}
+    rows = read_log(args.log)
+    if not rows:
+        raise SystemExit(f"No questions in {args.log}")
+    thresholds = [float(t) for t in args.thresholds.split(",")]
+    results = [replay(rows, threshold, args.dim, args.capacity, aliases)[0] for threshold in thresholds]
+
+    if args.json:
+        print(json.dumps({"log": args.log, "exact_hit_rate": exact_hit_rate(rows), "thresholds": results}, indent=2))
+    else:
+        print(f"{len(rows)} questions from {args.log}; exact-key cache hit rate {exact_hit_rate(rows):.1%}")
+        labelled = "false_hit_rate" in results[0]
+        print(f"{'threshold':>9} {'hits':>6} {'hit rate':>9}" +
+              (f" {'false hits':>10} {'false rate':>10} {'recall':>7}" if labelled else "") + f" {'us/q':>7}")
+        for r in results:
+            line = f"{r['threshold']:>9} {r['hits']:>6} {r['hit_rate']:>9.1%}"
+            if labelled:
+                line += f" {r['false_hits']:>10} {r['false_hit_rate']:>10.1%} {r['recall']:>7.1%}"
+            print(line + f" {r['us_per_question']:>7}")
+
+    if args.show_hits is not None:
+        _, pairs = replay(rows, args.show_hits, args.dim, args.capacity, aliases)
+        print(f"\nMatches at threshold {args.show_hits}:")
+        for question, stored, wrong in pairs:
+            print(f"  {'WRONG ' if wrong else ''}{question!r} -> {stored!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Cold start of the app: import cost and the time until the server answers.
+
+    python benchmarks/startup_time.py [--runs 5] [--modes asgi,wsgi] [--top 10]
+        [--compare REF] [--json]
+
+For each run, measures:
+- import: `python -X importtime -c "import asgi"` in a fresh process. Reports the
+  wall time and the cumulative import time of the heaviest packages.
+- first 200: starts serve.py and polls GET /login every 10 ms. Reports the time
+  from process start until the first 200.
+
+The database is created once up front (`python migrate.py`), as a deploy would
+do, so the numbers don't include schema work. The environment is production
+shaped: the OpenAI backend with a dummy key, and the Smartsheet stub, so no
+request leaves the machine. --compare REF runs the same measurements on a git
+worktree of REF (e.g. HEAD~1) and prints both.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from harness import ROOT, free_port, start_server, stop_server
+
+ENV = {
+    "LLM_BACKEND": "openai",
+    "OPENAI_API_KEY": "sk-benchmark",
+    "SMARTSHEET_STUB": "true",
+    "CONTENT_RELOAD_INTERVAL": "0",
+    "AUTH_USERNAME": "bench",
+    "AUTH_PASSWORD": "bench",
+    "FLASK_SECRET_KEY": "benchmark",
+    "LOG_LEVEL": "WARNING"
+}
+
+
+def app_settings(workdir):
+    return dict(ENV, DATABASE_URL="sqlite:///" + os.path.join(workdir, "startup.db"),
+                SMARTSHEET_JOURNAL_PATH=os.path.join(workdir, "journal.jsonl"))
+
+
+def app_env(workdir):
+    return dict(os.environ, **app_settings(workdir))
+
+
+def init_database(root, workdir):
+    env = app_env(workdir)
+    if os.path.exists(os.path.join(root, "migrate.py")):
+        command = [sys.executable, "migrate.py"]
+    elif os.path.exists(os.path.join(root, "init_db.py")):
+        command = [sys.executable, "init_db.py"]
+    else:
+        # Older trees create the tables when models is imported
+        command = [sys.executable, "-c", "import models"]
+    subprocess.run(command, cwd=root, env=env, check=True, capture_output=True)
+
+
+def parse_importtime(stderr):
+    """{top-level package: cumulative seconds of its first import} from -X importtime output"""
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        # A package's outermost entry includes its submodules
+        packages[package] = max(packages.get(package, 0.0), int(cumulative) / 1e6)
+    return packages
+
+
+def measure_import(root, workdir):
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import asgi"], cwd=root,
+                            env=app_env(workdir), capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise RuntimeError(result.stderr[-2000:])
+    return elapsed, parse_importtime(result.stderr)
+
+
+def measure_first_200(root, workdir, mode):
+    port = free_port()
+    started = time.perf_counter()
+    server = start_server(mode, port, workdir, root=root, DB_INIT_ON_START="false", **app_settings(workdir))
+    try:
+        deadline = started + 60
+        while time.perf_counter() < deadline:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/login", timeout=5) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            if server.poll() is not None:
+                raise RuntimeError(f"{mode} server exited with {server.returncode}")
+            time.sleep(0.01)
+        raise RuntimeError("Server did not start")
+    finally:
+        stop_server(server)
+
+
+def measure_tree(root, args):
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    init_database(root, workdir)
+    walls, modules = [], {}
+    for _ in range(args.runs):
+        wall, run_modules = measure_import(root, workdir)
+        walls.append(wall)
+        for name, seconds in run_modules.items():
+            modules.setdefault(name, []).append(seconds)
+    import_ms = {name: round(statistics.median(values) * 1000, 1) for name, values in modules.items()}
+    result = {
+        "import_wall_ms": round(statistics.median(walls) * 1000, 1),
+        "import_asgi_ms": import_ms.get("asgi", 0.0),
+        "top_imports_ms": dict(sorted(((name, ms) for name, ms in import_ms.items() if name not in ("asgi", "main")),
+                                      key=lambda item: -item[1])[:args.top])
+    }
+    for mode in args.modes.split(","):
+        timings = [measure_first_200(root, workdir, mode) for _ in range(args.runs)]
+        result[f"{mode}_first_200_ms"] = round(statistics.median(timings) * 1000, 1)
+    return result
+
+
+def worktree(ref):
+    path = tempfile.mkdtemp(prefix="startup-ref-")
+    subprocess.run(["git", "worktree", "add", "--detach", path, ref], cwd=ROOT, check=True, capture_output=True)
+    return path
+
+
+def print_result(label, result):
+    print(f"{label}: import asgi {result['import_asgi_ms']} ms (process {result['import_wall_ms']} ms)" +
+          "".join(f", {name.split('_')[0]} first 200 {value} ms"
+                  for name, value in result.items() if name.endswith("_first_200_ms")))
+    for name, ms in result["top_imports_ms"].items():
+        print(f"    {name:30} {ms:>8} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--modes", default="asgi,wsgi", help="Server modes to start")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest imported packages to list")
+    parser.add_argument("--compare", metavar="REF", help="Also measure this git ref, e.g. HEAD~1")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    args = parser.parse_args()
+
+    results = {"current": measure_tree(ROOT, args)}
+    if args.compare:
+        path = worktree(args.compare)
+        try:
+            results[args.compare] = measure_tree(path, args)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", path], cwd=ROOT, capture_output=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for label, result in results.items():
+        print_result(label, result)
+
+
+if __name__ == "__main__":
+    main()
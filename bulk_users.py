@@ -0,0 +1,212 @@
+# bulk_users.py
+import csv
+import logging
+import re
+import time
+
+from sqlalchemy import delete, insert, select
+
+logger = logging.getLogger(__name__)
+
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+# CSV header names (lowercased, spaces as underscores) -> field; the /export_users file is accepted as is
+CSV_COLUMNS = {
+    "last_name": "last_name",
+    "lastname": "last_name",
+    "email": "email",
+    "program": "program",
+    "current_program": "program"
+}
+
+# Stay well under the bind parameter limits (SQLite 32766, Postgres 65535) with 4 columns per row
+MAX_CHUNK_SIZE = 5000
+
+
+def read_user_csv(lines):
+    """
+    Yield (line number, last name, email, program) for each data row of a CSV
+    with last_name and email columns and an optional program column.
+    Raises ValueError when the header lacks a required column.
+    """
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return
+    fields = [CSV_COLUMNS.get(name.strip().lower().replace(" ", "_")) for name in header]
+    missing = {"last_name", "email"} - set(fields)
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(sorted(missing))}")
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        values = {field: cell.strip() for field, cell in zip(fields, row) if field}
+        yield reader.line_num, values.get("last_name", ""), values.get("email", ""), values.get("program", "")
+
+
+def insert_ignoring_duplicates(db, table, rows):
+    """INSERT ... ON CONFLICT DO NOTHING for a list of row dicts; returns the emails inserted"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        # No portable ON CONFLICT: skip the emails that already exist, then insert the rest
+        emails = [row["email"] for row in rows]
+        existing = set(db.execute(select(table.c.email).where(table.c.email.in_(emails))).scalars())
+        rows = [row for row in rows if row["email"] not in existing]
+        if rows:
+            db.execute(insert(table), rows)
+        return {row["email"] for row in rows}
+    statement = dialect_insert(table).values(rows).on_conflict_do_nothing(index_elements=["email"])
+    return set(db.execute(statement.returning(table.c.email)).scalars())
+
+
+class BulkUsers:
+    """
+    Set-based user import and deletion for admins. Work is done `chunk_size`
+    rows per statement and transaction; each operation is a generator that
+    yields a progress dict after every chunk, with that chunk's per-row
+    errors, and a final summary with "done": true. Deleting users also deletes
+    their rows in `related_models` (models with a user_id column).
+    """
+
+    def __init__(self, session_factory, model, related_models=(), chunk_size=1000):
+        self.session_factory = session_factory
+        self.model = model
+        self.related_models = related_models
+        self.chunk_size = chunk_size
+
+    def _chunk_size(self, chunk_size):
+        return min(max(int(chunk_size or self.chunk_size), 1), MAX_CHUNK_SIZE)
+
+    def import_csv(self, lines, programs, default_program, chunk_size=None):
+        """
+        Register the users in a CSV (see read_user_csv). Rows with a missing or
+        invalid field, an unknown program or an email repeated in the file are
+        reported as errors; emails that are already registered are skipped.
+        """
+        chunk_size = self._chunk_size(chunk_size)
+        totals = {"rows": 0, "inserted": 0, "skipped": 0, "errors": 0}
+        started = time.perf_counter()
+        seen = set()
+        chunk, errors = [], []
+        try:
+            for line, last_name, email, program in read_user_csv(lines):
+                totals["rows"] += 1
+                program = program or default_program
+                error = None
+                if not last_name or not email:
+                    error = "last_name and email are required"
+                elif not EMAIL_RE.match(email):
+                    error = "invalid email"
+                elif program not in programs:
+                    error = f"unknown program {program}"
+                elif email in seen:
+                    error = "email repeated in the file"
+                if error:
+                    errors.append({"line": line, "email": email, "error": error})
+                    continue
+                seen.add(email)
+                chunk.append({"line": line, "last_name": last_name, "email": email, "current_program": program})
+                if len(chunk) >= chunk_size:
+                    yield self._insert_chunk(chunk, errors, totals)
+                    chunk, errors = [], []
+        except (ValueError, UnicodeDecodeError, csv.Error) as e:
+            errors.append({"line": None, "email": None, "error": f"Could not read the CSV: {e}"})
+        if chunk or errors:
+            yield self._insert_chunk(chunk, errors, totals)
+        seconds = time.perf_counter() - started
+        logger.info("Bulk import: %d rows, %d inserted, %d skipped, %d errors in %.2f s",
+                    totals["rows"], totals["inserted"], totals["skipped"], totals["errors"], seconds)
+        yield dict(totals, done=True, seconds=round(seconds, 3))
+
+    def _insert_chunk(self, chunk, errors, totals):
+        inserted = set()
+        if chunk:
+            rows = [{"last_name": r["last_name"], "email": r["email"], "current_program": r["current_program"],
+                     "visit_count": 0} for r in chunk]
+            db = self.session_factory()
+            try:
+                inserted = insert_ignoring_duplicates(db, self.model.__table__, rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                logger.error("Bulk import chunk failed: %s", str(e))
+                errors.extend({"line": r["line"], "email": r["email"], "error": f"not saved: {e}"} for r in chunk)
+                chunk = []
+            finally:
+                db.close()
+        skipped = [r for r in chunk if r["email"] not in inserted]
+        totals["inserted"] += len(inserted)
+        totals["skipped"] += len(skipped)
+        totals["errors"] += len(errors)
+        return dict(totals, chunk_errors=errors,
+                    chunk_skipped=[{"line": r["line"], "email": r["email"]} for r in skipped])
+
+    def delete_emails(self, emails, chunk_size=None):
+        """Delete the users with these emails; emails with no user are reported as errors"""
+        chunk_size = self._chunk_size(chunk_size)
+        emails = list(dict.fromkeys(email.strip() for email in emails if email.strip()))
+        totals = {"requested": len(emails), "deleted": 0, "errors": 0}
+        started = time.perf_counter()
+        User = self.model
+        for i in range(0, len(emails), chunk_size):
+            batch = emails[i:i + chunk_size]
+            deleted, error = self._delete(User.email.in_(batch))
+            if error:
+                errors = [{"email": email, "error": error} for email in batch]
+            else:
+                errors = [{"email": email, "error": "not found"} for email in batch if email not in deleted]
+            totals["deleted"] += len(deleted)
+            totals["errors"] += len(errors)
+            yield dict(totals, chunk_errors=errors)
+        seconds = time.perf_counter() - started
+        logger.info("Bulk delete by email: %d requested, %d deleted in %.2f s",
+                    totals["requested"], totals["deleted"], seconds)
+        yield dict(totals, done=True, seconds=round(seconds, 3))
+
+    def delete_program(self, program, chunk_size=None):
+        """Delete every user whose current program is `program`, `chunk_size` users per transaction"""
+        chunk_size = self._chunk_size(chunk_size)
+        totals = {"deleted": 0, "errors": 0}
+        started = time.perf_counter()
+        User = self.model
+        while True:
+            batch = select(User.id).where(User.current_program == program).order_by(User.id).limit(chunk_size)
+            deleted, error = self._delete(User.id.in_(batch.scalar_subquery()))
+            if error:
+                totals["errors"] += 1
+                yield dict(totals, chunk_errors=[{"email": None, "error": error}])
+                break
+            totals["deleted"] += len(deleted)
+            yield dict(totals, chunk_errors=[])
+            if len(deleted) < chunk_size:
+                break
+        seconds = time.perf_counter() - started
+        logger.info("Bulk delete of program %s: %d deleted in %.2f s", program, totals["deleted"], seconds)
+        yield dict(totals, done=True, seconds=round(seconds, 3))
+
+    def _delete(self, condition):
+        """Delete the users matching `condition` and their related rows in one transaction; (emails, error)"""
+        User = self.model
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                delete(User).where(condition).returning(User.id, User.email)
+                .execution_options(synchronize_session=False)
+            ).all()
+            ids = [row.id for row in rows]
+            if ids:
+                for model in self.related_models:
+                    db.execute(delete(model).where(model.user_id.in_(ids))
+                               .execution_options(synchronize_session=False))
+            db.commit()
+            return {row.email for row in rows}, None
+        except Exception as e:
+            db.rollback()
+            logger.error("Bulk delete failed: %s", str(e))
+            return set(), str(e)
+        finally:
+            db.close()
@@ -0,0 +1,202 @@
+# content_index.py
+import math
+import re
+import sys
+from collections import defaultdict
+
+# Rough chars-per-token ratio for English text, used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+# Target chunk size in words when splitting program content
+CHUNK_WORDS = 120
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its
+me my of on or our so that the their them then there these they this to was we what
+when where which who why will with you your
+""".split())
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase word tokens with stopwords removed"""
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+def estimate_tokens(text):
+    """Cheap token estimate for budgeting prompt size"""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+_encoding = None
+
+
+def _get_encoding():
+    """tiktoken's o200k/cl100k encoding when tiktoken is installed, else False"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except ValueError:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            # Not installed, or the encoding file can't be fetched: fall back to estimates
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    """Token count from the offline tokenizer, or an estimate without one"""
+    encoding = _get_encoding()
+    if encoding:
+        return max(1, len(encoding.encode(text, disallowed_special=())))
+    return estimate_tokens(text)
+
+
+def chunk_content(text, chunk_words=CHUNK_WORDS):
+    """
+    Split program content into chunks along paragraph boundaries.
+    Short paragraphs (slide titles, bullets) are merged until a chunk
+    reaches roughly chunk_words; oversized paragraphs are split by lines.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+    pieces = []
+    for paragraph in paragraphs:
+        if len(paragraph.split()) <= chunk_words:
+            pieces.append(paragraph)
+            continue
+        # Split long paragraphs on line breaks, keeping lines together
+        current = []
+        count = 0
+        for line in paragraph.splitlines():
+            words = len(line.split())
+            if current and count + words > chunk_words:
+                pieces.append("\n".join(current))
+                current, count = [], 0
+            current.append(line)
+            count += words
+        if current:
+            pieces.append("\n".join(current))
+
+    chunks = []
+    current = []
+    count = 0
+    for piece in pieces:
+        words = len(piece.split())
+        if current and count + words > chunk_words:
+            chunks.append("\n\n".join(current))
+            current, count = [], 0
+        current.append(piece)
+        count += words
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+class ContentIndex:
+    """BM25 index over the chunks of one program's content"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        # Counted once when the content loads, then reused for every prompt
+        self.chunk_tokens = [count_tokens(c) for c in chunks]
+        self.postings = defaultdict(list)  # term -> [(chunk_id, term_frequency)]
+        self.doc_lengths = []
+
+        for chunk_id, chunk in enumerate(chunks):
+            terms = tokenize(chunk)
+            self.doc_lengths.append(len(terms))
+            frequencies = defaultdict(int)
+            for term in terms:
+                frequencies[term] += 1
+            for term, tf in frequencies.items():
+                self.postings[term].append((chunk_id, tf))
+
+        n = len(chunks)
+        self.avg_doc_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+        self.postings = dict(self.postings)
+
+    @classmethod
+    def from_text(cls, text, chunk_words=CHUNK_WORDS):
+        """Build an index from raw program content"""
+        return cls(chunk_content(text, chunk_words))
+
+    def search(self, query, top_k=5):
+        """Return [(chunk_id, score)] for the best matching chunks"""
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for chunk_id, tf in posting:
+                norm = 1 - BM25_B + BM25_B * self.doc_lengths[chunk_id] / (self.avg_doc_length or 1)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * norm)
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:top_k]
+
+    def select(self, query, top_k=5, token_budget=1500, exclude=()):
+        """
+        Pick the chunk ids to send for a query: the best top_k matches that
+        fit within token_budget, returned in document order. When nothing
+        matches, fall back to the opening chunks so the model still has context.
+        Chunks in `exclude` (already in the prompt) are never picked.
+        """
+        exclude = set(exclude)
+        ranked = [chunk_id for chunk_id, _ in self.search(query, top_k + len(exclude))
+                  if chunk_id not in exclude][:top_k]
+        if not ranked:
+            ranked = [chunk_id for chunk_id in range(len(self.chunks)) if chunk_id not in exclude]
+
+        selected = []
+        used = 0
+        for chunk_id in ranked:
+            cost = self.chunk_tokens[chunk_id]
+            if used + cost > token_budget:
+                continue
+            selected.append(chunk_id)
+            used += cost
+            if len(selected) >= top_k:
+                break
+        return sorted(selected)
+
+    def memory_bytes(self):
+        """Approximate memory held by the chunks and postings"""
+        total = sum(sys.getsizeof(chunk) for chunk in self.chunks)
+        for term, posting in self.postings.items():
+            total += sys.getsizeof(term) + sys.getsizeof(posting) + sum(sys.getsizeof(entry) for entry in posting)
+        return total + sys.getsizeof(self.postings) + sys.getsizeof(self.idf)
+
+    def render(self, chunk_ids):
+        """Join the selected chunks into the text placed in the prompt"""
+        return "\n\n".join(self.chunks[i] for i in chunk_ids)
+
+
+if __name__ == "__main__":
+    # Offline check: python content_index.py content_summary_bcc.txt "what is the GROW model?"
+    if len(sys.argv) < 3:
+        print("Usage: python content_index.py <content_file> <question> [top_k] [token_budget]")
+        sys.exit(1)
+
+    with open(sys.argv[1], "r", encoding="utf-8") as f:
+        index = ContentIndex.from_text(f.read())
+
+    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    budget = int(sys.argv[4]) if len(sys.argv) > 4 else 1500
+    print(f"{len(index.chunks)} chunks, {len(index.postings)} terms, {sum(index.chunk_tokens)} tokens total")
+    for chunk_id, score in index.search(sys.argv[2], top_k):
+        print(f"  chunk {chunk_id}: score={score:.2f} tokens={index.chunk_tokens[chunk_id]}")
+    selected = index.select(sys.argv[2], top_k, budget)
+    print(f"Selected chunks {selected} ({sum(index.chunk_tokens[i] for i in selected)} tokens)")
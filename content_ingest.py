@@ -0,0 +1,247 @@
+# content_ingest.py
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".pptx", ".docx", ".pdf")
+
+# Bump when extraction changes so cached results are rebuilt
+EXTRACTOR_VERSION = "1"
+
+
+def file_hash(path):
+    """sha256 of a file's bytes, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _clean(lines):
+    return "\n".join(line.strip() for line in lines if line and line.strip())
+
+
+def _shape_lines(shape):
+    """Text lines from a slide shape, including tables and grouped shapes"""
+    if getattr(shape, "shapes", None) is not None:
+        for child in shape.shapes:
+            yield from _shape_lines(child)
+    elif getattr(shape, "has_table", False):
+        for row in shape.table.rows:
+            yield " | ".join(cell.text.strip() for cell in row.cells if cell.text.strip())
+    elif getattr(shape, "has_text_frame", False):
+        for paragraph in shape.text_frame.paragraphs:
+            yield "".join(run.text for run in paragraph.runs)
+
+
+def extract_pptx(path):
+    """One record per slide: the title placeholder plus the text of every other shape"""
+    from pptx import Presentation
+
+    records = []
+    for number, slide in enumerate(Presentation(path).slides, start=1):
+        title_shape = slide.shapes.title
+        title = title_shape.text.strip() if title_shape is not None and title_shape.has_text_frame else ""
+        lines = []
+        for shape in slide.shapes:
+            if title_shape is not None and shape.shape_id == title_shape.shape_id:
+                continue
+            lines.extend(_shape_lines(shape))
+        records.append({"slide": number, "title": title, "text": _clean(lines)})
+    return records
+
+
+def extract_docx(path):
+    """Documents have no slides: each heading starts a new section record"""
+    import docx
+
+    records = []
+    title, lines = "", []
+    for paragraph in docx.Document(path).paragraphs:
+        if paragraph.style is not None and paragraph.style.name.startswith("Heading"):
+            if title or _clean(lines):
+                records.append({"slide": len(records) + 1, "title": title, "text": _clean(lines)})
+            title, lines = paragraph.text.strip(), []
+        else:
+            lines.append(paragraph.text)
+    if title or _clean(lines):
+        records.append({"slide": len(records) + 1, "title": title, "text": _clean(lines)})
+    return records
+
+
+def extract_pdf(path):
+    """One record per page; the first non-empty line stands in for the title"""
+    from pypdf import PdfReader
+
+    records = []
+    for number, page in enumerate(PdfReader(path).pages, start=1):
+        lines = [line.strip() for line in (page.extract_text() or "").splitlines() if line.strip()]
+        title = lines[0] if lines else ""
+        records.append({"slide": number, "title": title, "text": _clean(lines[1:])})
+    return records
+
+
+EXTRACTORS = {".pptx": extract_pptx, ".docx": extract_docx, ".pdf": extract_pdf}
+
+
+def extract_file(path):
+    """Extract one file in a worker process; returns (path, records, error)"""
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        return path, EXTRACTORS[extension](path), None
+    except ImportError as e:
+        return path, None, f"missing library for {extension} files ({e.name})"
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+class ExtractionCache:
+    """Extraction results stored as one JSON file per source-file hash"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.directory, f"{digest}-{EXTRACTOR_VERSION}.json")
+
+    def get(self, digest):
+        try:
+            with open(self._path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def set(self, digest, records):
+        path = self._path(digest)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+def find_sources(directory):
+    """Supported files under directory, sorted, skipping Office lock files"""
+    sources = []
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            if filename.startswith("~$") or not filename.lower().endswith(SUPPORTED_EXTENSIONS):
+                continue
+            sources.append(os.path.join(root, filename))
+    return sorted(sources)
+
+
+def ingest(directory, cache_dir, workers=None):
+    """
+    Extract every supported file under directory. Files whose hash is already
+    in the cache are not opened again; the rest are extracted across a process
+    pool. Returns (records, stats).
+    """
+    started = time.perf_counter()
+    cache = ExtractionCache(cache_dir)
+    sources = find_sources(directory)
+
+    results = {}
+    pending = {}
+    for path in sources:
+        digest = file_hash(path)
+        cached = cache.get(digest)
+        if cached is not None:
+            results[path] = cached
+        else:
+            pending[path] = digest
+
+    errors = {}
+    extracted_slides = 0
+    extract_started = time.perf_counter()
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(extract_file, path) for path in pending]
+            for future in as_completed(futures):
+                path, records, error = future.result()
+                if error:
+                    logger.warning("Skipping %s: %s", path, error)
+                    errors[path] = error
+                    continue
+                cache.set(pending[path], records)
+                results[path] = records
+                extracted_slides += len(records)
+    extract_seconds = time.perf_counter() - extract_started
+
+    records = []
+    for path in sources:
+        deck = os.path.relpath(path, directory)
+        for record in results.get(path, []):
+            records.append(dict(record, deck=deck))
+
+    elapsed = time.perf_counter() - started
+    stats = {
+        "files": len(sources),
+        "cached_files": len(sources) - len(pending),
+        "extracted_files": len(pending) - len(errors),
+        "failed_files": len(errors),
+        "slides": len(records),
+        "extracted_slides": extracted_slides,
+        "seconds": round(elapsed, 3),
+        "slides_per_second": round(extracted_slides / extract_seconds, 1) if extracted_slides else 0.0
+    }
+    return records, stats
+
+
+def write_records(records, path):
+    """Write records as JSON lines: {"deck", "slide", "title", "text"}"""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps({key: record[key] for key in ("deck", "slide", "title", "text")},
+                               ensure_ascii=False) + "\n")
+    os.replace(temp_path, path)
+
+
+def read_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def render_records(records):
+    """Program content text: one paragraph per slide, so each slide stays together when chunked"""
+    paragraphs = []
+    for record in records:
+        text = _clean([record.get("title", ""), record.get("text", "")])
+        if text:
+            paragraphs.append(text)
+    return "\n\n".join(paragraphs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract slide text from a directory of decks")
+    parser.add_argument("directory", help="Directory with .pptx, .docx and .pdf files")
+    parser.add_argument("--output", default="content_slides.jsonl", help="Per-slide JSONL output")
+    parser.add_argument("--text", help="Also write the rendered program content text here")
+    parser.add_argument("--cache-dir", default=".ingest_cache", help="Extraction cache directory")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    if not os.path.isdir(args.directory):
+        print(f"Not a directory: {args.directory}")
+        sys.exit(1)
+
+    records, stats = ingest(args.directory, args.cache_dir, args.workers)
+    write_records(records, args.output)
+    if args.text:
+        with open(args.text, "w", encoding="utf-8") as f:
+            f.write(render_records(records))
+
+    print(f"{stats['files']} files ({stats['cached_files']} cached, {stats['extracted_files']} extracted, "
+          f"{stats['failed_files']} failed), {stats['slides']} slides written to {args.output}")
+    print(f"Extracted {stats['extracted_slides']} slides at {stats['slides_per_second']} slides/sec, "
+          f"{stats['seconds']} s total")
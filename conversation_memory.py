@@ -0,0 +1,221 @@
+# conversation_memory.py
+import abc
+import hashlib
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import delete, func, select
+
+from content_index import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """One question and the reply it got, with their combined token count"""
+
+    __slots__ = ("question", "reply", "tokens")
+
+    def __init__(self, question, reply, tokens=None):
+        self.question = question
+        self.reply = reply
+        self.tokens = tokens if tokens is not None else count_tokens(question) + count_tokens(reply)
+
+
+# Words that point back at an earlier turn ("what about that?", "give me an example of it")
+FOLLOW_UP_WORDS = frozenset(
+    "it its it's that this these those they them their he she him her above earlier previous same "
+    "example examples more another else again elaborate expand".split()
+)
+FOLLOW_UP_OPENERS = ("and ", "but ", "so ", "also ", "then ", "or ", "what about", "how about", "what if")
+WORD_RE = re.compile(r"[a-z']+")
+
+
+def is_follow_up(question):
+    """
+    Whether a question probably depends on the turns before it: it refers back
+    ("why is that?"), continues ("and for managers?") or is too short to stand
+    alone ("why?"). Anything else is answered, and cached, as a fresh question.
+    """
+    text = question.strip().lower()
+    words = WORD_RE.findall(text)
+    if len(words) <= 2:
+        return True
+    return text.startswith(FOLLOW_UP_OPENERS) or any(word in FOLLOW_UP_WORDS for word in words)
+
+
+def history_key(turns):
+    """Digest of a conversation's turns, so answers given in context are cached apart from fresh questions"""
+    if not turns:
+        return ""
+    raw = "\x1e".join(f"{turn.question}\x1f{turn.reply}" for turn in turns)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class ConversationStore(abc.ABC):
+    """
+    The last `max_turns` turns per (user, program). Turns older than `idle_ttl`
+    seconds are forgotten, so a question asked after a break starts a new
+    conversation. Questions and replies are clipped to `max_chars` characters.
+    """
+
+    def __init__(self, max_turns=6, idle_ttl=30 * 60, max_chars=2000):
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.max_chars = max_chars
+
+    def _turn(self, question, reply):
+        return Turn(question[:self.max_chars], reply[:self.max_chars])
+
+    @abc.abstractmethod
+    def history(self, user_id, program):
+        """Turns of the current conversation, oldest first"""
+
+    @abc.abstractmethod
+    def append(self, user_id, program, question, reply):
+        """Add a turn to the current conversation, or start a new one"""
+
+
+class MemoryConversationStore(ConversationStore):
+    """
+    Ring buffers in a bounded in-process dict, for a single worker. When more
+    than `max_sessions` conversations are held, the least recently used go first.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_sessions=5000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()  # (user_id, program) -> (deque of turns, last_used)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def history(self, user_id, program):
+        key = (user_id, program)
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None:
+                return []
+            turns, last_used = entry
+            if time.time() - last_used > self.idle_ttl:
+                del self._sessions[key]
+                return []
+            return list(turns)
+
+    def append(self, user_id, program, question, reply):
+        key = (user_id, program)
+        turn = self._turn(question, reply)
+        now = time.time()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or now - entry[1] > self.idle_ttl:
+                turns = deque(maxlen=self.max_turns)
+            else:
+                turns = entry[0]
+            turns.append(turn)
+            self._sessions[key] = (turns, now)
+            self._sessions.move_to_end(key)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+
+    def info(self):
+        with self._lock:
+            sessions = len(self._sessions)
+            turns = sum(len(entry[0]) for entry in self._sessions.values())
+        return {"backend": self.backend, "sessions": sessions, "turns": turns, "evictions": self.evictions,
+                "max_sessions": self.max_sessions, "max_turns": self.max_turns}
+
+
+class SQLConversationStore(ConversationStore):
+    """
+    Turns in the conversation_turns table, shared by all workers. Appending a
+    turn also deletes the conversation's turns beyond `max_turns` and any that
+    went idle, so each user keeps at most `max_turns` rows per program.
+    """
+
+    backend = "sql"
+
+    def __init__(self, session_factory, model, **kwargs):
+        super().__init__(**kwargs)
+        self.session_factory = session_factory
+        self.model = model
+
+    def history(self, user_id, program):
+        ConversationTurn = self.model
+        db = self.session_factory()
+        try:
+            rows = db.execute(
+                select(ConversationTurn.question, ConversationTurn.reply, ConversationTurn.tokens)
+                .where(ConversationTurn.user_id == user_id,
+                       ConversationTurn.program == program,
+                       ConversationTurn.created_at >= time.time() - self.idle_ttl)
+                .order_by(ConversationTurn.id.desc())
+                .limit(self.max_turns)
+            ).all()
+            return [Turn(question, reply, tokens) for question, reply, tokens in reversed(rows)]
+        except Exception as e:
+            logger.error("Conversation history error: %s", str(e))
+            return []
+        finally:
+            db.close()
+
+    def append(self, user_id, program, question, reply):
+        ConversationTurn = self.model
+        turn = self._turn(question, reply)
+        now = time.time()
+        conversation = (ConversationTurn.user_id == user_id, ConversationTurn.program == program)
+        keep = (
+            select(ConversationTurn.id)
+            .where(*conversation)
+            .order_by(ConversationTurn.id.desc())
+            .limit(self.max_turns)
+        )
+        db = self.session_factory()
+        try:
+            db.add(ConversationTurn(user_id=user_id, program=program, question=turn.question,
+                                    reply=turn.reply, tokens=turn.tokens, created_at=now))
+            db.flush()
+            db.execute(
+                delete(ConversationTurn)
+                .where(*conversation)
+                .where((ConversationTurn.id.not_in(keep.scalar_subquery()))
+                       | (ConversationTurn.created_at < now - self.idle_ttl))
+                .execution_options(synchronize_session=False)
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("Conversation store error: %s", str(e))
+        finally:
+            db.close()
+
+    def info(self):
+        ConversationTurn = self.model
+        usage = {}
+        db = self.session_factory()
+        try:
+            turns = db.query(func.count(ConversationTurn.id)).scalar()
+            conversations = select(ConversationTurn.user_id, ConversationTurn.program).distinct().subquery()
+            sessions = db.query(func.count()).select_from(conversations).scalar()
+            usage = {"sessions": sessions, "turns": turns}
+        except Exception as e:
+            logger.error("Conversation stats error: %s", str(e))
+        finally:
+            db.close()
+        return dict(usage, backend=self.backend, max_turns=self.max_turns)
+
+
+def create_conversation_store(backend, session_factory=None, model=None, **kwargs):
+    """Create the configured history backend ('memory', 'sql' or 'none')"""
+    if backend == "none":
+        return None
+    if backend == "sql":
+        # Rows are bounded per conversation; there is no in-process session cap
+        kwargs.pop("max_sessions", None)
+        return SQLConversationStore(session_factory, model, **kwargs)
+    return MemoryConversationStore(**kwargs)
@@ -0,0 +1,118 @@
+# db_metrics.py
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Connection pool and query counters collected from SQLAlchemy events"""
+
+    def __init__(self, slow_query_ms=500):
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connections_opened = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.queries = 0
+        self.query_seconds_total = 0.0
+        self.slow_queries = 0
+        self.pool = None
+        # Optional callback(seconds) for every query, e.g. to count queries per request
+        self.on_query = None
+
+    def record_wait(self, seconds):
+        with self._lock:
+            self.checkout_wait_total += seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, seconds)
+
+    def install(self, engine):
+        """Attach pool and query listeners to an engine"""
+        self.pool = engine.pool
+
+        @event.listens_for(engine.pool, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            with self._lock:
+                self.connections_opened += 1
+
+        @event.listens_for(engine.pool, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            with self._lock:
+                self.checkouts += 1
+                self.checked_out += 1
+                self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+        @event.listens_for(engine.pool, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            with self._lock:
+                self.checked_out = max(0, self.checked_out - 1)
+
+        @event.listens_for(engine, "before_cursor_execute")
+        def before_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine, "after_cursor_execute")
+        def after_execute(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - conn.info["query_started"].pop()
+            with self._lock:
+                self.queries += 1
+                self.query_seconds_total += elapsed
+                slow = elapsed * 1000 >= self.slow_query_ms
+                if slow:
+                    self.slow_queries += 1
+            if self.on_query:
+                self.on_query(elapsed)
+            if slow:
+                logger.warning("Slow query (%.0f ms): %s", elapsed * 1000, " ".join(statement.split())[:500])
+
+        @event.listens_for(engine, "handle_error")
+        def on_error(context):
+            # A failed statement never reaches after_cursor_execute; drop its start time so
+            # the connection doesn't carry it back to the pool. A connection runs one
+            # statement at a time, so none of its statements is still running.
+            if context.connection is not None:
+                context.connection.info.get("query_started", []).clear()
+
+    def to_dict(self):
+        with self._lock:
+            stats = {
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "peak_checked_out": self.peak_checked_out,
+                "connections_opened": self.connections_opened,
+                "checkout_wait_avg_ms": round(self.checkout_wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "checkout_wait_max_ms": round(self.checkout_wait_max * 1000, 3),
+                "queries": self.queries,
+                "query_avg_ms": round(self.query_seconds_total / self.queries * 1000, 3) if self.queries else 0.0,
+                "slow_queries": self.slow_queries,
+                "slow_query_threshold_ms": self.slow_query_ms
+            }
+        if isinstance(self.pool, QueuePool):
+            stats.update({
+                "pool_size": self.pool.size(),
+                "pool_checked_in": self.pool.checkedin(),
+                "pool_overflow": max(0, self.pool.overflow()),
+                "pool_max_overflow": self.pool._max_overflow
+            })
+        return stats
+
+
+def timed_pool_class(metrics):
+    """QueuePool subclass that reports how long each checkout waited for a connection"""
+
+    class TimedQueuePool(QueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                metrics.record_wait(time.perf_counter() - started)
+
+    return TimedQueuePool
@@ -0,0 +1,378 @@
+# faq.py
+"""
+Precomputed answers to common questions, per program and content version.
+
+    python faq.py [--programs BCC,MI] [--propose 20] [--question-log log.csv]
+        [--from-smartsheet] [--log-top 50] [--workers 4] [--rpm 60] [--output-dir faq]
+
+Candidate questions come from three places: the content's own headings, the
+model (asked for --propose likely learner questions per program) and the
+question log (the --log-top most frequent questions, from a CSV/JSONL export
+or straight from the Smartsheet sheet). Near-duplicates are merged, and each
+remaining question is answered with the same prompt as a live /chat. The
+requests run on --workers threads, at most --rpm per minute. Results go to
+<output-dir>/<program>-<content version>.json, so a content change makes the
+file stale rather than wrong. Answers already in the file for this version are
+kept, so a rerun only pays for new questions.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from dotenv import load_dotenv
+
+from answer_cache import normalize_question
+from semantic_cache import HashingEmbedder, negations
+
+logger = logging.getLogger(__name__)
+
+TAG_RE = re.compile(r"^\[([^\]]+)\](\[[^\]]+\])*\s*")
+HEADING_RE = re.compile(r"^\*\s*(.+?)\s*$")
+# "3.", "2)", "IV.", "Step 2:" and similar numbering in front of a heading
+HEADING_NUMBER_RE = re.compile(r"^(?:(?:step|part|module|section)\s+)?(?:\d+|[ivx]+|[a-z])[.):]\s+", re.IGNORECASE)
+HEADING_TRAILING_RE = re.compile(r"[\s.:;,!\-\u2013\u2014\u2026]+$")
+QUESTION_WORDS = frozenset("what how why when where who which".split())
+# Headings that contain or end on one of these read as the start of a sentence, not a topic
+# ("Feedback is", "Coaching Can Take Many Forms", "Cultural Humility Promotes...")
+NON_TOPIC_WORDS = frozenset("""
+is are was were be can could will would should must may might do does means mean promotes includes
+""".split())
+DANGLING_WORDS = frozenset("a an and or the of to for with in on by".split())
+HEADING_TOPIC_WORDS = 6
+
+
+class FaqTier:
+    """
+    Loads the FAQ files in a directory and answers a question when it matches a
+    canonical question of the program's current content version: exactly
+    (after normalizing) or with an embedding similarity of at least `threshold`
+    and the same negations ("not", "never", ...).
+    """
+
+    def __init__(self, directory, threshold=0.85, aliases=None):
+        self.directory = directory
+        self.threshold = threshold
+        self.embedder = HashingEmbedder(aliases=aliases)
+        # (program, content version) -> (normalized question -> answer, vectors, answers, negations)
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    def load(self):
+        entries = {}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                if not name.endswith(".json"):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), "r", encoding="utf-8") as f:
+                        faq = json.load(f)
+                    pairs = [(item["question"], item["answer"]) for item in faq["entries"]]
+                    key = (faq["program"], faq["content_version"])
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error("Could not load FAQ file %s: %s", name, str(e))
+                    continue
+                exact = {normalize_question(question): answer for question, answer in pairs}
+                vectors = np.array([self.embedder.embed(question) for question, _ in pairs], dtype=np.float32)
+                entries[key] = (exact, vectors.reshape(len(pairs), self.embedder.dim),
+                                [answer for _, answer in pairs], [negations(question) for question, _ in pairs])
+        with self._lock:
+            self._entries = entries
+        logger.info("Loaded %d FAQ answers for %d program versions",
+                    sum(len(entry[2]) for entry in entries.values()), len(entries))
+
+    def get(self, program, content_version, question):
+        entry = self._entries.get((program, content_version))
+        answer = None
+        if entry:
+            exact, vectors, answers, negated = entry
+            answer = exact.get(normalize_question(question))
+            if answer is None and len(answers):
+                scores = vectors @ self.embedder.embed(question)
+                question_negations = negations(question)
+                for i, entry_negations in enumerate(negated):
+                    if entry_negations != question_negations:
+                        scores[i] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    answer = answers[best]
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                    "programs": len(self._entries),
+                    "answers": sum(len(entry[2]) for entry in self._entries.values())}
+
+
+def faq_path(directory, program, content_version):
+    return os.path.join(directory, f"{program}-{content_version}.json")
+
+
+def read_question_log(path, fields=()):
+    """
+    (program or None, question) pairs from a JSONL or CSV export; a leading
+    "[BCC]" tag gives the program. Any extra `fields` are appended to each tuple.
+    """
+    pairs = []
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            records = csv.DictReader(f)
+        else:
+            records = (json.loads(line) for line in f if line.strip())
+        for record in records:
+            question = (record.get("question") or record.get("Question") or "").strip()
+            program = record.get("program") or record.get("Program")
+            tag = TAG_RE.match(question)
+            if tag:
+                program = program or tag.group(1)
+                question = question[tag.end():]
+            if question:
+                pairs.append((program, question) + tuple(record.get(field) for field in fields))
+    return pairs
+
+
+def smartsheet_questions(access_token, sheet_id, column_id):
+    """(program, question) pairs from the question column of the chat log sheet"""
+    import smartsheet
+    client = smartsheet.Smartsheet(access_token)
+    client.errors_as_exceptions(True)
+    sheet = client.Sheets.get_sheet(int(sheet_id), column_ids=[int(column_id)])
+    pairs = []
+    for row in sheet.rows:
+        for cell in row.cells:
+            if cell.column_id == int(column_id) and cell.value:
+                tag = TAG_RE.match(str(cell.value))
+                if tag:
+                    pairs.append((tag.group(1), str(cell.value)[tag.end():].strip()))
+    return pairs
+
+
+def heading_topic(heading):
+    """
+    The topic a heading names, with numbering and trailing punctuation removed,
+    or None when the heading reads as a sentence rather than a topic
+    """
+    heading = HEADING_NUMBER_RE.sub("", heading)
+    # "Feedback Steps: How the coach can elicit feedback" -> "Feedback Steps"
+    heading = HEADING_TRAILING_RE.sub("", heading.split(": ", 1)[0])
+    words = heading.split()
+    if not 0 < len(words) <= HEADING_TOPIC_WORDS:
+        return None
+    lowered = [word.lower().strip("()") for word in words]
+    if lowered[0] in QUESTION_WORDS or lowered[-1] in DANGLING_WORDS:
+        return None
+    if any(word in NON_TOPIC_WORDS for word in lowered):
+        return None
+    # A full stop or exclamation inside ("Slow down. Listen first") is a sentence; "vs." is fine
+    if re.search(r"[.!]", re.sub(r"\bvs\.", "vs", heading)):
+        return None
+    return heading
+
+
+def heading_questions(text):
+    """Questions from the content's "*Heading" lines; topic headings become "What does the program say about ...?" """
+    questions = []
+    for line in text.splitlines():
+        match = HEADING_RE.match(line)
+        if not match:
+            continue
+        heading = HEADING_NUMBER_RE.sub("", match.group(1)).strip()
+        if heading.endswith("?"):
+            questions.append(heading)
+            continue
+        topic = heading_topic(heading)
+        if topic:
+            questions.append(f"What does the program say about {topic}?")
+    return questions
+
+
+def propose_questions(llm_client, program, snapshot, count):
+    """Ask the model for likely learner questions that the content answers"""
+    if count <= 0:
+        return []
+    messages = [
+        {"role": "system", "content": f"You write study questions for the {program.name} program. "
+                                      f"Use only this content:\n\n{snapshot.content}"},
+        {"role": "user", "content": f"List {count} distinct questions a learner is likely to ask that this "
+                                    f"content answers. One question per line, no numbering."}
+    ]
+    completion = llm_client.complete(program.model, messages, max_tokens=40 * count)
+    questions = []
+    for line in completion.text.splitlines():
+        line = re.sub(r"^\s*(\d+[.)]|[-*])\s*", "", line).strip()
+        if line.endswith("?"):
+            questions.append(line)
+    return questions[:count]
+
+
+def merge_questions(questions, embedder, threshold):
+    """Drop exact and near-duplicate questions, keeping the first of each"""
+    kept = []
+    seen = set()
+    vectors = {}  # negations -> vectors of the kept questions with them
+    for question in questions:
+        normalized = normalize_question(question)
+        if not normalized or normalized in seen:
+            continue
+        vector = embedder.embed(question)
+        # "When not to use X" is a different question from "when to use X"
+        same_negations = vectors.setdefault(negations(question), [])
+        if same_negations and float(np.max(np.array(same_negations) @ vector)) >= threshold:
+            continue
+        seen.add(normalized)
+        same_negations.append(vector)
+        kept.append(question)
+    return kept
+
+
+class RateLimit:
+    """Spaces calls at least 60/rpm seconds apart, across threads"""
+
+    def __init__(self, rpm):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def answer_questions(llm_client, prompt_builder, usage, program, snapshot, questions, workers, rate_limit):
+    """Answer questions in parallel; returns ({question: answer}, failed questions)"""
+    def answer(question):
+        rate_limit.wait()
+        prompt = prompt_builder.build(program, snapshot, question)
+        try:
+            completion = llm_client.complete(program.model, prompt.messages, prompt.max_output_tokens)
+        except Exception as e:
+            logger.warning("No answer for %r: %s", question, str(e))
+            return question, None
+        usage.record(program.code, program.model, completion.usage.get("prompt_tokens", prompt.input_tokens),
+                      completion.usage.get("completion_tokens", 0), estimated_input_tokens=prompt.input_tokens)
+        return question, completion.text.strip()
+
+    answers = {}
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for question, text in pool.map(answer, questions):
+            if text:
+                answers[question] = text
+            else:
+                failed.append(question)
+    return answers, failed
+
+
+def build_program(program, llm_client, prompt_builder, usage, args, logged_questions):
+    snapshot = program.snapshot
+    path = faq_path(args.output_dir, program.code, snapshot.version)
+    existing = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            existing = {item["question"]: item["answer"] for item in json.load(f)["entries"]}
+
+    candidates = heading_questions(snapshot.content)
+    candidates += propose_questions(llm_client, program, snapshot, args.propose)
+    counts = Counter(question for code, question in logged_questions if code == program.code)
+    candidates += [question for question, _ in counts.most_common(args.log_top)]
+    embedder = HashingEmbedder(aliases={program.code.lower(): program.name.lower()})
+    questions = merge_questions(list(existing) + candidates, embedder, args.merge_threshold)
+
+    pending = [question for question in questions if question not in existing]
+    answers, failed = answer_questions(llm_client, prompt_builder, usage, program, snapshot, pending,
+                                       args.workers, RateLimit(args.rpm))
+    answers.update(existing)
+
+    entries = [{"question": question, "answer": answers[question]} for question in questions if question in answers]
+    os.makedirs(args.output_dir, exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump({"program": program.code, "content_version": snapshot.version, "model": program.model,
+                   "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "entries": entries},
+                  f, ensure_ascii=False, indent=1)
+    os.replace(temp_path, path)
+    return {"program": program.code, "file": path, "questions": len(questions), "reused": len(existing),
+            "answered": len(answers) - len(existing), "failed": len(failed)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--manifest", default=os.getenv("PROGRAMS_MANIFEST", "programs.json"))
+    parser.add_argument("--programs", help="Comma-separated program codes (default: all enabled)")
+    parser.add_argument("--output-dir", default=os.getenv("FAQ_DIR", "faq"))
+    parser.add_argument("--propose", type=int, default=20, help="Questions to ask the model for per program")
+    parser.add_argument("--question-log", help="CSV or JSONL export of asked questions")
+    parser.add_argument("--from-smartsheet", action="store_true",
+                        help="Read asked questions from the Smartsheet chat log (SMARTSHEET_* settings)")
+    parser.add_argument("--log-top", type=int, default=50, help="Most frequent logged questions to include")
+    parser.add_argument("--merge-threshold", type=float, default=0.85,
+                        help="Similarity above which candidate questions count as duplicates")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent model requests")
+    parser.add_argument("--rpm", type=float, default=60, help="Model requests per minute (0: unlimited)")
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+
+    from llm_client import create_llm_client
+    from program_registry import ProgramRegistry
+    from prompt_builder import PromptBuilder, UsageTracker, parse_prices
+
+    programs = ProgramRegistry.from_manifest(args.manifest, settings={"model": os.getenv("OPENAI_MODEL"),
+                                                                      "token_budget": os.getenv("CHAT_CONTEXT_TOKEN_BUDGET"),
+                                                                      "top_k": os.getenv("CHAT_CONTEXT_TOP_K")})
+    codes = args.programs.split(",") if args.programs else [program.code for program in programs]
+    llm_client = create_llm_client(os.getenv("LLM_BACKEND", "openai"), api_key=os.getenv("OPENAI_API_KEY"),
+                                   timeout=float(os.getenv("LLM_TIMEOUT", 60)),
+                                   max_workers=args.workers)
+    prompt_builder = PromptBuilder(input_budget=int(os.getenv("CHAT_INPUT_TOKEN_BUDGET", 3000)),
+                                   max_output_tokens=int(os.getenv("CHAT_MAX_OUTPUT_TOKENS", 500)),
+                                   prefix_content_tokens=int(os.getenv("CHAT_PREFIX_CONTENT_TOKENS", 0)))
+    usage = UsageTracker(prices=parse_prices(os.getenv("LLM_PRICES")))
+
+    logged_questions = []
+    if args.question_log:
+        logged_questions += read_question_log(args.question_log)
+    if args.from_smartsheet:
+        logged_questions += smartsheet_questions(os.getenv("SMARTSHEET_ACCESS_TOKEN"), os.getenv("SMARTSHEET_SHEET_ID"),
+                                                 os.getenv("SMARTSHEET_QUESTION_COLUMN"))
+
+    started = time.perf_counter()
+    for code in codes:
+        program = programs.get(code)
+        if program is None:
+            print(f"Unknown program: {code}")
+            sys.exit(1)
+        result = build_program(program, llm_client, prompt_builder, usage, args, logged_questions)
+        print(f"{result['program']}: {result['questions']} questions ({result['reused']} reused, "
+              f"{result['answered']} answered, {result['failed']} failed) -> {result['file']}")
+    total = usage.to_dict()["total"]
+    print(f"Done in {time.perf_counter() - started:.1f} s; {total['requests']} model calls, "
+          f"${total['cost_usd']:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,619 @@
+# llm_client.py
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+# openai 0.28 error classes worth retrying (matched by name so openai is only imported by its backend)
+RETRYABLE_ERRORS = frozenset(["Timeout", "APIConnectionError", "RateLimitError", "ServiceUnavailableError", "TryAgain"])
+
+
+class LLMUnavailable(Exception):
+    """The model could not be reached: retries exhausted, deadline passed or circuit open"""
+
+
+class LLMTimeout(TimeoutError):
+    """A single attempt ran past the request deadline"""
+
+
+def is_retryable(error):
+    """True for rate limiting (429), server errors (5xx), timeouts and connection failures"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    return type(error).__name__ in RETRYABLE_ERRORS
+
+
+def parse_hedge_after(value):
+    """LLM_HEDGE_AFTER setting: empty disables hedging, 'p95' tracks recent latency, else seconds"""
+    if not value:
+        return None
+    return value if value == "p95" else float(value)
+
+
+class Completion:
+    """A finished reply and the provider's token usage (empty when not reported)"""
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage = usage or {}
+
+
+class OpenAIBackend:
+    """ChatCompletion calls sharing one pooled HTTP session, so connections are reused across requests"""
+
+    name = "openai"
+
+    def __init__(self, api_key=None, pool_size=20):
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self._openai = None
+        self._lock = threading.Lock()
+        self._aiosessions = {}  # event loop -> aiohttp session
+
+    @property
+    def openai(self):
+        """The openai module with the pooled session installed, imported on first use (it is slow to import)"""
+        if self._openai is None:
+            with self._lock:
+                if self._openai is None:
+                    self._openai = self._setup()
+        return self._openai
+
+    def _setup(self):
+        import openai
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if self.api_key:
+            openai.api_key = self.api_key
+        session = requests.Session()
+        # No transport-level retries: LLMClient decides what to retry within the deadline
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        openai.requestssession = session
+        return openai
+
+    def warm_up(self):
+        return self.openai is not None
+
+    def _aiosession(self):
+        """One pooled aiohttp session per event loop (openai otherwise opens one per request)"""
+        import aiohttp
+
+        loop = asyncio.get_running_loop()
+        session = self._aiosessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size))
+            self._aiosessions[loop] = session
+        return session
+
+    def complete(self, model, messages, max_tokens, timeout):
+        response = self.openai.ChatCompletion.create(
+            model=model, messages=messages, max_tokens=max_tokens, request_timeout=timeout)
+        return Completion(response['choices'][0]['message']['content'], response.get('usage'))
+
+    async def acomplete(self, model, messages, max_tokens, timeout):
+        token = self.openai.aiosession.set(self._aiosession())
+        try:
+            response = await self.openai.ChatCompletion.acreate(
+                model=model, messages=messages, max_tokens=max_tokens, request_timeout=timeout)
+        finally:
+            self.openai.aiosession.reset(token)
+        return Completion(response['choices'][0]['message']['content'], response.get('usage'))
+
+    def stream(self, model, messages, max_tokens, timeout):
+        response = self.openai.ChatCompletion.create(
+            model=model, messages=messages, max_tokens=max_tokens, stream=True, request_timeout=timeout)
+        try:
+            for chunk in response:
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+
+    async def astream(self, model, messages, max_tokens, timeout):
+        token = self.openai.aiosession.set(self._aiosession())
+        try:
+            response = await self.openai.ChatCompletion.acreate(
+                model=model, messages=messages, max_tokens=max_tokens, stream=True, request_timeout=timeout)
+        finally:
+            # The session is only read when the request is opened
+            self.openai.aiosession.reset(token)
+        try:
+            async for chunk in response:
+                delta = chunk['choices'][0].get('delta', {}).get('content')
+                if delta:
+                    yield delta
+        finally:
+            if hasattr(response, 'aclose'):
+                await response.aclose()
+
+
+class FakeApiError(Exception):
+    """Error raised by FakeBackend, shaped like an HTTP error"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Fake LLM error {status_code}")
+        self.status_code = status_code
+
+
+class FakeBackend:
+    """
+    Offline stand-in for the model. latency (plus up to jitter) delays each call,
+    fail_times makes the next N calls fail with fail_status, error_rate makes
+    any call fail with that probability, and streams send the reply a few
+    words at a time.
+    """
+
+    name = "fake"
+
+    def __init__(self, reply="This is a placeholder answer from the offline model.",
+                 latency=0.0, jitter=0.0, fail_times=0, fail_status=503, error_rate=0.0, stream_words=3):
+        self.reply = reply
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_times = fail_times
+        self.fail_status = fail_status
+        self.error_rate = error_rate
+        self.stream_words = stream_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _next_call(self):
+        """Count a call; returns (delay, fail)"""
+        with self._lock:
+            self.calls += 1
+            fail = self.fail_times > 0
+            if fail:
+                self.fail_times -= 1
+        fail = fail or (self.error_rate and random.random() < self.error_rate)
+        return self.latency + random.uniform(0, self.jitter), fail
+
+    def warm_up(self):
+        return True
+
+    def _call(self, timeout):
+        delay, fail = self._next_call()
+        # Like a real request timeout: give up once the call has taken `timeout`
+        if delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"Fake LLM call took longer than {timeout:.1f} s")
+        if delay:
+            time.sleep(delay)
+        if fail:
+            raise FakeApiError(self.fail_status)
+
+    def _completion(self, messages):
+        return Completion(self.reply, {"prompt_tokens": sum(len(m["content"]) // 4 for m in messages),
+                                       "completion_tokens": len(self.reply.split())})
+
+    def complete(self, model, messages, max_tokens, timeout):
+        self._call(timeout)
+        return self._completion(messages)
+
+    async def _acall(self, timeout):
+        delay, fail = self._next_call()
+        if delay > timeout:
+            await asyncio.sleep(timeout)
+            raise TimeoutError(f"Fake LLM call took longer than {timeout:.1f} s")
+        if delay:
+            await asyncio.sleep(delay)
+        if fail:
+            raise FakeApiError(self.fail_status)
+
+    async def acomplete(self, model, messages, max_tokens, timeout):
+        await self._acall(timeout)
+        return self._completion(messages)
+
+    def _deltas(self):
+        words = self.reply.split(" ")
+        return [" ".join(words[i:i + self.stream_words]) + " " for i in range(0, len(words), self.stream_words)]
+
+    def stream(self, model, messages, max_tokens, timeout):
+        self._call(timeout)
+        yield from self._deltas()
+
+    async def astream(self, model, messages, max_tokens, timeout):
+        await self._acall(timeout)
+        for delta in self._deltas():
+            yield delta
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failed calls and rejects calls
+    for reset_timeout seconds, then lets one probe call through (half open):
+    success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.opens = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    self.opens += 1
+                    logger.warning("LLM circuit opened after %d consecutive failures", self.failures)
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+
+class LatencyTracker:
+    """Recent call latencies for picking the hedge delay"""
+
+    def __init__(self, size=200, min_samples=20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction):
+        """The given percentile of recent latencies, or None until min_samples calls were seen"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < self.min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class LLMClient:
+    """
+    Model calls with a per-request deadline, jittered retries on retryable
+    errors and a circuit breaker. hedge_after sends a second identical request
+    when the first hasn't answered in time ("p95" for the recent p95 latency,
+    or a number of seconds) and uses whichever answers first. Streams are only
+    retried before their first chunk and are never hedged.
+
+    An attempt that isn't hedged calls the backend on the caller's thread, and
+    the backend's request timeout enforces the deadline. Hedged attempts run on
+    a pool of max_workers threads; their deadline starts when a worker picks
+    the request up, so time spent queued for a worker is not counted as the
+    model being slow.
+    """
+
+    def __init__(self, backend, timeout=30, max_retries=2, backoff_base=0.5,
+                 hedge_after=None, breaker=None, max_workers=32):
+        self.backend = backend
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.hedge_after = hedge_after
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="llm")
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "timeouts": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "failures": 0,
+            "short_circuited": 0
+        }
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _hedge_delay(self):
+        if self.hedge_after == "p95":
+            return self.latency.percentile(0.95)
+        return self.hedge_after
+
+    def _backoff_delay(self, attempt, deadline):
+        """Jittered delay before the next attempt, or None when that would pass the deadline"""
+        delay = self.backoff_base * (2 ** attempt)
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        if time.monotonic() + delay >= deadline:
+            return None
+        self._count("retries")
+        return delay
+
+    def _backoff(self, attempt, deadline):
+        """Sleep before the next attempt; returns False when that would pass the deadline"""
+        delay = self._backoff_delay(attempt, deadline)
+        if delay is None:
+            return False
+        time.sleep(delay)
+        return True
+
+    def _pooled(self, picked_up, model, messages, max_tokens, timeout):
+        picked_up.set()
+        return self.backend.complete(model, messages, max_tokens, timeout)
+
+    def _attempt(self, model, messages, max_tokens, timeout):
+        """One attempt, possibly hedged; the first successful answer wins"""
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None or hedge_delay >= timeout:
+            started = time.monotonic()
+            try:
+                completion = self.backend.complete(model, messages, max_tokens, timeout)
+            except Exception as e:
+                if isinstance(e, TimeoutError) or type(e).__name__ == "Timeout":
+                    self._count("timeouts")
+                raise
+            self.latency.record(time.monotonic() - started)
+            return completion
+
+        picked_up = threading.Event()
+        primary = self._executor.submit(self._pooled, picked_up, model, messages, max_tokens, timeout)
+        picked_up.wait()
+        started = time.monotonic()
+        deadline = started + timeout
+        pending = {primary}
+
+        done, _ = wait(pending, timeout=hedge_delay)
+        if not done:
+            self._count("hedged")
+            pending.add(self._executor.submit(
+                self._pooled, threading.Event(), model, messages, max_tokens, deadline - time.monotonic()))
+
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        self._count("hedge_wins")
+                    self.latency.record(time.monotonic() - started)
+                    return future.result()
+                error = future.exception()
+        if pending or error is None:
+            self._count("timeouts")
+            raise LLMTimeout(f"No answer within {timeout:.1f} s")
+        raise error
+
+    def complete(self, model, messages, max_tokens):
+        """Return a Completion, or raise LLMUnavailable"""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailable("Circuit open")
+        self._count("calls")
+        deadline = time.monotonic() + self.timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                completion = self._attempt(model, messages, max_tokens, remaining)
+            except Exception as e:
+                if not is_retryable(e):
+                    # A bad request, not an outage: don't trip the breaker
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                logger.warning("LLM attempt %d failed: %s", attempt + 1, str(e))
+                if attempt == self.max_retries or not self._backoff(attempt, deadline):
+                    break
+                continue
+            self.breaker.record_success()
+            return completion
+
+        self._count("failures")
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"Model unavailable: {last_error}") from last_error
+
+    async def _aattempt(self, model, messages, max_tokens, timeout):
+        """Async version of _attempt; the losing hedged request is cancelled"""
+        started = time.monotonic()
+        deadline = started + timeout
+        primary = asyncio.ensure_future(self.backend.acomplete(model, messages, max_tokens, timeout))
+        pending = {primary}
+        try:
+            hedge_delay = self._hedge_delay()
+            if hedge_delay is not None and hedge_delay < timeout:
+                done, _ = await asyncio.wait(pending, timeout=hedge_delay)
+                if not done:
+                    self._count("hedged")
+                    pending.add(asyncio.ensure_future(
+                        self.backend.acomplete(model, messages, max_tokens, deadline - time.monotonic())))
+
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=max(0, deadline - time.monotonic()),
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self._count("hedge_wins")
+                        self.latency.record(time.monotonic() - started)
+                        return task.result()
+                    error = task.exception()
+            if pending or error is None:
+                self._count("timeouts")
+                raise LLMTimeout(f"No answer within {timeout:.1f} s")
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def acomplete(self, model, messages, max_tokens):
+        """Async version of complete, for the ASGI app: waits without holding a thread"""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailable("Circuit open")
+        self._count("calls")
+        deadline = time.monotonic() + self.timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                completion = await self._aattempt(model, messages, max_tokens, remaining)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                logger.warning("LLM attempt %d failed: %s", attempt + 1, str(e))
+                delay = None if attempt == self.max_retries else self._backoff_delay(attempt, deadline)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return completion
+
+        self._count("failures")
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"Model unavailable: {last_error}") from last_error
+
+    def stream(self, model, messages, max_tokens):
+        """Return an iterator of reply text deltas, or raise LLMUnavailable"""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailable("Circuit open")
+        self._count("calls")
+        deadline = time.monotonic() + self.timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.monotonic()
+            deltas = self.backend.stream(model, messages, max_tokens, remaining)
+            try:
+                # Retrying is only safe until text has reached the user
+                first = next(deltas, None)
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                logger.warning("LLM stream attempt %d failed: %s", attempt + 1, str(e))
+                if attempt == self.max_retries or not self._backoff(attempt, deadline):
+                    break
+                continue
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            return self._relay(first, deltas)
+
+        self._count("failures")
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"Model unavailable: {last_error}") from last_error
+
+    def _relay(self, first, deltas):
+        try:
+            if first is not None:
+                yield first
+            yield from deltas
+        finally:
+            deltas.close()
+
+    async def astream(self, model, messages, max_tokens):
+        """Async version of stream: returns an async iterator of reply text deltas, or raises LLMUnavailable"""
+        if not self.breaker.allow():
+            self._count("short_circuited")
+            raise LLMUnavailable("Circuit open")
+        self._count("calls")
+        deadline = time.monotonic() + self.timeout
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            started = time.monotonic()
+            deltas = self.backend.astream(model, messages, max_tokens, remaining)
+            try:
+                first = await deltas.__anext__()
+            except StopAsyncIteration:
+                first = None
+            except Exception as e:
+                if not is_retryable(e):
+                    self.breaker.record_success()
+                    raise
+                last_error = e
+                logger.warning("LLM stream attempt %d failed: %s", attempt + 1, str(e))
+                delay = None if attempt == self.max_retries else self._backoff_delay(attempt, deadline)
+                if delay is None:
+                    break
+                await asyncio.sleep(delay)
+                continue
+            self.latency.record(time.monotonic() - started)
+            self.breaker.record_success()
+            return self._arelay(first, deltas)
+
+        self._count("failures")
+        self.breaker.record_failure()
+        raise LLMUnavailable(f"Model unavailable: {last_error}") from last_error
+
+    async def _arelay(self, first, deltas):
+        try:
+            if first is not None:
+                yield first
+            async for delta in deltas:
+                yield delta
+        finally:
+            await deltas.aclose()
+
+    def warm_up(self):
+        """Load the backend's libraries and connection pool ahead of the first request"""
+        return self.backend.warm_up()
+
+    def info(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        p95 = self.latency.percentile(0.95)
+        return dict(stats, backend=self.backend.name, breaker=self.breaker.state,
+                    breaker_opens=self.breaker.opens, timeout=self.timeout,
+                    hedge_after=self.hedge_after, p95_seconds=round(p95, 4) if p95 is not None else None)
+
+
+def create_llm_client(backend, api_key=None, pool_size=20, fake_latency=0.0, fake_error_rate=0.0, **kwargs):
+    """Create the client for the configured backend ('openai' or 'fake')"""
+    if backend == "fake":
+        return LLMClient(FakeBackend(latency=fake_latency, error_rate=fake_error_rate), **kwargs)
+    return LLMClient(OpenAIBackend(api_key=api_key, pool_size=pool_size), **kwargs)
@@ -0,0 +1,197 @@
+# log_config.py
+import atexit
+import contextvars
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import uuid
+
+# Id of the request being handled, attached to every record logged while it runs
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+_listener = None
+_handler = None
+_output = None
+_lock = threading.Lock()
+
+
+def new_request_id(incoming=None):
+    """Reuse a sane incoming X-Request-ID (from a proxy), else make one"""
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request id, in the thread that logged them"""
+
+    def filter(self, record):
+        # Records drained from the queue at shutdown were stamped when they were logged
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message, request id and any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc)
+            .isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record):
+        if getattr(record, "request_id", None) is None:
+            record.request_id = "-"
+        return super().format(record)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts records on a bounded queue and returns. When the listener falls behind
+    and the queue is full, records are dropped and counted instead of blocking
+    the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments into the message here; the listener thread
+        # does the formatting. The exception traceback is rendered now, while
+        # its frames still exist.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class DrainingQueueListener(logging.handlers.QueueListener):
+    """
+    A QueueListener whose stop() waits for room for its stop sentinel instead
+    of raising queue.Full, so a full queue is still written out on shutdown.
+    """
+
+    def stop(self, timeout=None):
+        """Write out what is queued and stop the thread; False if it didn't finish within `timeout` seconds"""
+        if self._thread is None:
+            return True
+        timeout = timeout if timeout is not None else float(os.getenv("LOG_STOP_TIMEOUT", 10))
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            self._thread = None
+            return False
+        self._thread.join(timeout)
+        finished = not self._thread.is_alive()
+        self._thread = None
+        return finished
+
+
+def configure_logging(level=None, fmt=None, stream=None, queue_size=None):
+    """
+    Send all logging through a queue drained by a background listener thread,
+    so writing log lines never happens on a request thread.
+
+    level (LOG_LEVEL, default INFO), fmt 'json' or 'text' (LOG_FORMAT, default
+    json) and queue_size (LOG_QUEUE_SIZE, default 10000) come from the
+    environment when not given. Calling it again replaces the previous setup.
+    """
+    global _listener, _handler, _output
+    level = (level or os.getenv("LOG_LEVEL", "INFO")).upper()
+    fmt = (fmt or os.getenv("LOG_FORMAT", "json")).lower()
+    queue_size = int(queue_size if queue_size is not None else os.getenv("LOG_QUEUE_SIZE", 10000))
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(RequestIdFilter())
+    listener = DrainingQueueListener(handler.queue, output, respect_handler_level=False)
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(handler)
+        root.setLevel(level)
+        listener.start()
+        _listener, _handler, _output = listener, handler, output
+    return listener
+
+
+def stop_logging(timeout=None):
+    """
+    Write out the queued records and stop the listener thread. Records logged
+    afterwards (e.g. by other atexit hooks) are written directly.
+    """
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        root = logging.getLogger()
+        if _handler in root.handlers:
+            root.removeHandler(_handler)
+            _output.addFilter(RequestIdFilter())
+            root.addHandler(_output)
+        if not _listener.stop(timeout):
+            sys.stderr.write(f"Logging listener did not finish; {_handler.queue.qsize()} records not written\n")
+        _listener = None
+
+
+def _restart_after_fork():
+    """A forked worker (gunicorn --preload) has the queue but not the listener thread; start its own"""
+    if _listener is not None:
+        _listener._thread = None
+        _listener.start()
+
+
+def log_stats():
+    if _handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _handler.queue.qsize(), "dropped": _handler.dropped}
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
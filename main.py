@@ -1,62 +1,192 @@
-import openai
 import os
 import datetime
-import smartsheet
 import csv
 import io
-import threading
+import json
+import shutil
+import tempfile
+import zlib
+import atexit
 import logging
+import threading
+import time
+from collections import deque
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, render_template, redirect, url_for, make_response, Response, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, Response, session, stream_with_context, g
 from functools import wraps
+from sqlalchemy import select, or_, tuple_
 import re
-from models import User, get_db, close_db
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+from models import User, CachedAnswer, InflightRequest, ChatQuota, ConversationTurn, engine, init_db, session_factory, get_db, remove_db, pool_metrics
+from program_registry import ProgramRegistry, ContentWatcher
+from answer_cache import create_answer_cache, make_key
+from single_flight import SingleFlight, DatabaseFlightLock
+from smartsheet_writer import SmartsheetWriter, StubSmartsheetClient
+from rate_limiter import create_rate_limiter, parse_limits
+from prompt_builder import PromptBuilder, UsageTracker, parse_prices
+from content_index import count_tokens
+from llm_client import create_llm_client, parse_hedge_after, CircuitBreaker, LLMUnavailable
+from request_metrics import RequestMetrics, SamplingProfiler, ProfileStore, flatten
+from log_config import configure_logging, log_stats, new_request_id, request_id_var
+from conversation_memory import create_conversation_store, history_key, is_follow_up
+from semantic_cache import SemanticCache, program_aliases
+from faq import FaqTier
+from bulk_users import MAX_CHUNK_SIZE, BulkUsers
 
 # Load environment variables
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Logging goes through a queue to a background thread (LOG_LEVEL, LOG_FORMAT=json|text)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # Initialize Flask application
 app = Flask(__name__)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_key")  # Add a secret key for session management
 
-# Program content dictionaries
-program_content = {}
-program_names = {
-    "BCC": "Building Coaching Competency",
-    "MI": "Motivational Interviewing",
-    "Safety": "Safety and Risk Assessment"
-}
-
-# Load content summaries for each program
-def load_program_content():
-    # BCC content
-    try:
-        with open("content_summary_bcc.txt", "r", encoding="utf-8") as f:
-            program_content["BCC"] = f.read()
-    except FileNotFoundError:
-        program_content["BCC"] = "BCC content not available"
-    
-    # MI content
-    try:
-        with open("content_summary_mi.txt", "r", encoding="utf-8") as f:
-            program_content["MI"] = f.read()
-    except FileNotFoundError:
-        program_content["MI"] = "MI content not available"
-    
-    # Safety content
-    try:
-        with open("content_summary_safety.txt", "r", encoding="utf-8") as f:
-            program_content["Safety"] = f.read()
-    except FileNotFoundError:
-        program_content["Safety"] = "Safety content not available"
+# Request-scoped database sessions: whatever a route opened is closed when the request ends
+app.teardown_appcontext(remove_db)
+
+# Every log line of a request carries its id; a proxy's X-Request-ID is reused
+@app.before_request
+def set_request_id():
+    g.request_id = new_request_id(request.headers.get("X-Request-ID"))
+    g.request_id_token = request_id_var.set(g.request_id)
+
+@app.after_request
+def add_request_id_header(response):
+    if 'request_id' in g:
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
+@app.teardown_request
+def reset_request_id(exc):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
 
-# Initialize program content
-load_program_content()
+# Learning programs, loaded from the manifest. Environment settings apply to
+# every program that doesn't set its own value in the manifest.
+programs = ProgramRegistry.from_manifest(
+    os.getenv("PROGRAMS_MANIFEST", "programs.json"),
+    settings={
+        "model": os.getenv("OPENAI_MODEL"),
+        "token_budget": os.getenv("CHAT_CONTEXT_TOKEN_BUDGET"),
+        "top_k": os.getenv("CHAT_CONTEXT_TOP_K"),
+        "quota": os.getenv("CHAT_QUOTA_PER_DAY")
+    }
+)
+DEFAULT_PROGRAM = os.getenv("DEFAULT_PROGRAM", "BCC")
+
+# Content is loaded lazily on first use; preload it when workers are forked from
+# this process (gunicorn --preload) so they share one copy. serve.py's uvicorn workers
+# are started as new processes, so there it only moves the loading to startup
+if os.getenv("PRELOAD_PROGRAM_CONTENT", "false").lower() == "true":
+    programs.preload()
+
+# Poll content files and swap in rebuilt snapshots when they change (0 disables)
+content_watcher = ContentWatcher(programs, interval=float(os.getenv("CONTENT_RELOAD_INTERVAL", 30)))
+
+@app.before_request
+def start_content_watcher():
+    content_watcher.ensure_started()
+
+def program_for_code(code):
+    """The program for a code, falling back to the default for unknown codes"""
+    return programs.get(code) or programs.get(DEFAULT_PROGRAM)
+
+def current_program_for_session():
+    return program_for_code(session.get('current_program'))
+
+# Answer cache for repeated questions (backend: memory, sql or none)
+answer_cache = create_answer_cache(
+    os.getenv("ANSWER_CACHE_BACKEND", "memory"),
+    max_bytes=int(os.getenv("ANSWER_CACHE_MAX_BYTES", 5 * 1024 * 1024)),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60)),
+    session_factory=session_factory,
+    model=CachedAnswer
+)
+
+# Precomputed answers built offline by `python faq.py`, one file per program and content
+# version; consulted before everything else, so a matching question costs no model call
+faq_tier = FaqTier(
+    os.getenv("FAQ_DIR", "faq"),
+    threshold=float(os.getenv("FAQ_THRESHOLD", 0.85)),
+    aliases=program_aliases(programs)
+) if os.getenv("FAQ_ENABLED", "true").lower() == "true" else None
+
+# Near-duplicate questions ("what is MI?" / "explain motivational interviewing") share
+# answers when their similarity reaches SEMANTIC_CACHE_THRESHOLD. Only standalone
+# questions are used; SEMANTIC_CACHE_DIR keeps the entries across restarts
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85)),
+    capacity=int(os.getenv("SEMANTIC_CACHE_CAPACITY", 1000)),
+    ttl=int(os.getenv("ANSWER_CACHE_TTL", 24 * 60 * 60)),
+    path=os.getenv("SEMANTIC_CACHE_DIR") or None,
+    aliases=program_aliases(programs)
+) if os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true" else None
+if semantic_cache and semantic_cache.path:
+    atexit.register(semantic_cache.save)
+
+# Coalesce identical concurrent questions into one upstream call; the optional
+# database lock extends this across workers (works best with ANSWER_CACHE_BACKEND=sql)
+CHAT_COALESCE_TIMEOUT = int(os.getenv("CHAT_COALESCE_TIMEOUT", 30))
+chat_flights = SingleFlight(
+    timeout=CHAT_COALESCE_TIMEOUT,
+    db_lock=DatabaseFlightLock(session_factory, InflightRequest, ttl=CHAT_COALESCE_TIMEOUT * 2)
+    if os.getenv("CHAT_COALESCE_DB_LOCK", "false").lower() == "true" else None
+)
+
+# Server-side daily question quota per user and program (backend: memory or sql)
+chat_limiter = create_rate_limiter(
+    os.getenv("CHAT_QUOTA_BACKEND", "memory"),
+    session_factory=session_factory,
+    model=ChatQuota,
+    default_limit=int(os.getenv("CHAT_QUOTA_PER_DAY", 300)),
+    limits=dict({program.code: program.quota for program in programs}, **parse_limits(os.getenv("CHAT_QUOTA_LIMITS")))
+)
+
+# Prompts fit CHAT_INPUT_TOKEN_BUDGET (static prefix + retrieved content + recent turns + question).
+# CHAT_PREFIX_CONTENT_TOKENS of the opening content go in the prefix, so prompt caching can reuse it
+prompt_builder = PromptBuilder(
+    input_budget=int(os.getenv("CHAT_INPUT_TOKEN_BUDGET", 3000)),
+    max_output_tokens=int(os.getenv("CHAT_MAX_OUTPUT_TOKENS", 500)),
+    history_budget=int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", 800)),
+    prefix_content_tokens=int(os.getenv("CHAT_PREFIX_CONTENT_TOKENS", 0))
+)
+
+# Recent turns per user and program, so follow-up questions have context
+# (backend: memory, sql or none). Conversations idle for CHAT_HISTORY_IDLE_SECONDS start over
+conversations = create_conversation_store(
+    os.getenv("CHAT_HISTORY_BACKEND", "memory"),
+    session_factory=session_factory,
+    model=ConversationTurn,
+    max_turns=int(os.getenv("CHAT_HISTORY_TURNS", 6)),
+    idle_ttl=int(os.getenv("CHAT_HISTORY_IDLE_SECONDS", 30 * 60)),
+    max_sessions=int(os.getenv("CHAT_HISTORY_MAX_SESSIONS", 5000))
+)
+llm_usage = UsageTracker(prices=parse_prices(os.getenv("LLM_PRICES")))
+
+# Model calls: pooled connections, a per-request deadline, retries, optional hedging
+# (LLM_HEDGE_AFTER=p95 or seconds) and a circuit breaker. LLM_BACKEND=fake runs offline
+llm_client = create_llm_client(
+    os.getenv("LLM_BACKEND", "openai"),
+    api_key=os.getenv("OPENAI_API_KEY"),
+    pool_size=int(os.getenv("LLM_POOL_SIZE", 20)),
+    fake_latency=float(os.getenv("LLM_FAKE_LATENCY", 0)),
+    fake_error_rate=float(os.getenv("LLM_FAKE_ERROR_RATE", 0)),
+    timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+    hedge_after=parse_hedge_after(os.getenv("LLM_HEDGE_AFTER")),
+    max_workers=int(os.getenv("LLM_MAX_WORKERS", 32)),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+        reset_timeout=float(os.getenv("LLM_BREAKER_RESET", 30))
+    )
+)
+LLM_UNAVAILABLE_REPLY = "The assistant is temporarily unavailable. Please try again in a minute."
+
+# Recent answers and the content chunks they were grounded on, for the admin view
+recent_chat_sources = deque(maxlen=int(os.getenv("CHAT_SOURCES_HISTORY", 200)))
 
 # Basic Auth settings
 AUTHORIZED_USERNAME = os.getenv("AUTH_USERNAME")  # default: admin
@@ -74,6 +204,10 @@ def authenticate():
         {'WWW-Authenticate': 'Basic realm="Login Required"'}
     )
 
+def is_admin_request():
+    auth = request.authorization
+    return bool(auth) and check_auth(auth.username, auth.password)
+
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
@@ -97,37 +231,85 @@ if SMARTSHEET_QUESTION_COLUMN:
 if SMARTSHEET_RESPONSE_COLUMN:
     SMARTSHEET_RESPONSE_COLUMN = int(SMARTSHEET_RESPONSE_COLUMN)
 
+SMARTSHEET_STUB = not SMARTSHEET_ACCESS_TOKEN and os.getenv("SMARTSHEET_STUB", "false").lower() == "true"
+if SMARTSHEET_STUB:
+    SMARTSHEET_SHEET_ID = SMARTSHEET_SHEET_ID or "stub"
+
 smartsheet_client = None
-if SMARTSHEET_ACCESS_TOKEN:
-    smartsheet_client = smartsheet.Smartsheet(SMARTSHEET_ACCESS_TOKEN)
+smartsheet_client_lock = threading.Lock()
+
+def create_smartsheet_client():
+    if SMARTSHEET_ACCESS_TOKEN:
+        import smartsheet
+        # Retries are handled by the batched writer below, so the SDK shouldn't retry and block it
+        client = smartsheet.Smartsheet(SMARTSHEET_ACCESS_TOKEN, max_retry_time=0)
+        client.errors_as_exceptions(True)
+        return client
+    # Local stand-in that keeps rows in memory, for development and tests
+    return StubSmartsheetClient(
+        latency=float(os.getenv("SMARTSHEET_STUB_LATENCY", 0)),
+        error_rate=float(os.getenv("SMARTSHEET_STUB_ERROR_RATE", 0))
+    )
+
+def get_smartsheet_client():
+    """The Smartsheet client, created on first use (the SDK is slow to import); None when not configured"""
+    global smartsheet_client
+    if smartsheet_client is None and (SMARTSHEET_ACCESS_TOKEN or SMARTSHEET_STUB):
+        with smartsheet_client_lock:
+            if smartsheet_client is None:
+                smartsheet_client = create_smartsheet_client()
+    return smartsheet_client
+
+def send_rows_to_smartsheet(records):
+    """Add a batch of recorded conversations to the sheet in one add_rows call"""
+    from smartsheet.models import Row
+
+    rows = []
+    for record in records:
+        new_row = Row()
+        new_row.to_top = True
+        new_row.cells = [
+            {
+                'column_id': SMARTSHEET_TIMESTAMP_COLUMN,
+                'value': record['timestamp']
+            },
+            {
+                'column_id': SMARTSHEET_QUESTION_COLUMN,
+                'value': record['question']
+            },
+            {
+                'column_id': SMARTSHEET_RESPONSE_COLUMN,
+                'value': record['reply']
+            }
+        ]
+        rows.append(new_row)
+    return get_smartsheet_client().Sheets.add_rows(SMARTSHEET_SHEET_ID, rows)
+
+# Background writer batching rows into Smartsheet, with a local journal for outages
+smartsheet_writer = SmartsheetWriter(
+    send_rows_to_smartsheet,
+    max_queue=int(os.getenv("SMARTSHEET_QUEUE_SIZE", 1000)),
+    batch_size=int(os.getenv("SMARTSHEET_BATCH_SIZE", 100)),
+    flush_interval=float(os.getenv("SMARTSHEET_FLUSH_INTERVAL", 2.0)),
+    journal_path=os.getenv("SMARTSHEET_JOURNAL_PATH", "smartsheet_journal.jsonl"),
+    stop_timeout=float(os.getenv("SMARTSHEET_STOP_TIMEOUT", 5.0))
+)
+atexit.register(smartsheet_writer.stop)
 
 def record_in_smartsheet(user_question, chatbot_reply):
     """
     Record the user's question and chatbot response in Smartsheet.
-    Adds a new row with the current timestamp, the user's question,
-    and the chatbot's reply.
+    Queues a new row with the current timestamp, the user's question,
+    and the chatbot's reply; rows are written in batches in the background.
     """
-    if not smartsheet_client or not SMARTSHEET_SHEET_ID:
+    if not (SMARTSHEET_ACCESS_TOKEN or SMARTSHEET_STUB) or not SMARTSHEET_SHEET_ID:
         return
 
-    new_row = smartsheet.models.Row()
-    new_row.to_top = True
-    new_row.cells = [
-        {
-            'column_id': SMARTSHEET_TIMESTAMP_COLUMN,
-            'value': datetime.datetime.now().isoformat()
-        },
-        {
-            'column_id': SMARTSHEET_QUESTION_COLUMN,
-            'value': user_question
-        },
-        {
-            'column_id': SMARTSHEET_RESPONSE_COLUMN,
-            'value': chatbot_reply
-        }
-    ]
-    response = smartsheet_client.Sheets.add_rows(SMARTSHEET_SHEET_ID, [new_row])
-    return response
+    smartsheet_writer.enqueue({
+        'timestamp': datetime.datetime.now().isoformat(),
+        'question': user_question,
+        'reply': chatbot_reply
+    })
 # --- End of Smartsheet Integration Setup ---
 
 # Home route: redirect to login page
@@ -149,12 +331,10 @@ def register():
             db.add(new_user)
             db.commit()
             logger.debug("User created successfully")
-            close_db(db)
             return redirect(url_for('login'))
         except Exception as e:
             db.rollback()
             logger.error("Registration error: %s", str(e))
-            close_db(db)
             return f"Registration error: {str(e)}", 400
             
     return render_template('register.html')
@@ -171,31 +351,19 @@ def login():
         # Get DB session
         db = get_db()
         try:
-            # Query user with class method
-            user = User.get_by_credentials(db, last_name, email)
+            # Increment the visit count and fetch the user in a single statement
+            user = User.record_login(db, last_name, email)
             
             if not user:
                 logger.debug("User not found")
-                close_db(db)
                 return "User not found. Please register first.", 400
                 
-            # Update visit count
             logger.debug("User found with ID: %s", user.id)
-            user.visit_count += 1
-            
-            # Store data before committing
-            user_data = user.to_dict()
-            
-            # Commit changes safely
-            db.commit()
             
             # Store in session
-            session['user_id'] = user_data['id']
-            session['user_email'] = user_data['email']
-            session['last_name'] = user_data['last_name']
-            
-            # Cleanup
-            close_db(db)
+            session['user_id'] = user.id
+            session['user_email'] = user.email
+            session['last_name'] = user.last_name
             
             # Always direct users to program selection after login
             # This ensures they can choose their program every time
@@ -205,7 +373,6 @@ def login():
         except Exception as e:
             # Rollback on error
             db.rollback()
-            close_db(db)
             logger.error("Login error: %s", str(e))
             return f"Login error: {str(e)}", 500
             
@@ -219,21 +386,16 @@ def program_select():
     if 'user_id' not in session:
         logger.warning("User not in session, redirecting to login")
         return redirect(url_for('login'))
-        
-    # Enable all programs - previously these were conditionally enabled
-    mi_enabled = True
-    safety_enabled = True
     
     logger.debug("Program select page for user: %s", session.get('user_id'))
-    return render_template('program_select.html', 
-                         mi_enabled=mi_enabled,
-                         safety_enabled=safety_enabled)
+    return render_template('program_select.html', programs=programs.enabled())
 
 # Set program route
 @app.route('/set_program/<program>')
 def set_program(program):
     # Verify valid program
-    if program not in ["BCC", "MI", "Safety"]:
+    selected = programs.get(program)
+    if not selected or not selected.enabled:
         return redirect(url_for('program_select'))
     
     # Verify user is logged in
@@ -247,90 +409,53 @@ def set_program(program):
     # Get DB session
     db = get_db()
     try:
-        # Get user by ID
-        user = User.get_by_id(db, user_id)
-        
-        if not user:
+        # Update program in a single statement
+        if not User.set_current_program(db, user_id, program):
             logger.warning("User not found in database")
-            close_db(db)
             # Clear session and redirect to login
             session.clear()
             return redirect(url_for('login'))
-            
-        # Update program
-        user.current_program = program
-        db.commit()
         
         # Set in session
         session['current_program'] = program
         
-        # Cleanup
-        close_db(db)
-        
-        # Redirect to the appropriate program page
-        if program == "BCC":
-            return redirect(url_for('index_bcc'))
-        elif program == "MI":
-            return redirect(url_for('index_mi'))
-        elif program == "Safety":
-            return redirect(url_for('index_safety'))
-        else:
-            return redirect(url_for('program_select'))
+        # Redirect to the program page
+        return redirect(url_for('program_page', code=program))
         
     except Exception as e:
         # Rollback on error
         db.rollback()
-        close_db(db)
         logger.error("Error setting program: %s", str(e))
         return redirect(url_for('program_select'))
 
-# BCC Chatbot interface
-@app.route('/index_bcc')
-def index_bcc():
+# Chatbot interface for a program
+@app.route('/program/<code>')
+def program_page(code):
     # Verify user is logged in
     if 'user_id' not in session:
         logger.warning("User not logged in, redirecting to login")
         return redirect(url_for('login'))
-        
-    # Set current program to BCC
-    session['current_program'] = 'BCC'
-    
-    logger.debug("Loading BCC chatbot interface")
-    return render_template('index.html',
-                         program='BCC',
-                         program_display_name=program_names.get('BCC', "Building Coaching Competency"))
 
-# MI Chatbot interface
-@app.route('/index_mi')
-def index_mi():
-    # Verify user is logged in
-    if 'user_id' not in session:
-        logger.warning("User not logged in, redirecting to login")
-        return redirect(url_for('login'))
+    program = programs.get(code)
+    if not program or not program.enabled:
+        return redirect(url_for('program_select'))
         
-    # Set current program to MI
-    session['current_program'] = 'MI'
+    # Set current program
+    session['current_program'] = program.code
     
-    logger.debug("Loading MI chatbot interface")
+    logger.debug("Loading %s chatbot interface", program.code)
     return render_template('index.html',
-                         program='MI',
-                         program_display_name=program_names.get('MI', "Motivational Interviewing"))
+                         program=program.code,
+                         quota_limit=chat_limiter.limit_for(program.code),
+                         program_display_name=program.name)
 
-# Safety Chatbot interface
-@app.route('/index_safety')
-def index_safety():
-    # Verify user is logged in
-    if 'user_id' not in session:
-        logger.warning("User not logged in, redirecting to login")
-        return redirect(url_for('login'))
-        
-    # Set current program to Safety
-    session['current_program'] = 'Safety'
-    
-    logger.debug("Loading Safety chatbot interface")
-    return render_template('index.html',
-                         program='Safety',
-                         program_display_name=program_names.get('Safety', "Safety and Risk Assessment"))
+# Old per-program URLs (/index_bcc, /index_mi, /index_safety)
+@app.route('/index_<code>')
+def legacy_program_page(code):
+    program = programs.find(code)
+    if not program:
+        return redirect(url_for('program_select'))
+    return redirect(url_for('program_page', code=program.code))
 
 # Legacy index route - redirect to program selection
 @app.route('/index')
@@ -339,6 +464,284 @@ def index():
     logger.debug("Redirecting from legacy index route to program selection")
     return redirect(url_for('program_select'))
 
+# Reply length limits: replies over REPLY_WORD_LIMIT words are cut at the first sentence end
+# after REPLY_TRUNCATE_WORDS words (or right after word REPLY_TRUNCATE_WORDS when no sentence
+# ends before word REPLY_WORD_LIMIT). /chat and /chat/stream share the rule through ReplyTruncator
+REPLY_WORD_LIMIT = 500
+REPLY_TRUNCATE_WORDS = 300
+SENTENCE_END_RE = re.compile(r'[.?!]')
+WORD_SPAN_RE = re.compile(r'\S+')
+
+class ReplyTruncator:
+    """
+    Applies the reply length limits to a reply as it streams in. feed() returns
+    the text that is sure to be kept and can be sent now; text that a cut could
+    still drop is held back until the reply ends or passes REPLY_WORD_LIMIT
+    words, which sets `over_limit` (the caller should stop reading then).
+    """
+
+    def __init__(self):
+        self.text = ''
+        self.spans = []  # (start, end) of each word so far
+        self.sent = 0
+        self.cut = None
+
+    @property
+    def over_limit(self):
+        return self.cut is not None
+
+    def feed(self, delta):
+        self.text += delta
+        spans = self.spans
+        # The last word may go on in this delta, so scan again from its start
+        start = spans.pop()[0] if spans else 0
+        spans.extend(match.span() for match in WORD_SPAN_RE.finditer(self.text, start))
+        if len(spans) <= REPLY_TRUNCATE_WORDS:
+            keep = len(self.text)
+        else:
+            truncate_end = spans[REPLY_TRUNCATE_WORDS - 1][1]
+            window_end = spans[min(len(spans), REPLY_WORD_LIMIT) - 1][1]
+            sentence_end = SENTENCE_END_RE.search(self.text, truncate_end, window_end)
+            keep = sentence_end.end() if sentence_end else truncate_end
+            if len(spans) > REPLY_WORD_LIMIT:
+                self.cut = keep
+        return self._release(keep)
+
+    def finish(self):
+        """The held-back text once the reply has ended (nothing if it was cut)"""
+        return self._release(self.cut if self.over_limit else len(self.text))
+
+    def _release(self, upto):
+        released = self.text[self.sent:upto]
+        self.sent = max(self.sent, upto)
+        return released
+
+    @property
+    def reply(self):
+        return self.text[:self.cut].strip() if self.over_limit else self.text.strip()
+
+def build_chat_prompt(program, snapshot, user_message, history=()):
+    """Build the prompt for the model: messages, content chunk ids used and estimated input tokens"""
+    with request_metrics.span("prompt"):
+        prompt = prompt_builder.build(program, snapshot, user_message, history)
+    logger.debug("Using chunks %s and %d earlier turns for program: %s (%d input tokens)",
+                 prompt.chunk_ids, prompt.history_turns, program.code, prompt.input_tokens)
+    return prompt
+
+def load_history(user_id, program):
+    """The user's recent turns in this program, oldest first"""
+    if not conversations:
+        return []
+    with request_metrics.span("history"):
+        return conversations.history(user_id, program)
+
+def truncate_reply(chatbot_reply):
+    """Apply the reply length limits to a whole reply (see ReplyTruncator)"""
+    truncator = ReplyTruncator()
+    truncator.feed(chatbot_reply)
+    return truncator.reply
+
+# Per-request timing spans, query counts and model histograms, exported on /metrics
+request_metrics = RequestMetrics()
+pool_metrics.on_query = request_metrics.record_query
+request_metrics.add_collector("db", pool_metrics.to_dict)
+request_metrics.add_collector("llm_client", llm_client.info)
+request_metrics.add_collector("llm_usage", lambda: flatten(llm_usage.to_dict()["total"]))
+request_metrics.add_collector("coalescing", chat_flights.info)
+request_metrics.add_collector("smartsheet", smartsheet_writer.metrics)
+request_metrics.add_collector("logging", log_stats)
+if answer_cache:
+    request_metrics.add_collector("answer_cache", answer_cache.info)
+if faq_tier:
+    request_metrics.add_collector("faq", faq_tier.info)
+if semantic_cache:
+    request_metrics.add_collector("semantic_cache", semantic_cache.info)
+if conversations:
+    request_metrics.add_collector("conversations", conversations.info)
+
+# Slow first-use work (database connections, program content, the model and
+# Smartsheet SDKs) runs in a background thread once the server starts, so the
+# port opens without waiting for it
+WARM_UP_ENABLED = os.getenv("WARM_UP_ENABLED", "true").lower() == "true"
+WARM_UP_DB_CONNECTIONS = int(os.getenv("WARM_UP_DB_CONNECTIONS", 2))
+warm_up_state = {"started": False, "done": False, "seconds": {}}
+warm_up_lock = threading.Lock()
+
+def open_db_connections(count):
+    """Check out `count` pooled connections at once, so the pool holds them for the first requests"""
+    connections = []
+    try:
+        for _ in range(count):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.exec_driver_sql("SELECT 1")
+    finally:
+        for connection in connections:
+            connection.close()
+
+def warm_up():
+    """Do the slow first-use work now; each step's time is reported on /metrics"""
+    steps = [
+        ("database", lambda: open_db_connections(WARM_UP_DB_CONNECTIONS)),
+        ("content", lambda: [program.snapshot for program in programs.enabled()]),
+        ("llm_client", llm_client.warm_up),
+        ("smartsheet", get_smartsheet_client)
+    ]
+    for name, step in steps:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, str(e))
+        warm_up_state["seconds"][name] = round(time.perf_counter() - started, 4)
+    warm_up_state["done"] = True
+    logger.info("Warm-up finished in %.3f s", sum(warm_up_state["seconds"].values()))
+
+def start_warm_up():
+    """Run warm_up() in a daemon thread, once per process"""
+    with warm_up_lock:
+        if not WARM_UP_ENABLED or warm_up_state["started"]:
+            return
+        warm_up_state["started"] = True
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+request_metrics.add_collector("warm_up", lambda: dict(warm_up_state["seconds"], done=int(warm_up_state["done"])))
+
+# Admins can profile a single request by sending X-Profile: 1 with their credentials
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+profiles = ProfileStore()
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_token = request_metrics.start(request.url_rule.rule if request.url_rule else "unmatched")
+    if PROFILING_ENABLED and request.headers.get("X-Profile") and is_admin_request():
+        g.profiler = SamplingProfiler(threading.get_ident(),
+                                      interval=float(os.getenv("PROFILING_INTERVAL", 0.005))).start()
+
+@app.after_request
+def finish_request_metrics(response):
+    profiler = g.pop('profiler', None)
+    trace = request_metrics.finish(g.pop('metrics_token'), response.status_code, request.method) \
+        if 'metrics_token' in g else None
+    if profiler:
+        profiler.stop()
+        elapsed = time.perf_counter() - trace.started if trace else 0.0
+        response.headers["X-Profile-Id"] = profiles.add(request.path, profiler, elapsed)
+    return response
+
+def record_chat(user_id, program, content_version, user_question, chatbot_reply, chunk_ids, source):
+    """
+    Log a finished answer to Smartsheet and the admin sources view, and add it
+    to the user's conversation. source is 'llm', 'faq', 'cache', 'semantic' (the
+    answer to a similar question) or 'coalesced' (shared with an identical in-flight request).
+    """
+    if conversations:
+        with request_metrics.span("history_store"):
+            conversations.append(user_id, program, user_question, chatbot_reply)
+
+    # Record conversation in Smartsheet (queued, written in the background)
+    try:
+        # Also record which program was being used and where the answer came from
+        tag = f"[{program}]"
+        if source == "cache":
+            tag += "[cached]"
+        elif source == "faq":
+            tag += "[faq]"
+        elif source == "semantic":
+            tag += "[semantic]"
+        elif source == "coalesced":
+            tag += "[coalesced]"
+        with request_metrics.span("smartsheet_enqueue"):
+            record_in_smartsheet(f"{tag} {user_question}", chatbot_reply)
+    except Exception as smex:
+        logger.error("Error recording in Smartsheet: %s", str(smex))
+
+    recent_chat_sources.append({
+        "timestamp": datetime.datetime.now().isoformat(),
+        "user_id": user_id,
+        "program": program,
+        "content_version": content_version,
+        "question": user_question,
+        "chunk_ids": chunk_ids,
+        "source": source
+    })
+
+def semantic_version(program, content_version):
+    return f"{content_version}:{program.model}"
+
+def get_cached_reply(program, snapshot, user_message, history=()):
+    """
+    Look up a ready answer: the precomputed FAQ, then the cache by exact
+    question, then by a similar standalone question. Returns (cache_key,
+    reply or None, 'faq', 'cache' or 'semantic'); a new answer is stored and
+    coalesced under cache_key.
+    """
+    # Only follow-ups ("what about that?") are keyed by the conversation. Other questions
+    # share one key whatever came before, and fall back to an answer given in this conversation
+    follow_up = bool(history) and is_follow_up(user_message)
+    conversation_key = make_key(program.code, user_message, snapshot.version, program.model, history_key(history))
+    if follow_up:
+        keys = [conversation_key]
+    else:
+        keys = [make_key(program.code, user_message, snapshot.version, program.model)]
+        if history:
+            keys.append(conversation_key)
+    cache_key = keys[0]
+    if faq_tier:
+        # FAQ questions are self-contained, so they match with or without history
+        with request_metrics.span("faq_lookup"):
+            chatbot_reply = faq_tier.get(program.code, snapshot.version, user_message)
+        if chatbot_reply is not None:
+            return cache_key, truncate_reply(chatbot_reply), "faq"
+    chatbot_reply = None
+    if answer_cache:
+        with request_metrics.span("cache_lookup"):
+            for key in keys:
+                chatbot_reply = answer_cache.get(key)
+                if chatbot_reply is not None:
+                    return cache_key, chatbot_reply, "cache"
+    if semantic_cache and not follow_up:
+        with request_metrics.span("semantic_lookup"):
+            chatbot_reply = semantic_cache.get(program.code, semantic_version(program, snapshot.version), user_message)
+    return cache_key, chatbot_reply, "semantic"
+
+def store_reply(program, prompt, chatbot_reply, cache_key):
+    """Cache a new answer under its exact key, and for similar questions when it stands alone"""
+    with request_metrics.span("cache_store"):
+        if answer_cache:
+            answer_cache.set(cache_key, chatbot_reply, program=program.code)
+        if semantic_cache and not prompt.follow_up:
+            semantic_cache.set(program.code, semantic_version(program, prompt.content_version), prompt.question,
+                               chatbot_reply)
+
+def generate_reply(program, snapshot, user_message, cache_key, history=()):
+    """Ask the model for a reply and cache it; returns (reply, chunk_ids)"""
+    prompt = build_chat_prompt(program, snapshot, user_message, history)
+    started = time.perf_counter()
+    with request_metrics.span("llm"):
+        completion = llm_client.complete(program.model, prompt.messages, prompt.max_output_tokens)
+    return finish_reply(program, prompt, completion, cache_key, time.perf_counter() - started)
+
+def finish_reply(program, prompt, completion, cache_key, llm_seconds):
+    """Record usage, truncate and cache a model reply; returns (reply, chunk_ids)"""
+    raw_reply = completion.text
+    usage = completion.usage
+    input_tokens = usage.get('prompt_tokens', prompt.input_tokens)
+    output_tokens = usage.get('completion_tokens') or count_tokens(raw_reply)
+    llm_usage.record(program.code, program.model, input_tokens, output_tokens,
+                     estimated_input_tokens=prompt.input_tokens)
+    request_metrics.record_llm(program.code, llm_seconds, input_tokens, output_tokens)
+    with request_metrics.span("truncate"):
+        chatbot_reply = truncate_reply(raw_reply.strip())
+
+    store_reply(program, prompt, chatbot_reply, cache_key)
+    return chatbot_reply, prompt.chunk_ids
+
+def lookup_shared_reply(cache_key):
+    """Result published by another worker for the same question, via the answer cache"""
+    chatbot_reply = answer_cache.get(cache_key) if answer_cache else None
+    return (chatbot_reply, []) if chatbot_reply is not None else None
+
 # Chat endpoint for processing user messages
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -352,71 +755,153 @@ def chat():
         return jsonify({"error": "A question is required."}), 400
 
     # Get the current program from session
-    current_program = session.get('current_program', 'BCC')
-    logger.debug(f"Processing chat for program: {current_program}")
-    
-    # Get content for the selected program
-    content = program_content.get(current_program, "Content not available for this program")
-
-    # Check quota using cookie
-    quota = request.cookies.get('chat_quota')
-    if quota:
-        quota = int(quota)
-    else:
-        quota = 0
+    program = current_program_for_session()
+    current_program = program.code
+    # Use one content snapshot for the whole request, even if it is reloaded meanwhile
+    snapshot = program.snapshot
+    user_id = session['user_id']
+    logger.debug("Processing chat for program: %s", current_program)
 
-    if quota >= 300:
+    # Check the server-side quota for this user and program
+    with request_metrics.span("quota"):
+        allowed, _ = chat_limiter.consume(user_id, current_program)
+    if not allowed:
         return jsonify({"reply": "You have used all your quota for today."}), 200
 
     try:
-        # Create a system message specific to the current program
-        system_message = f"You are an assistant that only answers questions based on the following content for the {program_names.get(current_program, 'selected')} program: {content}"
-        logger.debug(f"Using content for program: {current_program}")
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_message},
-                {"role": "user", "content": user_message}
-            ],
-            max_tokens=500
-        )
-        
-        chatbot_reply = response['choices'][0]['message']['content'].strip()
-
-        # Truncate response to 300 words if necessary
-        words = chatbot_reply.split()
-        if len(words) > 500:
-            truncated_text = ' '.join(words[:300])
-            end_index = chatbot_reply.find(truncated_text) + len(truncated_text)
-            rest_text = chatbot_reply[end_index:]
-            sentence_end = re.search(r'[.?!]', rest_text)
-            if sentence_end:
-                chatbot_reply = chatbot_reply[:end_index + sentence_end.end()]
-            else:
-                chatbot_reply = truncated_text
-
-        # Record conversation in Smartsheet asynchronously
-        def record_smartsheet_async(user_question, chatbot_reply, program):
-            try:
-                # Also record which program was being used
-                record_in_smartsheet(f"[{program}] {user_question}", chatbot_reply)
-            except Exception as smex:
-                logger.error("Error recording in Smartsheet: %s", str(smex))
-
-        threading.Thread(target=record_smartsheet_async, args=(user_message, chatbot_reply, current_program)).start()
+        history = load_history(user_id, current_program)
+        # Serve repeated questions from the answer cache without calling the model
+        cache_key, chatbot_reply, source = get_cached_reply(program, snapshot, user_message, history)
+        chunk_ids = []
+        if chatbot_reply is not None:
+            logger.debug("Answer cache hit (%s) for program: %s", source, current_program)
+        else:
+            # Identical questions arriving at the same time share one upstream call
+            (chatbot_reply, chunk_ids), shared = chat_flights.do(
+                cache_key,
+                lambda: generate_reply(program, snapshot, user_message, cache_key, history),
+                lookup=lambda: lookup_shared_reply(cache_key)
+            )
+            source = "coalesced" if shared else "llm"
 
-        # Create the response object and update the chat quota cookie
-        response_obj = make_response(jsonify({"reply": chatbot_reply}))
-        quota += 1
-        expires = datetime.datetime.now() + datetime.timedelta(days=1)
-        response_obj.set_cookie('chat_quota', str(quota), expires=expires)
+        record_chat(user_id, current_program, snapshot.version, user_message, chatbot_reply, chunk_ids, source)
 
-        return response_obj
+        return jsonify({"reply": chatbot_reply})
 
+    except LLMUnavailable as e:
+        logger.error("Chat model unavailable: %s", str(e))
+        return jsonify({"reply": LLM_UNAVAILABLE_REPLY}), 503
     except Exception as e:
-        logger.error("Chat error: %s", str(e))
-        return jsonify({"error": str(e)}), 500
+        logger.exception("Chat error: %s", str(e))
+        return jsonify({"error": "Something went wrong. Please try again."}), 500
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Event"""
+    payload = f"data: {json.dumps(data)}\n\n"
+    return f"event: {event}\n{payload}" if event else payload
+
+def stream_reply(program, snapshot, user_message, cache_key, history=()):
+    """
+    Generator relaying the model's reply as SSE delta events; returns (reply, chunk_ids).
+    Applies the same length limits as /chat: text a cut could still drop is held back,
+    and the upstream stream is cancelled once the reply passes REPLY_WORD_LIMIT words
+    instead of paying for text we would drop.
+    """
+    prompt = build_chat_prompt(program, snapshot, user_message, history)
+    started = time.perf_counter()
+    stream = llm_client.stream(program.model, prompt.messages, prompt.max_output_tokens)
+
+    truncator = ReplyTruncator()
+    try:
+        for delta in stream:
+            ready = truncator.feed(delta)
+            if ready:
+                yield sse_event({"delta": ready})
+            if truncator.over_limit:
+                break
+    finally:
+        stream.close()
+    rest = truncator.finish()
+    if rest:
+        yield sse_event({"delta": rest})
+
+    chatbot_reply = truncator.reply
+    # Streams don't report usage, so both sides are estimates
+    output_tokens = count_tokens(chatbot_reply) if chatbot_reply else 0
+    llm_usage.record(program.code, program.model, prompt.input_tokens, output_tokens)
+    request_metrics.record_llm(program.code, time.perf_counter() - started, prompt.input_tokens, output_tokens)
+    store_reply(program, prompt, chatbot_reply, cache_key)
+    return chatbot_reply, prompt.chunk_ids
+
+# Streaming chat endpoint: relays the reply as Server-Sent Events while the model generates
+@app.route('/chat/stream', methods=['POST'])
+def chat_stream():
+    # Verify user is logged in
+    if 'user_id' not in session:
+        logger.warning("User not logged in, redirecting to login")
+        return jsonify({"reply": "Session expired. Please log in again."}), 401
+
+    user_message = request.json.get("message")
+    if not user_message:
+        return jsonify({"error": "A question is required."}), 400
+
+    program = current_program_for_session()
+    current_program = program.code
+    snapshot = program.snapshot
+    user_id = session['user_id']
+    logger.debug("Processing streaming chat for program: %s", current_program)
+
+    with request_metrics.span("quota"):
+        allowed, _ = chat_limiter.consume(user_id, current_program)
+    if not allowed:
+        return jsonify({"reply": "You have used all your quota for today."}), 200
+
+    def generate():
+        try:
+            history = load_history(user_id, current_program)
+            cache_key, chatbot_reply, source = get_cached_reply(program, snapshot, user_message, history)
+            if chatbot_reply is not None:
+                logger.debug("Answer cache hit (%s) for program: %s", source, current_program)
+                yield sse_event({"delta": chatbot_reply})
+                record_chat(user_id, current_program, snapshot.version, user_message, chatbot_reply, [], source)
+                yield sse_event({"reply": chatbot_reply}, event="done")
+                return
+
+            # Wait for an identical question that is already streaming instead of starting another
+            call, leader = chat_flights.begin(cache_key)
+            if not leader:
+                chatbot_reply, _ = call.wait(chat_flights.timeout)
+                yield sse_event({"delta": chatbot_reply})
+                record_chat(user_id, current_program, snapshot.version, user_message, chatbot_reply, [], "coalesced")
+                yield sse_event({"reply": chatbot_reply}, event="done")
+                return
+
+            result = None
+            error = None
+            try:
+                chatbot_reply, chunk_ids = result = yield from stream_reply(program, snapshot, user_message, cache_key, history)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                if result is None and error is None:
+                    error = RuntimeError("The identical request was cancelled before it finished")
+                chat_flights.finish(cache_key, call, result=result, error=error)
+
+            record_chat(user_id, current_program, snapshot.version, user_message, chatbot_reply, chunk_ids, "llm")
+            yield sse_event({"reply": chatbot_reply}, event="done")
+
+        except LLMUnavailable as e:
+            logger.error("Streaming chat model unavailable: %s", str(e))
+            yield sse_event({"reply": LLM_UNAVAILABLE_REPLY}, event="done")
+        except Exception as e:
+            logger.exception("Streaming chat error: %s", str(e))
+            yield sse_event({"error": "Something went wrong. Please try again."}, event="error")
+
+    # The request is timed and traced until the last event, not just until the headers are sent
+    body = request_metrics.traced(request_metrics.defer(), generate(), 200, request.method)
+    return Response(stream_with_context(body), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # Program switch route
 @app.route('/switch_program')
@@ -454,74 +939,333 @@ def delete_registration():
         else:
             message = "User not found. No registration to remove."
             status_code = 404
-        close_db(db)
         return message, status_code
     except Exception as e:
         db.rollback()
         message = f"Error during deletion: {str(e)}"
         status_code = 500
-        close_db(db)
         return message, status_code
 
-@app.route('/export_users', methods=['GET'])
+# Admin bulk import and deletion, BULK_CHUNK_SIZE rows per statement and transaction
+bulk_users = BulkUsers(session_factory, User, related_models=(ConversationTurn, ChatQuota),
+                       chunk_size=int(os.getenv("BULK_CHUNK_SIZE", 1000)))
+
+def ndjson_lines(items):
+    """One JSON object per line, so clients can show progress as chunks finish"""
+    for item in items:
+        yield json.dumps(item) + "\n"
+
+def parse_chunk_size(value):
+    """A chunk_size parameter (query string text or JSON number) as an int from 1 to MAX_CHUNK_SIZE, else None"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        return None
+    return value if 1 <= value <= MAX_CHUNK_SIZE else None
+
+CHUNK_SIZE_ERROR = f"chunk_size must be an integer from 1 to {MAX_CHUNK_SIZE}"
+
+@app.route('/bulk_users', methods=['GET'])
 @requires_auth
-def export_users():
-    db = get_db()
+def bulk_users_page():
+    return render_template('bulk_users.html', programs=[program.code for program in programs],
+                           default_program=DEFAULT_PROGRAM)
+
+@app.route('/import_users', methods=['POST'])
+@requires_auth
+def import_users():
+    """
+    Register users from a CSV with last_name, email and optional program columns,
+    uploaded as the "file" field or sent as a text/csv body. Streams NDJSON progress.
+    """
+    upload = request.files.get('file')
+    if upload:
+        body = upload.stream
+    elif request.mimetype == 'text/csv':
+        body = request.stream
+    else:
+        return jsonify({"error": "Upload a CSV file as 'file' or send a text/csv body"}), 400
+    default_program = request.values.get('program') or DEFAULT_PROGRAM
+    if default_program not in programs:
+        return jsonify({"error": f"Unknown program {default_program}"}), 400
+    chunk_size = request.values.get('chunk_size')
+    if chunk_size is not None:
+        chunk_size = parse_chunk_size(chunk_size)
+        if chunk_size is None:
+            return jsonify({"error": CHUNK_SIZE_ERROR}), 400
+
+    # The upload is closed with the request, before the response body is read, so keep a copy
+    spool = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    shutil.copyfileobj(body, spool)
+    spool.seek(0)
+
+    def progress():
+        with io.TextIOWrapper(spool, encoding='utf-8-sig', newline='') as lines:
+            yield from bulk_users.import_csv(lines, programs, default_program, chunk_size=chunk_size)
+
+    return Response(ndjson_lines(progress()), mimetype="application/x-ndjson")
+
+@app.route('/bulk_delete_users', methods=['POST'])
+@requires_auth
+def bulk_delete_users():
+    """
+    Delete users by a list of emails ("emails") or every user of a program
+    ("program"). Takes a JSON body only, so a cross-site form can't send it with
+    the browser's cached credentials, and "confirm" must repeat what is deleted:
+    the number of distinct emails, or the program code. Streams NDJSON progress.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Send a JSON body (Content-Type: application/json)"}), 415
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "The body must be a JSON object"}), 400
+    emails = data.get('emails')
+    program = data.get('program')
+    if emails is not None and not (isinstance(emails, list) and all(isinstance(email, str) for email in emails)):
+        return jsonify({"error": "emails must be a list of strings"}), 400
+    emails = list(dict.fromkeys(email.strip() for email in emails or [] if email.strip()))
+    if bool(emails) == bool(program):
+        return jsonify({"error": "Send either emails or a program"}), 400
+    if program and program not in programs:
+        return jsonify({"error": f"Unknown program {program}"}), 400
+    expected = len(emails) if emails else program
+    confirm = data.get('confirm')
+    if isinstance(confirm, bool) or confirm != expected:
+        return jsonify({"error": f"Set confirm to {json.dumps(expected)} to delete "
+                                 + (f"{len(emails)} users" if emails else f"every user of {program}")}), 400
+
+    chunk_size = request.args.get('chunk_size', data.get('chunk_size'))
+    if chunk_size is not None:
+        chunk_size = parse_chunk_size(chunk_size)
+        if chunk_size is None:
+            return jsonify({"error": CHUNK_SIZE_ERROR}), 400
+    if emails:
+        progress = bulk_users.delete_emails(emails, chunk_size=chunk_size)
+    else:
+        progress = bulk_users.delete_program(program, chunk_size=chunk_size)
+    return Response(ndjson_lines(progress), mimetype="application/x-ndjson")
+
+# Rows fetched per round trip when streaming the user export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+
+def iter_user_csv(statement):
+    """Yield the export as CSV text, one chunk per batch of rows read through a server-side cursor"""
+    # The response body is read after the request context is gone, so use a session of its own
+    db = session_factory()
     try:
-        # Get all users and convert to dictionaries
-        users = db.query(User).all()
-        user_data = [user.to_dict() for user in users]
-        
-        # Create CSV output
         output = io.StringIO()
         writer = csv.writer(output)
         writer.writerow(['ID', 'Last Name', 'Email', 'Visit Count', 'Program'])
-        
-        for user in user_data:
-            writer.writerow([user['id'], user['last_name'], user['email'], user['visit_count'], user['current_program']])
-        
-        close_db(db)
-        return Response(
-            output.getvalue(),
-            mimetype="text/csv",
-            headers={"Content-disposition": "attachment; filename=user_data.csv"}
-        )
+        yield output.getvalue()
+
+        result = db.execute(statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+        for rows in result.partitions():
+            output.seek(0)
+            output.truncate(0)
+            writer.writerows(rows)
+            yield output.getvalue()
     except Exception as e:
+        # Headers are already sent, so the best we can do is log and end the file
         logger.error("Error exporting users: %s", str(e))
-        close_db(db)
-        return f"Error exporting users: {str(e)}", 500
+    finally:
+        db.close()
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into a gzip stream"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+@app.route('/export_users', methods=['GET'])
+@requires_auth
+def export_users():
+    # Select only the exported columns; rows are streamed without building ORM objects
+    statement = select(User.id, User.last_name, User.email, User.visit_count, User.current_program).order_by(User.id)
+
+    # Optional filters
+    program = request.args.get('program')
+    if program:
+        statement = statement.where(User.current_program == program)
+    min_visits = request.args.get('min_visits', type=int)
+    if min_visits:
+        statement = statement.where(User.visit_count >= min_visits)
+
+    if request.args.get('gzip') in ('1', 'true', 'on'):
+        return Response(
+            gzip_chunks(iter_user_csv(statement)),
+            mimetype="application/gzip",
+            headers={"Content-disposition": "attachment; filename=user_data.csv.gz"}
+        )
+    return Response(
+        iter_user_csv(statement),
+        mimetype="text/csv",
+        headers={"Content-disposition": "attachment; filename=user_data.csv"}
+    )
+
+# Admin user list page size
+USERS_PAGE_SIZE = 50
+USERS_PAGE_SIZE_MAX = 200
+
+def query_users_page(db, search=None, sort='id', after=None, limit=USERS_PAGE_SIZE):
+    """
+    Fetch one page of users with keyset pagination, in a single bounded query.
+    search matches an email prefix or an exact last name; sort is 'id' or
+    'visits' (most visits first). after is the cursor returned with the
+    previous page. Returns (rows, next_cursor).
+    """
+    statement = select(User.id, User.last_name, User.email, User.visit_count, User.current_program)
+
+    if search:
+        escaped = search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        statement = statement.where(or_(User.email.like(escaped + '%', escape='\\'), User.last_name == search))
+
+    if sort == 'visits':
+        statement = statement.order_by(User.visit_count.desc(), User.id.desc())
+        if after:
+            visits, last_id = (int(part) for part in after.split(':', 1))
+            statement = statement.where(tuple_(User.visit_count, User.id) < tuple_(visits, last_id))
+    else:
+        statement = statement.order_by(User.id)
+        if after:
+            statement = statement.where(User.id > int(after))
+
+    # Fetch one extra row to know whether there is a next page
+    rows = db.execute(statement.limit(limit + 1)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = f"{last.visit_count or 0}:{last.id}" if sort == 'visits' else str(last.id)
+    return rows, next_cursor
+
+def users_page_args():
+    """Read search, sort, cursor and page size from the query string"""
+    limit = min(max(request.args.get('limit', USERS_PAGE_SIZE, type=int), 1), USERS_PAGE_SIZE_MAX)
+    return {
+        "search": request.args.get('q', '').strip() or None,
+        "sort": 'visits' if request.args.get('sort') == 'visits' else 'id',
+        "after": request.args.get('after') or None,
+        "limit": limit
+    }
 
 @app.route('/users')
 @requires_auth
 def show_users():
+    args = users_page_args()
     db = get_db()
     try:
-        # Get all users and convert to dictionaries
-        users = db.query(User).all()
-        user_data = [user.to_dict() for user in users]
-        
-        # Convert dictionaries to User-like objects for the template
-        class UserObj:
-            def __init__(self, data):
-                self.id = data['id']
-                self.last_name = data['last_name']
-                self.email = data['email']
-                self.visit_count = data['visit_count']
-                self.current_program = data['current_program']
-                
-        user_objects = [UserObj(data) for data in user_data]
-        close_db(db)
-        return render_template('users.html', users=user_objects)
+        users, next_cursor = query_users_page(db, **args)
+        return render_template('users.html', users=users, next_cursor=next_cursor,
+                               search=args['search'] or '', sort=args['sort'], limit=args['limit'])
+    except ValueError:
+        return "Invalid page cursor", 400
     except Exception as e:
         logger.error("Error showing users: %s", str(e))
-        close_db(db)
         return f"Error showing users: {str(e)}", 500
 
+@app.route('/api/users')
+@requires_auth
+def api_users():
+    """JSON variant of the admin user list"""
+    args = users_page_args()
+    db = get_db()
+    try:
+        users, next_cursor = query_users_page(db, **args)
+        return jsonify({"users": [dict(row._mapping) for row in users], "next": next_cursor})
+    except ValueError:
+        return jsonify({"error": "Invalid page cursor"}), 400
+    except Exception as e:
+        logger.error("Error listing users: %s", str(e))
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/chat_sources')
+@requires_auth
+def chat_sources():
+    """Show which content chunks recent answers were grounded on"""
+    entries = []
+    for entry in reversed(recent_chat_sources):
+        program = programs.get(entry['program'])
+        snapshot = program.snapshot if program else None
+        chunks = []
+        for chunk_id in entry['chunk_ids']:
+            # Previews are only available while the answer's content version is current
+            current = snapshot is not None and snapshot.version == entry['content_version']
+            text = snapshot.index.chunks[chunk_id] if current else ""
+            chunks.append({"id": chunk_id, "preview": text[:120]})
+        entries.append(dict(entry, chunks=chunks))
+    return jsonify({"entries": entries})
+
+@app.route('/cache_stats')
+@requires_auth
+def cache_stats():
+    """Answer cache hit/miss counters and usage"""
+    if not answer_cache:
+        return jsonify({"backend": "none"})
+    return jsonify(answer_cache.info())
+
+@app.route('/smartsheet_stats')
+@requires_auth
+def smartsheet_stats():
+    """Queue depth, batch size and flush latency of the Smartsheet writer"""
+    return jsonify(smartsheet_writer.metrics())
+
+@app.route('/db_stats')
+@requires_auth
+def db_stats():
+    """Connection pool usage, checkout wait and query counters, for sizing the pool"""
+    return jsonify(pool_metrics.to_dict())
+
+@app.route('/llm_usage')
+@requires_auth
+def llm_usage_stats():
+    """Model calls, input/output tokens and estimated cost, per program and in total"""
+    return jsonify(llm_usage.to_dict())
+
+@app.route('/llm_stats')
+@requires_auth
+def llm_stats():
+    """Model client retries, timeouts, hedging, circuit breaker state and p95 latency"""
+    return jsonify(llm_client.info())
+
+@app.route('/metrics')
+@requires_auth
+def metrics():
+    """Request, phase, query and model histograms plus component gauges, in Prometheus text format"""
+    return Response(request_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/profiles/<profile_id>')
+@requires_auth
+def profile(profile_id):
+    """A profiled request's samples as collapsed stacks (flamegraph input)"""
+    collapsed = profiles.get(profile_id)
+    if collapsed is None:
+        return jsonify({"error": "Profile not found"}), 404
+    return Response(collapsed, mimetype="text/plain")
+
+@app.route('/content_stats')
+@requires_auth
+def content_stats():
+    """Content version, reload time and snapshot memory per program"""
+    return jsonify({"programs": [program.stats() for program in programs]})
+
 @app.route('/export')
 @requires_auth
 def export_page():
-    return render_template('export.html')
+    return render_template('export.html', programs=[program.code for program in programs])
 
 if __name__ == '__main__':
-    port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    if os.getenv("FLASK_DEBUG", "false").lower() == "true":
+        # Development server with the debugger and auto-reload
+        init_db()
+        app.run(host='0.0.0.0', port=int(os.environ.get("PORT", 5000)), debug=True)
+    else:
+        import sys
+        from serve import run
+        # Let asgi.py's "import main" reuse this module instead of loading the app a second time
+        sys.modules.setdefault("main", sys.modules["__main__"])
+        run()
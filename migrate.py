@@ -0,0 +1,449 @@
+# migrate.py
+"""
+Versioned schema migrations.
+
+    python migrate.py               apply pending migrations
+    python migrate.py --dry-run     show what would run and the rows it would touch
+    python migrate.py --status      list applied and pending migrations
+    python migrate.py --to 3        stop after version 3
+
+Applied versions are recorded in the schema_migrations table. Each step checks
+the schema before changing it, so a migration that failed half way can simply
+be run again: the steps already done are reported as skipped. Before anything
+runs, the pending steps are checked against the schema (e.g. an index on a
+column that neither exists nor is added by an earlier step), and --dry-run
+reports the same problems. On Postgres, indexes are built with CREATE INDEX CONCURRENTLY
+(writes to the table carry on meanwhile) and backfills update `batch_size`
+rows per transaction, so no long lock is held. Only one runner works at a time
+(an advisory lock).
+
+Tables are created from their current model in models.py. Once a table has
+been released, change it with a new migration, never by editing an old one.
+"""
+import argparse
+import logging
+import time
+
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, inspect, schema, select, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from models import engine, User, CachedAnswer, InflightRequest, ChatQuota, ConversationTurn
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 1000
+
+# Arbitrary key for pg_advisory_lock, shared by every runner
+ADVISORY_LOCK_KEY = 72710431
+
+metadata = MetaData()
+schema_migrations = Table(
+    "schema_migrations", metadata,
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("name", String, nullable=False),
+    Column("applied_at", Float, nullable=False),
+    Column("seconds", Float, nullable=False)
+)
+
+
+class MigrationError(Exception):
+    """A migration that can't run, or failed part way; `completed` lists the steps done before it"""
+
+    def __init__(self, message, completed=()):
+        super().__init__(message)
+        self.completed = list(completed)
+
+
+def is_postgres(bind):
+    return bind.dialect.name == "postgresql"
+
+
+def table_exists(bind, table_name):
+    return inspect(bind).has_table(table_name)
+
+
+def column_names(bind, table_name):
+    if not table_exists(bind, table_name):
+        return set()
+    return {column["name"] for column in inspect(bind).get_columns(table_name)}
+
+
+def estimate_rows(bind, table_name, where=None):
+    """Rows in a table (matching `where`); Postgres uses the planner's estimate for whole tables"""
+    if not table_exists(bind, table_name):
+        return 0
+    with bind.connect() as conn:
+        if is_postgres(bind) and where is None:
+            estimate = conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = :name"),
+                                    {"name": table_name}).scalar()
+            if estimate is not None and estimate >= 0:
+                return int(estimate)
+        query = f"SELECT COUNT(*) FROM {table_name}" + (f" WHERE {where}" if where else "")
+        return conn.execute(text(query)).scalar()
+
+
+class CreateTable:
+    """Create a model's table and its indexes if the table doesn't exist (a new table is empty, so nothing waits)"""
+
+    def __init__(self, model):
+        self.table = model.__table__
+
+    def label(self, bind):
+        return f"create table {self.table.name}"
+
+    def describe(self, bind):
+        return self.label(bind) + (" (exists, skipped)" if table_exists(bind, self.table.name) else "")
+
+    def estimate(self, bind):
+        return 0
+
+    def requires(self):
+        return []
+
+    def provides(self):
+        return [(self.table.name, column.name) for column in self.table.columns]
+
+    def apply(self, bind, batch_size):
+        """Returns what it did, for the run report"""
+        if table_exists(bind, self.table.name):
+            return "exists, skipped"
+        self.table.create(bind, checkfirst=True)
+        return "created"
+
+
+class AddColumn:
+    """
+    ALTER TABLE ... ADD COLUMN if the column is missing. With a constant default
+    this only changes the catalog on Postgres 11+, so it doesn't rewrite the table.
+    """
+
+    def __init__(self, table_name, column_name, definition):
+        self.table_name = table_name
+        self.column_name = column_name
+        self.definition = definition
+
+    def sql(self):
+        return f"ALTER TABLE {self.table_name} ADD COLUMN {self.column_name} {self.definition}"
+
+    def exists(self, bind):
+        return self.column_name in column_names(bind, self.table_name)
+
+    def label(self, bind):
+        return self.sql()
+
+    def describe(self, bind):
+        return self.label(bind) + (" (exists, skipped)" if self.exists(bind) else "")
+
+    def estimate(self, bind):
+        return 0
+
+    def requires(self):
+        return []
+
+    def provides(self):
+        return [(self.table_name, self.column_name)]
+
+    def apply(self, bind, batch_size):
+        if self.exists(bind):
+            return "exists, skipped"
+        with bind.begin() as conn:
+            conn.execute(text(self.sql()))
+        return "added"
+
+
+class CreateIndex:
+    """
+    Build one of a model's indexes, by name, if it doesn't exist. Postgres builds
+    it CONCURRENTLY, outside a transaction; an invalid index left by a failed
+    concurrent build is dropped and built again.
+    """
+
+    def __init__(self, model, index_name):
+        self.table = model.__table__
+        self.index = next(index for index in self.table.indexes if index.name == index_name)
+
+    def sql(self, bind):
+        statement = str(schema.CreateIndex(self.index, if_not_exists=True).compile(dialect=bind.dialect))
+        if is_postgres(bind):
+            # "CREATE [UNIQUE] INDEX IF NOT EXISTS ..." -> "CREATE [UNIQUE] INDEX CONCURRENTLY IF NOT EXISTS ..."
+            statement = statement.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+        return statement
+
+    def exists(self, bind):
+        return table_exists(bind, self.table.name) and any(
+            index["name"] == self.index.name for index in inspect(bind).get_indexes(self.table.name))
+
+    def label(self, bind):
+        return self.sql(bind)
+
+    def describe(self, bind):
+        return self.label(bind) + (" (exists, skipped)" if self.exists(bind) else "")
+
+    def estimate(self, bind):
+        # Building an index reads every row
+        return 0 if self.exists(bind) else estimate_rows(bind, self.table.name)
+
+    def requires(self):
+        return [(self.table.name, column.name) for column in self.index.columns]
+
+    def provides(self):
+        return []
+
+    def apply(self, bind, batch_size):
+        missing = [column for _, column in self.requires() if column not in column_names(bind, self.table.name)]
+        if missing:
+            raise MigrationError(f"Index {self.index.name} needs column(s) {', '.join(missing)}, "
+                                 f"which {self.table.name} doesn't have")
+        if self.exists(bind) and not is_postgres(bind):
+            return "exists, skipped"
+        with bind.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if is_postgres(bind):
+                valid = conn.execute(text(
+                    "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = :name"
+                ), {"name": self.index.name}).scalar()
+                if valid is False:
+                    logger.warning("Rebuilding invalid index %s", self.index.name)
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {self.index.name}"))
+                elif valid:
+                    return "exists, skipped"
+            conn.execute(text(self.sql(bind)))
+        return "built"
+
+
+class Backfill:
+    """
+    UPDATE table SET `assignments` WHERE `where`, `batch_size` rows per
+    transaction (picked by primary key), until no row matches. Each batch
+    commits on its own, so locks are short and a restart picks up where the
+    last run stopped. `where` must stop matching a row once it is updated.
+    """
+
+    def __init__(self, table_name, assignments, where, key="id", pause=0.0):
+        self.table_name = table_name
+        self.assignments = assignments
+        self.where = where
+        self.key = key
+        self.pause = pause
+
+    def sql(self):
+        return (f"UPDATE {self.table_name} SET {self.assignments} WHERE {self.key} IN "
+                f"(SELECT {self.key} FROM {self.table_name} WHERE {self.where} ORDER BY {self.key} LIMIT :batch_size)")
+
+    def label(self, bind):
+        return f"UPDATE {self.table_name} SET {self.assignments} WHERE {self.where} (in batches)"
+
+    def describe(self, bind):
+        return self.label(bind)
+
+    def estimate(self, bind):
+        try:
+            return estimate_rows(bind, self.table_name, self.where)
+        except SQLAlchemyError:
+            # The columns are added by an earlier step of the same run
+            return None
+
+    def requires(self):
+        # `assignments` and `where` are free SQL; a column they use must exist by the time this runs
+        return []
+
+    def provides(self):
+        return []
+
+    def apply(self, bind, batch_size):
+        total = batches = 0
+        while True:
+            with bind.begin() as conn:
+                updated = conn.execute(text(self.sql()), {"batch_size": batch_size}).rowcount
+            total += updated
+            batches += 1
+            if updated < batch_size:
+                break
+            if self.pause:
+                time.sleep(self.pause)
+        logger.info("Backfilled %d rows of %s in %d batches", total, self.table_name, batches)
+        return f"{total} rows in {batches} batches"
+
+
+class Migration:
+    def __init__(self, version, name, steps):
+        self.version = version
+        self.name = name
+        self.steps = steps
+
+
+MIGRATIONS = [
+    Migration(1, "users table", [CreateTable(User)]),
+    # Replaces add_column.py
+    Migration(2, "users.current_program", [
+        AddColumn("users", "current_program", "VARCHAR DEFAULT 'BCC'"),
+        Backfill("users", "current_program = 'BCC'", "current_program IS NULL")
+    ]),
+    # Tables created before these indexes were declared don't have them. The oldest users
+    # tables (id, last_name, email) don't have visit_count either, so it's added first;
+    # databases that already ran this migration have it, and the steps skip
+    Migration(3, "users lookup indexes", [
+        AddColumn("users", "visit_count", "INTEGER DEFAULT 0"),
+        Backfill("users", "visit_count = 0", "visit_count IS NULL"),
+        CreateIndex(User, "ix_users_last_name"),
+        CreateIndex(User, "ix_users_email_prefix"),
+        CreateIndex(User, "ix_users_visit_count_id"),
+        CreateIndex(User, "ix_users_email_last_name")
+    ]),
+    Migration(4, "answer cache and coalescing tables", [CreateTable(CachedAnswer), CreateTable(InflightRequest)]),
+    Migration(5, "chat quota table", [CreateTable(ChatQuota)]),
+    Migration(6, "conversation history table", [CreateTable(ConversationTurn)])
+]
+
+
+class MigrationRunner:
+    def __init__(self, bind, migrations=MIGRATIONS, batch_size=BACKFILL_BATCH_SIZE):
+        self.bind = bind
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.batch_size = batch_size
+        # [(version, name, [(step description, what it did)])] of the last run, including a failed migration
+        self.report = []
+
+    def applied(self):
+        """{version: (name, applied_at)} of applied migrations"""
+        if not table_exists(self.bind, schema_migrations.name):
+            return {}
+        with self.bind.connect() as conn:
+            rows = conn.execute(select(schema_migrations.c.version, schema_migrations.c.name,
+                                       schema_migrations.c.applied_at)).all()
+        return {version: (name, applied_at) for version, name, applied_at in rows}
+
+    def pending(self, target=None):
+        applied = self.applied()
+        return [migration for migration in self.migrations
+                if migration.version not in applied and (target is None or migration.version <= target)]
+
+    def plan(self, target=None):
+        """[(migration, [(description, estimated rows)])] for the pending migrations"""
+        return [(migration, [(step.describe(self.bind), step.estimate(self.bind)) for step in migration.steps])
+                for migration in self.pending(target)]
+
+    def check(self, migrations):
+        """
+        Problems that would stop `migrations` part way: steps that need a column
+        that neither exists now nor is added by an earlier step
+        """
+        columns = {}
+        problems = []
+        for migration in migrations:
+            for step in migration.steps:
+                for table_name, column in step.requires():
+                    if table_name not in columns:
+                        columns[table_name] = column_names(self.bind, table_name)
+                    if column not in columns[table_name]:
+                        problems.append(f"migration {migration.version}: {step.label(self.bind)} "
+                                        f"needs {table_name}.{column}, which doesn't exist and no earlier step adds it")
+                for table_name, column in step.provides():
+                    if table_name not in columns:
+                        columns[table_name] = column_names(self.bind, table_name)
+                    columns[table_name].add(column)
+        return problems
+
+    def run(self, target=None):
+        """Apply pending migrations in order; returns the versions applied"""
+        # Autocommit: an open transaction here would make CREATE INDEX CONCURRENTLY wait on it
+        with self.bind.connect().execution_options(isolation_level="AUTOCOMMIT") as lock_conn:
+            if is_postgres(self.bind):
+                lock_conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": ADVISORY_LOCK_KEY})
+            try:
+                metadata.create_all(self.bind, checkfirst=True)
+                # Read after taking the lock: another runner may have just finished
+                pending = self.pending(target)
+                problems = self.check(pending)
+                if problems:
+                    raise MigrationError("Nothing applied:\n" + "\n".join(problems))
+                for migration in pending:
+                    self.apply(migration)
+            finally:
+                if is_postgres(self.bind):
+                    lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": ADVISORY_LOCK_KEY})
+        return [migration.version for migration in pending]
+
+    def apply(self, migration):
+        """
+        Run a migration's steps in order and record it. Steps commit on their own
+        (a concurrent index build can't be in a transaction); if one fails, the
+        error says which, and running again skips the steps already done.
+        """
+        logger.info("Applying migration %d: %s", migration.version, migration.name)
+        started = time.perf_counter()
+        done = []
+        self.report.append((migration.version, migration.name, done))
+        for number, step in enumerate(migration.steps, 1):
+            description = step.label(self.bind)
+            try:
+                result = step.apply(self.bind, self.batch_size)
+            except Exception as e:
+                raise MigrationError(
+                    f"Migration {migration.version} ({migration.name}) failed at step {number} of "
+                    f"{len(migration.steps)}, {description}: {e}. The steps before it are done; "
+                    f"run again to resume", done) from e
+            logger.info("  step %d/%d: %s: %s", number, len(migration.steps), description, result)
+            done.append((description, result))
+        seconds = time.perf_counter() - started
+        with self.bind.begin() as conn:
+            conn.execute(schema_migrations.insert().values(
+                version=migration.version, name=migration.name, applied_at=time.time(), seconds=seconds))
+        logger.info("Applied migration %d in %.2f s", migration.version, seconds)
+
+
+def upgrade(bind=engine, target=None):
+    """Apply every pending migration (what deploys and DB_INIT_ON_START run)"""
+    return MigrationRunner(bind).run(target)
+
+
+def print_report(report):
+    for version, name, steps in report:
+        print(f"{version:>4}  {name}")
+        for description, result in steps:
+            print(f"        {description}: {result}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dry-run", action="store_true", help="Show pending steps and estimated rows; change nothing")
+    parser.add_argument("--status", action="store_true", help="List applied and pending migrations")
+    parser.add_argument("--to", type=int, dest="target", help="Apply migrations up to this version")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE, help="Rows per backfill transaction")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    runner = MigrationRunner(engine, batch_size=args.batch_size)
+    if args.status:
+        applied = runner.applied()
+        for migration in runner.migrations:
+            state = "applied " + time.strftime("%Y-%m-%d %H:%M", time.gmtime(applied[migration.version][1])) \
+                if migration.version in applied else "pending"
+            print(f"{migration.version:>4}  {migration.name:40} {state}")
+        return
+
+    if args.dry_run:
+        plan = runner.plan(args.target)
+        if not plan:
+            print("Nothing to do: the schema is up to date")
+        for migration, steps in plan:
+            print(f"{migration.version:>4}  {migration.name}")
+            for description, rows in steps:
+                print(f"        {description}\n          " + (f"~{rows} rows" if rows is not None else "rows unknown"))
+        problems = runner.check([migration for migration, _ in plan])
+        if problems:
+            print("Problems:\n" + "\n".join("  " + problem for problem in problems))
+            raise SystemExit(1)
+        return
+
+    try:
+        applied = runner.run(args.target)
+    except MigrationError as e:
+        print_report(runner.report)
+        print(e)
+        raise SystemExit(1)
+    print_report(runner.report)
+    print(f"Applied {len(applied)} migrations" + (f": {', '.join(map(str, applied))}" if applied else ""))
+
+
+if __name__ == "__main__":
+    main()
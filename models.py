@@ -1,24 +1,32 @@
 # models.py
 import os
-from sqlalchemy import create_engine, Column, Integer, String
+from sqlalchemy import create_engine, Column, Integer, String, Text, Float, Index, update, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, scoped_session
 from dotenv import load_dotenv
+from db_metrics import PoolMetrics, timed_pool_class
 load_dotenv()
 
 # Get the database URL from your Render environment
 DATABASE_URL = os.getenv("DATABASE_URL")
-print("DATABASE_URL =", DATABASE_URL)
+
+# Pool and query instrumentation, reported on the admin /db_stats endpoint
+pool_metrics = PoolMetrics(slow_query_ms=int(os.getenv("SLOW_QUERY_MS", 500)))
 
 # Create an engine with proper connection handling 
 engine = create_engine(
     DATABASE_URL, 
+    poolclass=timed_pool_class(pool_metrics),
     pool_pre_ping=True,
     pool_recycle=1800,  # 30 minutes
     pool_size=10,
     max_overflow=20,
     echo=False  # Set to True for SQL debugging
 )
+pool_metrics.install(engine)
+if hasattr(os, "register_at_fork"):
+    # A forked worker (gunicorn --preload) must not reuse the parent's connections
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
 
 # Create scoped session to ensure thread safety
 session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -36,6 +44,16 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     visit_count = Column(Integer, default=0)
     current_program = Column(String, default="BCC")
+
+    __table_args__ = (
+        # Admin user list: last name search, email prefix search (LIKE 'x%' on Postgres)
+        # and keyset pagination ordered by visit count
+        Index("ix_users_last_name", "last_name"),
+        Index("ix_users_email_prefix", "email", postgresql_ops={"email": "varchar_pattern_ops"}),
+        Index("ix_users_visit_count_id", "visit_count", "id"),
+        # Login lookup by credentials
+        Index("ix_users_email_last_name", "email", "last_name"),
+    )
     
     @classmethod
     def get_by_credentials(cls, db, last_name, email):
@@ -49,6 +67,37 @@ class User(Base):
     def get_by_id(cls, db, user_id):
         """Safely get user by ID"""
         return db.query(cls).filter(cls.id == user_id).first()
+
+    @classmethod
+    def record_login(cls, db, last_name, email):
+        """
+        Increment visit_count for the matching user in one atomic statement.
+        Returns a row with id, email and last_name, or None if no user matches.
+        Commits the change.
+        """
+        statement = (
+            update(cls)
+            .where(cls.email == email, cls.last_name == last_name)
+            .values(visit_count=func.coalesce(cls.visit_count, 0) + 1)
+            .returning(cls.id, cls.email, cls.last_name)
+            .execution_options(synchronize_session=False)
+        )
+        row = db.execute(statement).first()
+        db.commit()
+        return row
+
+    @classmethod
+    def set_current_program(cls, db, user_id, program):
+        """Set current_program in one statement; returns False if the user no longer exists. Commits the change."""
+        statement = (
+            update(cls)
+            .where(cls.id == user_id)
+            .values(current_program=program)
+            .execution_options(synchronize_session=False)
+        )
+        updated = db.execute(statement).rowcount
+        db.commit()
+        return updated == 1
     
     def to_dict(self):
         """Convert user object to dictionary"""
@@ -60,17 +109,61 @@ class User(Base):
             "current_program": self.current_program
         }
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
+# Cached chatbot answers shared by all workers (used when ANSWER_CACHE_BACKEND=sql)
+class CachedAnswer(Base):
+    __tablename__ = "answer_cache"
+    key = Column(String(64), primary_key=True)
+    program = Column(String)
+    answer = Column(Text, nullable=False)
+    size = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+    last_used_at = Column(Float, nullable=False, index=True)
+
+# Cross-worker lock rows for coalescing identical in-flight chat requests
+class InflightRequest(Base):
+    __tablename__ = "inflight_requests"
+    key = Column(String(64), primary_key=True)
+    expires_at = Column(Float, nullable=False)
+
+# Server-side chat quota: one token bucket per user and program (used when CHAT_QUOTA_BACKEND=sql)
+class ChatQuota(Base):
+    __tablename__ = "chat_quotas"
+    user_id = Column(Integer, primary_key=True)
+    program = Column(String, primary_key=True)
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)
+
+# Recent conversation turns per user and program (used when CHAT_HISTORY_BACKEND=sql)
+class ConversationTurn(Base):
+    __tablename__ = "conversation_turns"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    program = Column(String, nullable=False)
+    question = Column(Text, nullable=False)
+    reply = Column(Text, nullable=False)
+    tokens = Column(Integer, nullable=False)
+    created_at = Column(Float, nullable=False)
+
+    __table_args__ = (
+        Index("ix_conversation_turns_user_program_id", "user_id", "program", "id"),
+    )
+
+def init_db():
+    """
+    Apply pending schema migrations (see migrate.py). Run at deploy time
+    (python migrate.py), not on import, so starting a worker doesn't wait on schema checks.
+    """
+    from migrate import upgrade
+    upgrade(engine)
 
 # Database session management
 def get_db():
-    """Get database session"""
-    db = SessionLocal()
-    try:
-        return db
-    finally:
-        pass  # Will be closed by the caller
+    """Get the database session for the current request (removed by the app's teardown hook)"""
+    return SessionLocal()
+
+def remove_db(exception=None):
+    """Close and discard the current request's session, returning its connection to the pool"""
+    SessionLocal.remove()
 
 def close_db(db):
     """Safely close database session"""
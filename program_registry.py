@@ -0,0 +1,244 @@
+# program_registry.py
+import gc
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from answer_cache import content_version
+from content_index import ContentIndex
+from content_ingest import read_records, render_records
+
+logger = logging.getLogger(__name__)
+
+
+class ContentSnapshot:
+    """
+    Immutable view of a program's content and its derived index. Reloads build a
+    new snapshot and swap the reference, so a request that already holds one
+    keeps using it undisturbed.
+    """
+
+    def __init__(self, content, index, mtimes, load_seconds):
+        self.content = content
+        self.index = index
+        self.version = content_version(content)
+        self.mtimes = mtimes
+        self.loaded_at = time.time()
+        self.load_seconds = load_seconds
+        self.memory_bytes = sys.getsizeof(content) + index.memory_bytes()
+
+
+class Program:
+    """One learning program from the manifest; content and its index load on first use"""
+
+    def __init__(self, code, name, content_files, model, token_budget, top_k, quota,
+                 title=None, description="", enabled=True, base_dir="."):
+        self.code = code
+        self.name = name
+        self.title = title or f"{name} ({code})"
+        self.description = description
+        self.content_files = content_files
+        self.model = model
+        self.token_budget = token_budget
+        self.top_k = top_k
+        self.quota = quota
+        self.enabled = enabled
+        self.base_dir = base_dir
+        self.reloads = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _paths(self):
+        return [os.path.join(self.base_dir, filename) for filename in self.content_files]
+
+    def _mtimes(self):
+        mtimes = {}
+        for path in self._paths():
+            try:
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except FileNotFoundError:
+                mtimes[path] = None
+        return mtimes
+
+    def _build_snapshot(self):
+        started = time.perf_counter()
+        mtimes = self._mtimes()
+        parts = []
+        for path in self._paths():
+            try:
+                if path.endswith(".jsonl"):
+                    # Per-slide records written by content_ingest.py
+                    parts.append(render_records(read_records(path)))
+                else:
+                    with open(path, "r", encoding="utf-8") as f:
+                        parts.append(f.read())
+            except FileNotFoundError:
+                logger.warning("Content file %s for program %s not found", path, self.code)
+        content = "\n\n".join(parts) if parts else f"{self.code} content not available"
+        index = ContentIndex.from_text(content)
+        return ContentSnapshot(content, index, mtimes, time.perf_counter() - started)
+
+    @property
+    def snapshot(self):
+        """The current content snapshot, loading it on first use"""
+        if self._snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._build_snapshot()
+        return self._snapshot
+
+    @property
+    def content(self):
+        return self.snapshot.content
+
+    @property
+    def index(self):
+        return self.snapshot.index
+
+    @property
+    def version(self):
+        return self.snapshot.version
+
+    @property
+    def loaded(self):
+        return self._snapshot is not None
+
+    def reload_if_changed(self):
+        """Rebuild the snapshot when a content file changed on disk; returns True if it was swapped"""
+        current = self._snapshot
+        if current is None or self._mtimes() == current.mtimes:
+            return False
+        snapshot = self._build_snapshot()
+        with self._lock:
+            if snapshot.version == self._snapshot.version:
+                # Touched but not changed: keep the snapshot, remember the new mtimes
+                self._snapshot.mtimes = snapshot.mtimes
+                return False
+            self._snapshot = snapshot
+            self.reloads += 1
+        logger.info("Reloaded %s content: version %s, %.3f s, %d bytes",
+                    self.code, snapshot.version, snapshot.load_seconds, snapshot.memory_bytes)
+        return True
+
+    def stats(self):
+        snapshot = self._snapshot
+        stats = {"code": self.code, "loaded": snapshot is not None, "reloads": self.reloads}
+        if snapshot is not None:
+            stats.update({
+                "version": snapshot.version,
+                "loaded_at": snapshot.loaded_at,
+                "load_seconds": round(snapshot.load_seconds, 4),
+                "memory_bytes": snapshot.memory_bytes,
+                "chunks": len(snapshot.index.chunks)
+            })
+        return stats
+
+
+class ProgramRegistry:
+    """Programs keyed by code, loaded from a JSON manifest"""
+
+    def __init__(self, programs):
+        self._programs = {program.code: program for program in programs}
+        # Case-insensitive lookup for legacy URLs such as /index_bcc
+        self._by_lower = {code.lower(): program for code, program in self._programs.items()}
+
+    @classmethod
+    def from_manifest(cls, path, settings=None):
+        """
+        Load programs from a manifest. Each entry needs code, name and
+        content_files. model, token_budget, top_k and quota come from the
+        entry itself, else from settings (deployment settings from the
+        environment; None values are ignored), else from the manifest's "defaults".
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        defaults = dict(manifest.get("defaults", {}))
+        defaults.update({key: value for key, value in (settings or {}).items() if value is not None})
+        base_dir = os.path.dirname(os.path.abspath(path))
+
+        programs = []
+        for entry in manifest["programs"]:
+            settings = dict(defaults)
+            settings.update(entry)
+            programs.append(Program(
+                code=settings["code"],
+                name=settings["name"],
+                title=settings.get("title"),
+                description=settings.get("description", ""),
+                content_files=settings.get("content_files", []),
+                model=settings["model"],
+                token_budget=int(settings["token_budget"]),
+                top_k=int(settings["top_k"]),
+                quota=int(settings["quota"]),
+                enabled=settings.get("enabled", True),
+                base_dir=base_dir
+            ))
+        return cls(programs)
+
+    def get(self, code):
+        return self._programs.get(code)
+
+    def find(self, code):
+        """Case-insensitive lookup"""
+        return self._by_lower.get(code.lower())
+
+    def __contains__(self, code):
+        return code in self._programs
+
+    def __iter__(self):
+        return iter(self._programs.values())
+
+    def enabled(self):
+        return [program for program in self._programs.values() if program.enabled]
+
+    def preload(self):
+        """
+        Load every program's content and index now. Call this before the server
+        forks workers (e.g. gunicorn --preload) so workers share the pages
+        copy-on-write; gc.freeze() keeps the collector from touching and so
+        copying them later.
+        """
+        for program in self._programs.values():
+            program.snapshot
+        gc.freeze()
+
+    def reload_changed(self):
+        """Reload every loaded program whose content files changed; returns the codes reloaded"""
+        reloaded = []
+        for program in self._programs.values():
+            try:
+                if program.reload_if_changed():
+                    reloaded.append(program.code)
+            except Exception as e:
+                logger.error("Error reloading %s content: %s", program.code, str(e))
+        return reloaded
+
+
+class ContentWatcher:
+    """Background thread polling content file mtimes and swapping in rebuilt snapshots"""
+
+    def __init__(self, registry, interval):
+        self.registry = registry
+        self.interval = interval
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        """Start the watcher in this process (threads don't survive a fork, so check the pid)"""
+        if self.interval <= 0 or (self._pid == os.getpid() and self._thread.is_alive()):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="content-watcher", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.registry.reload_changed()
@@ -0,0 +1,208 @@
+# prompt_builder.py
+import logging
+import threading
+
+from content_index import count_tokens
+from conversation_memory import is_follow_up
+
+logger = logging.getLogger(__name__)
+
+# Chat formatting overhead: tokens added per message, plus the tokens priming the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+# OpenAI only caches the shared start of prompts at least this long
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+# Earlier questions that no longer fit whole are kept as a one-line note, each clipped to this many words
+SUMMARY_QUESTION_WORDS = 20
+
+# USD per million tokens (input, output)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4-turbo": (10.00, 30.00),
+    "gpt-3.5-turbo": (0.50, 1.50)
+}
+
+
+def parse_prices(value):
+    """Parse price overrides like 'gpt-4o-mini=0.15/0.60' (USD per million input/output tokens)"""
+    prices = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            model, price = item.split("=", 1)
+            input_price, output_price = price.split("/", 1)
+            prices[model.strip()] = (float(input_price), float(output_price))
+    return prices
+
+
+class Prompt:
+    """Messages for one request, with the chunks used and the estimated input size"""
+
+    def __init__(self, messages, chunk_ids, input_tokens, max_output_tokens, history_turns=0,
+                 question=None, content_version=None, follow_up=False):
+        self.messages = messages
+        self.chunk_ids = chunk_ids
+        self.input_tokens = input_tokens
+        self.max_output_tokens = max_output_tokens
+        self.history_turns = history_turns
+        self.question = question
+        self.content_version = content_version
+        # Asked with earlier turns, so the answer may only make sense in that conversation
+        self.follow_up = follow_up
+
+
+class PromptBuilder:
+    """
+    Builds chat prompts within an input token budget. The first system message
+    is a per-program prefix: the instructions, then the opening chunks of the
+    content up to prefix_content_tokens. It is the same for every question on
+    one version of the content; retrieved content, earlier turns of the
+    conversation and the question follow it. Providers only cache prompt
+    prefixes of PROMPT_CACHE_MIN_TOKENS or more, which the instructions alone
+    never reach.
+    """
+
+    def __init__(self, input_budget=3000, max_output_tokens=500, history_budget=800, prefix_content_tokens=0):
+        self.input_budget = input_budget
+        self.max_output_tokens = max_output_tokens
+        self.history_budget = history_budget
+        self.prefix_content_tokens = prefix_content_tokens
+        self._prefixes = {}  # program code -> (content version, text, tokens, chunk ids)
+        self._lock = threading.Lock()
+
+    def prefix(self, program, snapshot):
+        """
+        The static system message for a program, built once per content
+        version. Returns (text, tokens, ids of the chunks it includes).
+        """
+        prefix = self._prefixes.get(program.code)
+        if prefix is None or prefix[0] != snapshot.version:
+            text = (f"You are an assistant that only answers questions based on the following "
+                    f"content for the {program.name} program.")
+            tokens = count_tokens(text) + MESSAGE_OVERHEAD_TOKENS
+            content_index = snapshot.index
+            chunk_ids = []
+            for chunk_id, chunk_tokens in enumerate(content_index.chunk_tokens):
+                if tokens + chunk_tokens > self.prefix_content_tokens:
+                    break
+                chunk_ids.append(chunk_id)
+                tokens += chunk_tokens
+            if chunk_ids:
+                text = f"{text}\n\n{content_index.render(chunk_ids)}"
+            prefix = (snapshot.version, text, tokens, chunk_ids)
+            logger.info("Prompt prefix for %s: %d tokens, %d content chunks%s", program.code, tokens,
+                        len(chunk_ids), "" if tokens >= PROMPT_CACHE_MIN_TOKENS else " (too short for prompt caching)")
+            with self._lock:
+                self._prefixes[program.code] = prefix
+        return prefix[1:]
+
+    def fit_history(self, history, budget):
+        """
+        The most recent turns that fit `budget` tokens, as chat messages. Older
+        turns are reduced to their questions in one note, or dropped when even
+        that doesn't fit. Returns (messages, tokens, turns kept whole).
+        """
+        kept = []
+        used = 0
+        index = len(history)
+        while index > 0:
+            turn = history[index - 1]
+            cost = turn.tokens + 2 * MESSAGE_OVERHEAD_TOKENS
+            if used + cost > budget:
+                break
+            kept.append(turn)
+            used += cost
+            index -= 1
+
+        messages = []
+        if index > 0:
+            questions = "; ".join(" ".join(turn.question.split()[:SUMMARY_QUESTION_WORDS])
+                                  for turn in history[:index])
+            note = "Earlier in this conversation the user asked: " + questions
+            note_tokens = count_tokens(note) + MESSAGE_OVERHEAD_TOKENS
+            if used + note_tokens <= budget:
+                messages.append({"role": "system", "content": note})
+                used += note_tokens
+        for turn in reversed(kept):
+            messages.append({"role": "user", "content": turn.question})
+            messages.append({"role": "assistant", "content": turn.reply})
+        return messages, used, len(kept)
+
+    def build(self, program, snapshot, user_message, history=()):
+        # A question that stands on its own is answered without the conversation, so the
+        # answer can be cached and shared with everyone who asks it
+        if history and not is_follow_up(user_message):
+            history = ()
+        prefix, prefix_tokens, prefix_chunk_ids = self.prefix(program, snapshot)
+        question_tokens = count_tokens(user_message) + MESSAGE_OVERHEAD_TOKENS
+        fixed_tokens = prefix_tokens + question_tokens + MESSAGE_OVERHEAD_TOKENS + REPLY_PRIMING_TOKENS
+
+        history_messages, history_tokens, history_turns = [], 0, 0
+        if history:
+            history_budget = max(0, min(self.history_budget, self.input_budget - fixed_tokens))
+            history_messages, history_tokens, history_turns = self.fit_history(history, history_budget)
+        # The program's content budget, shrunk when a long question or the conversation leaves less room
+        content_budget = max(0, min(program.token_budget, self.input_budget - fixed_tokens - history_tokens))
+
+        # A follow-up like "give me an example" retrieves by the previous question too
+        query = f"{history[-1].question} {user_message}" if history else user_message
+        content_index = snapshot.index
+        chunk_ids = []
+        if content_budget:
+            chunk_ids = content_index.select(query, program.top_k, content_budget, exclude=prefix_chunk_ids)
+        content_tokens = sum(content_index.chunk_tokens[i] for i in chunk_ids)
+
+        messages = [
+            {"role": "system", "content": prefix},
+            {"role": "system", "content": content_index.render(chunk_ids)}
+        ]
+        messages.extend(history_messages)
+        messages.append({"role": "user", "content": user_message})
+        return Prompt(messages, sorted(prefix_chunk_ids + chunk_ids), fixed_tokens + history_tokens + content_tokens, self.max_output_tokens,
+                      history_turns, question=user_message, content_version=snapshot.version,
+                      follow_up=bool(history))
+
+
+class UsageTracker:
+    """Token and cost totals per program, logged per request"""
+
+    def __init__(self, prices=None):
+        self.prices = dict(MODEL_PRICES)
+        self.prices.update(prices or {})
+        self._lock = threading.Lock()
+        self._totals = {}  # program -> counters
+
+    def cost(self, model, input_tokens, output_tokens):
+        input_price, output_price = self.prices.get(model, (0.0, 0.0))
+        return (input_tokens * input_price + output_tokens * output_price) / 1000000
+
+    def record(self, program, model, input_tokens, output_tokens, estimated_input_tokens=None):
+        """
+        Record one model call. input_tokens/output_tokens are the provider's usage
+        figures when it reports them, otherwise our estimates.
+        """
+        cost = self.cost(model, input_tokens, output_tokens)
+        logger.info("LLM usage program=%s model=%s input_tokens=%d (estimated %s) output_tokens=%d cost=$%.6f",
+                    program, model, input_tokens, estimated_input_tokens or input_tokens, output_tokens, cost)
+        with self._lock:
+            totals = self._totals.setdefault(program, {
+                "requests": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0
+            })
+            totals["requests"] += 1
+            totals["input_tokens"] += input_tokens
+            totals["output_tokens"] += output_tokens
+            totals["cost_usd"] += cost
+        return cost
+
+    def to_dict(self):
+        with self._lock:
+            programs = {program: dict(totals, cost_usd=round(totals["cost_usd"], 6))
+                        for program, totals in self._totals.items()}
+        overall = {"requests": 0, "input_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+        for totals in programs.values():
+            for name in overall:
+                overall[name] += totals[name]
+        overall["cost_usd"] = round(overall["cost_usd"], 6)
+        return {"total": overall, "programs": programs}
@@ -0,0 +1,139 @@
+# rate_limiter.py
+import abc
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+# Questions per user per program per window, unless overridden per program
+DEFAULT_LIMIT = 300
+DEFAULT_WINDOW = 24 * 60 * 60
+
+
+def parse_limits(value):
+    """Parse per-program overrides like 'MI=100,Safety=50'"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            program, limit = item.split("=", 1)
+            limits[program.strip()] = int(limit)
+    return limits
+
+
+class TokenBucketLimiter(abc.ABC):
+    """
+    Token bucket per (user, program): each bucket holds up to `limit` tokens and
+    refills continuously at limit/window tokens per second. A question costs one token.
+    """
+
+    def __init__(self, default_limit=DEFAULT_LIMIT, window=DEFAULT_WINDOW, limits=None):
+        self.default_limit = default_limit
+        self.window = window
+        self.limits = limits or {}
+
+    def limit_for(self, program):
+        return self.limits.get(program, self.default_limit)
+
+    def _refilled(self, tokens, updated_at, now, limit):
+        return min(limit, tokens + (now - updated_at) * limit / self.window)
+
+    @abc.abstractmethod
+    def consume(self, user_id, program):
+        """Take one token; returns (allowed, remaining)"""
+
+
+class MemoryRateLimiter(TokenBucketLimiter):
+    """Buckets in a bounded in-process dict, for a single worker"""
+
+    backend = "memory"
+
+    def __init__(self, max_buckets=100000, **kwargs):
+        super().__init__(**kwargs)
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # (user_id, program) -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def consume(self, user_id, program):
+        limit = self.limit_for(program)
+        key = (user_id, program)
+        now = time.time()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (limit, now))
+            tokens = self._refilled(tokens, updated_at, now, limit)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            # Idle buckets are dropped first; a dropped bucket simply starts full again
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        return allowed, int(tokens)
+
+
+class SQLRateLimiter(TokenBucketLimiter):
+    """
+    Buckets in the chat_quotas table, shared by all workers. A question is one
+    atomic UPDATE ... RETURNING that refills and spends in the same statement;
+    a user's first question in a program, or a denied one, adds an INSERT and
+    at most one more UPDATE.
+    """
+
+    backend = "sql"
+
+    def __init__(self, session_factory, model, **kwargs):
+        super().__init__(**kwargs)
+        self.session_factory = session_factory
+        self.model = model
+
+    def consume(self, user_id, program):
+        ChatQuota = self.model
+        limit = self.limit_for(program)
+        now = time.time()
+        refilled = ChatQuota.tokens + (now - ChatQuota.updated_at) * (limit / self.window)
+        refilled = case((refilled > limit, limit), else_=refilled)
+
+        spend = (
+            update(ChatQuota)
+            .where(ChatQuota.user_id == user_id, ChatQuota.program == program, refilled >= 1)
+            .values(tokens=refilled - 1, updated_at=now)
+            .returning(ChatQuota.tokens)
+        )
+
+        db = self.session_factory()
+        try:
+            remaining = db.execute(spend).scalar()
+            if remaining is None:
+                try:
+                    db.execute(insert(ChatQuota).values(
+                        user_id=user_id, program=program, tokens=limit - 1, updated_at=now))
+                    db.commit()
+                    return True, limit - 1
+                except IntegrityError:
+                    # The bucket exists: either it is empty, or a concurrent first request created it
+                    db.rollback()
+                    remaining = db.execute(spend).scalar()
+            if remaining is None:
+                db.rollback()
+                return False, 0
+            db.commit()
+            return True, int(remaining)
+        except Exception as e:
+            db.rollback()
+            logger.error("Rate limiter error: %s", str(e))
+            # Fail open rather than locking everyone out when the database has trouble
+            return True, limit
+        finally:
+            db.close()
+
+
+def create_rate_limiter(backend, session_factory=None, model=None, **kwargs):
+    """Create the configured limiter backend ('memory' or 'sql')"""
+    if backend == "sql":
+        return SQLRateLimiter(session_factory, model, **kwargs)
+    return MemoryRateLimiter(**kwargs)
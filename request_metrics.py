@@ -0,0 +1,286 @@
+# request_metrics.py
+import bisect
+import contextvars
+import logging
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds; the last bucket is +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+TOKEN_BUCKETS = (50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set, in the Prometheus sense"""
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self._series = {}  # sorted label items -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(list(self.buckets) + ["+Inf"], values[:-1]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(key)} {values[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(key)} {cumulative}")
+        return lines
+
+
+def _labels(items):
+    if not items:
+        return ""
+    pairs = []
+    for name, value in items:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class Trace:
+    """Phase timings and query count of one request"""
+
+    def __init__(self, route):
+        self.route = route
+        self.started = time.perf_counter()
+        self.spans = []  # (phase, seconds)
+        self.queries = 0
+        # Set for a streamed response: recorded when its body ends, not when the headers go out
+        self.deferred = False
+
+
+class RequestMetrics:
+    """
+    Request, phase, database and model histograms, rendered in the Prometheus
+    text format. Gauges from other components (pool, cache, writer...) are
+    pulled from collector functions when /metrics is scraped.
+    """
+
+    def __init__(self, prefix="chatbot"):
+        self.prefix = prefix
+        self.requests = Histogram(f"{prefix}_http_request_seconds", "Request latency by route and status",
+                                  LATENCY_BUCKETS)
+        self.phases = Histogram(f"{prefix}_phase_seconds", "Time spent in each phase of a request",
+                                LATENCY_BUCKETS)
+        self.queries = Histogram(f"{prefix}_db_queries_per_request", "Database queries issued per request",
+                                 COUNT_BUCKETS)
+        self.llm_latency = Histogram(f"{prefix}_llm_request_seconds", "Model call latency by program",
+                                     LATENCY_BUCKETS)
+        self.llm_tokens = Histogram(f"{prefix}_llm_tokens", "Tokens per model call by program and direction",
+                                    TOKEN_BUCKETS)
+        self._collectors = OrderedDict()
+
+    def start(self, route):
+        """Begin tracing the current request; returns a token for finish()"""
+        return _current_trace.set(Trace(route))
+
+    def finish(self, token, status, method="GET"):
+        trace = _current_trace.get()
+        _current_trace.reset(token)
+        if trace is None or trace.deferred:
+            return trace
+        self._record(trace, status, method)
+        return trace
+
+    def defer(self):
+        """Keep the current request's trace open after finish(), for a streamed response; returns it"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.deferred = True
+        return trace
+
+    def traced(self, trace, body, status, method="GET"):
+        """
+        Iterate a streamed response body inside its request's trace, so its spans
+        and queries count towards the request, then record the request once the
+        body is done. The trace is set around each step rather than across
+        yields, since the body may be closed from another context.
+        """
+        try:
+            while True:
+                token = _current_trace.set(trace)
+                try:
+                    chunk = next(body)
+                except StopIteration:
+                    return
+                finally:
+                    _current_trace.reset(token)
+                yield chunk
+        finally:
+            body.close()
+            if trace is not None:
+                trace.deferred = False
+                self._record(trace, status, method)
+
+    async def atraced(self, trace, body, status, method="GET"):
+        """Async version of traced, for a streamed ASGI response body"""
+        try:
+            while True:
+                token = _current_trace.set(trace)
+                try:
+                    chunk = await body.__anext__()
+                except StopAsyncIteration:
+                    return
+                finally:
+                    _current_trace.reset(token)
+                yield chunk
+        finally:
+            await body.aclose()
+            if trace is not None:
+                trace.deferred = False
+                self._record(trace, status, method)
+
+    def _record(self, trace, status, method):
+        elapsed = time.perf_counter() - trace.started
+        self.requests.observe(elapsed, route=trace.route, method=method, status=str(status))
+        self.queries.observe(trace.queries, route=trace.route)
+        if trace.spans:
+            logger.debug("%s %s in %.1f ms, %d queries: %s", method, trace.route, elapsed * 1000, trace.queries,
+                         ", ".join(f"{phase}={seconds * 1000:.1f}ms" for phase, seconds in trace.spans))
+
+    @contextmanager
+    def span(self, phase):
+        """Time a phase of the current request"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            trace = _current_trace.get()
+            route = trace.route if trace else "background"
+            self.phases.observe(elapsed, route=route, phase=phase)
+            if trace:
+                trace.spans.append((phase, elapsed))
+
+    def record_query(self, seconds=None):
+        """Count a database query against the current request (installed as a PoolMetrics hook)"""
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.queries += 1
+
+    def record_llm(self, program, seconds, input_tokens, output_tokens):
+        self.llm_latency.observe(seconds, program=program)
+        self.llm_tokens.observe(input_tokens, program=program, direction="input")
+        self.llm_tokens.observe(output_tokens, program=program, direction="output")
+
+    def add_collector(self, name, collect):
+        """collect() returns a flat dict; its numeric values are exported as <prefix>_<name>_<key> gauges"""
+        self._collectors[name] = collect
+
+    def render(self):
+        lines = []
+        for histogram in (self.requests, self.phases, self.queries, self.llm_latency, self.llm_tokens):
+            lines.extend(histogram.render())
+        for name, collect in self._collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", name, str(e))
+                continue
+            for key, value in values.items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                metric = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {metric} gauge")
+                lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread every `interval` seconds while a request
+    runs, and aggregates them as collapsed stacks ("a;b;c count"), the input
+    format of flamegraph tools. Only the thread handling the request is
+    sampled, so it suits the Flask routes (one thread per request).
+    """
+
+    def __init__(self, thread_id, interval=0.005, max_depth=64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+class ProfileStore:
+    """The most recent request profiles, kept in memory for the admin to download"""
+
+    def __init__(self, max_profiles=20):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, route, profiler, seconds):
+        profile_id = uuid.uuid4().hex[:12]
+        header = f"# {route} {seconds * 1000:.1f} ms, {sum(profiler.samples.values())} samples\n"
+        with self._lock:
+            self._profiles[profile_id] = header + profiler.collapsed()
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._profiles.get(profile_id)
+
+
+def flatten(stats, prefix=""):
+    """Flatten nested stats dicts into one level with underscore-joined keys"""
+    flat = {}
+    for key, value in stats.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}_"))
+        else:
+            flat[name] = value
+    return flat
+
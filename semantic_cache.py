@@ -0,0 +1,254 @@
+# semantic_cache.py
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+
+import numpy as np
+
+from answer_cache import CacheStats, normalize_question
+
+logger = logging.getLogger(__name__)
+
+# Words that say how a question is asked rather than what it is about
+STOPWORDS = frozenset("""
+a an and are as at be can could do does for from give how i in is it me my of on or please should
+tell that the this to what whats what's when where which who why will with would you your about explain
+""".split())
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+
+# Words that turn a question around: "when should I not use X" must not get the answer to
+# "when should I use X", however similar the rest is. "Don't", "cannot" and the like count as "not"
+NEGATION_WORDS = frozenset("not no never nor none nothing nobody neither without".split())
+CONTRACTED_NEGATIONS = frozenset("""
+cannot dont doesnt didnt isnt arent wasnt werent cant couldnt shouldnt wouldnt wont mustnt
+""".split())
+
+
+def negations(text):
+    """The negating words of a question; two questions only match when these are the same"""
+    found = set()
+    for word in WORD_RE.findall(normalize_question(text)):
+        if word.endswith("n't") or word in CONTRACTED_NEGATIONS:
+            found.add("not")
+        elif word in NEGATION_WORDS:
+            found.add(word)
+    return frozenset(found)
+
+
+class HashingEmbedder:
+    """
+    Embeds a question as a hashed bag of features: content words, word pairs
+    and character trigrams of each word (so plurals and typos still overlap).
+    Hashing uses crc32, so vectors are stable across processes and restarts.
+    `aliases` maps a word to its expansion (e.g. "mi" -> "motivational
+    interviewing"), so acronyms and spelled-out names match.
+    """
+
+    def __init__(self, dim=512, aliases=None):
+        self.dim = dim
+        self.aliases = aliases or {}
+
+    def features(self, text):
+        words = []
+        for word in WORD_RE.findall(normalize_question(text)):
+            words.extend(self.aliases.get(word, word).split())
+        content = [w for w in words if w not in STOPWORDS] or words
+        for word in content:
+            yield word, 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                yield "#" + padded[i:i + 3], 0.5
+        for first, second in zip(content, content[1:]):
+            yield f"{first} {second}", 1.0
+
+    def embed(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, weight in self.features(text):
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += weight if h & 0x80000000 else -weight
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+class ProgramIndex:
+    """Fixed-capacity matrix of unit question vectors and their answers for one program"""
+
+    def __init__(self, capacity, dim, version=""):
+        self.version = version
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.created_at = np.zeros(capacity, dtype=np.float64)
+        self.last_used = np.zeros(capacity, dtype=np.float64)
+        self.questions = [""] * capacity
+        self.negations = [frozenset()] * capacity
+        self.answers = [""] * capacity
+        self.size = 0
+
+    def search(self, vector, negated):
+        """
+        (slot, cosine similarity) of the closest stored question with the same
+        negations (see negations()), or (None, 0.0)
+        """
+        if not self.size:
+            return None, 0.0
+        scores = self.vectors[:self.size] @ vector
+        for slot in range(self.size):
+            if self.negations[slot] != negated:
+                scores[slot] = -np.inf
+        slot = int(np.argmax(scores))
+        if np.isneginf(scores[slot]):
+            return None, 0.0
+        return slot, float(scores[slot])
+
+    def slot_for_insert(self):
+        """A free slot, else the least recently used one"""
+        if self.size < len(self.vectors):
+            self.size += 1
+            return self.size - 1, False
+        return int(np.argmin(self.last_used)), True
+
+
+def program_aliases(programs):
+    """Acronym program codes and their spelled-out names, e.g. {"mi": "motivational interviewing"}"""
+    return {program.code.lower(): program.name.lower() for program in programs
+            if program.code.isupper() and len(program.code) > 1}
+
+
+class SemanticCache:
+    """
+    Near-duplicate answer cache per program. A question whose embedding has a
+    cosine similarity of at least `threshold` with a stored question gets that
+    question's answer. Each program holds up to `capacity` entries, evicting
+    the least recently used. Entries are tied to a content version (content
+    plus model); when it changes, the program's entries are dropped. With a
+    `path`, the matrices are saved there every `save_every` new entries and at
+    exit, and loaded on startup.
+    """
+
+    def __init__(self, threshold=0.85, capacity=1000, dim=512, ttl=24 * 60 * 60, path=None, save_every=50,
+                 aliases=None):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.path = path
+        self.save_every = save_every
+        self.embedder = HashingEmbedder(dim, aliases)
+        self.stats = CacheStats()
+        self._programs = {}  # program code -> ProgramIndex
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    def _index(self, program, version):
+        index = self._programs.get(program)
+        if index is None or index.version != version:
+            index = self._programs[program] = ProgramIndex(self.capacity, self.embedder.dim, version)
+        return index
+
+    def get(self, program, version, question):
+        """The stored answer for a question close enough to this one, or None"""
+        vector = self.embedder.embed(question)
+        negated = negations(question)
+        now = time.time()
+        with self._lock:
+            index = self._programs.get(program)
+            slot, score = index.search(vector, negated) if index and index.version == version else (None, 0.0)
+            if slot is None or score < self.threshold or now - index.created_at[slot] > self.ttl:
+                self.stats.record("misses")
+                return None
+            index.last_used[slot] = now
+            answer = index.answers[slot]
+        self.stats.record("hits")
+        logger.debug("Semantic cache hit for program %s (similarity %.3f)", program, score)
+        return answer
+
+    def set(self, program, version, question, answer):
+        vector = self.embedder.embed(question)
+        negated = negations(question)
+        now = time.time()
+        with self._lock:
+            index = self._index(program, version)
+            slot, score = index.search(vector, negated)
+            if slot is None or score < self.threshold:
+                slot, evicted = index.slot_for_insert()
+                if evicted:
+                    self.stats.record("evictions")
+            index.vectors[slot] = vector
+            index.created_at[slot] = index.last_used[slot] = now
+            index.questions[slot] = question
+            index.negations[slot] = negated
+            index.answers[slot] = answer
+            self._unsaved += 1
+            save = self.path and self._unsaved >= self.save_every
+        if save:
+            self.save()
+
+    def save(self):
+        """Write each program's entries to <path>/<program>.npz (atomically, via a temporary file)"""
+        if not self.path:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        with self._lock:
+            snapshot = {}
+            for program, index in self._programs.items():
+                n = index.size
+                snapshot[program] = dict(
+                    version=np.array(index.version),
+                    vectors=index.vectors[:n].copy(),
+                    created_at=index.created_at[:n].copy(),
+                    last_used=index.last_used[:n].copy(),
+                    questions=np.array(index.questions[:n], dtype=str),
+                    answers=np.array(index.answers[:n], dtype=str)
+                )
+            self._unsaved = 0
+        for program, arrays in snapshot.items():
+            target = os.path.join(self.path, f"{program}.npz")
+            temporary = f"{target}.{os.getpid()}.tmp"
+            try:
+                with open(temporary, "wb") as f:
+                    np.savez_compressed(f, **arrays)
+                os.replace(temporary, target)
+            except OSError as e:
+                logger.error("Could not save the semantic cache for %s: %s", program, str(e))
+
+    def load(self):
+        if not os.path.isdir(self.path):
+            return
+        now = time.time()
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith(".npz"):
+                continue
+            program = name[:-4]
+            try:
+                with np.load(os.path.join(self.path, name)) as data:
+                    vectors = data["vectors"]
+                    if vectors.ndim != 2 or vectors.shape[1] != self.embedder.dim:
+                        logger.warning("Ignoring semantic cache %s: built with other settings", name)
+                        continue
+                    keep = np.nonzero(now - data["created_at"] <= self.ttl)[0]
+                    # The most recently used entries, if the file holds more than fits
+                    keep = keep[np.argsort(-data["last_used"][keep])][:self.capacity]
+                    index = ProgramIndex(self.capacity, self.embedder.dim, str(data["version"]))
+                    index.size = len(keep)
+                    index.vectors[:index.size] = vectors[keep]
+                    index.created_at[:index.size] = data["created_at"][keep]
+                    index.last_used[:index.size] = data["last_used"][keep]
+                    index.questions[:index.size] = [str(q) for q in data["questions"][keep]]
+                    index.negations[:index.size] = [negations(q) for q in index.questions[:index.size]]
+                    index.answers[:index.size] = [str(a) for a in data["answers"][keep]]
+            except (OSError, KeyError, ValueError) as e:
+                logger.error("Could not load the semantic cache %s: %s", name, str(e))
+                continue
+            with self._lock:
+                self._programs[program] = index
+            logger.info("Loaded %d semantic cache entries for %s", index.size, program)
+
+    def info(self):
+        with self._lock:
+            entries = sum(index.size for index in self._programs.values())
+        return dict(self.stats.to_dict(), entries=entries, capacity=self.capacity, threshold=self.threshold,
+                    dim=self.embedder.dim)
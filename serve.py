@@ -0,0 +1,55 @@
+# serve.py
+"""
+Production entry point.
+
+    python serve.py
+
+SERVER_MODE=asgi (default) runs asgi:app under uvicorn, where /chat awaits the
+model instead of holding a thread. SERVER_MODE=wsgi runs the plain Flask app
+under waitress with WSGI_THREADS threads. Both listen on PORT.
+
+Schema migrations are applied by `python migrate.py` at deploy time;
+DB_INIT_ON_START=true applies them here first instead.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def run():
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", 5000))
+    mode = os.getenv("SERVER_MODE", "asgi")
+
+    if os.getenv("DB_INIT_ON_START", "false").lower() == "true":
+        from models import init_db
+        init_db()
+
+    if mode == "wsgi":
+        import waitress
+        from main import app, start_warm_up
+        start_warm_up()
+        waitress.serve(app, host=host, port=port, threads=int(os.getenv("WSGI_THREADS", 8)))
+        return
+
+    workers = int(os.getenv("WEB_CONCURRENCY", 1))
+    if workers > 1 and os.getenv("PRELOAD_PROGRAM_CONTENT", "false").lower() == "true":
+        # uvicorn starts each worker as a new process, so nothing loaded here is shared
+        logger.warning("PRELOAD_PROGRAM_CONTENT only shares content between workers forked by "
+                       "gunicorn --preload; each of the %d uvicorn workers loads its own copy", workers)
+
+    import uvicorn
+    uvicorn.run(
+        "asgi:app",
+        host=host,
+        port=port,
+        workers=workers,
+        proxy_headers=True,
+        forwarded_allow_ips="*",
+        log_level=os.getenv("UVICORN_LOG_LEVEL", "info")
+    )
+
+
+if __name__ == "__main__":
+    run()
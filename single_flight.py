@@ -0,0 +1,256 @@
+# single_flight.py
+import asyncio
+import logging
+import threading
+import time
+
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+
+class FlightTimeout(Exception):
+    """Raised when a follower gives up waiting for the leading request"""
+
+
+class _Call:
+    """One in-flight upstream call that duplicate requests can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+    def wait(self, timeout):
+        if not self.done.wait(timeout):
+            raise FlightTimeout("Timed out waiting for an identical in-flight request")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Coalesce identical concurrent requests within one worker: the first caller
+    for a key runs the upstream call and concurrent duplicates wait for its
+    result. An optional database lock extends this across workers.
+    """
+
+    def __init__(self, timeout=30, db_lock=None):
+        self.timeout = timeout
+        self.db_lock = db_lock
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """Register interest in key; returns (call, is_leader)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.followers += 1
+                return call, False
+            call = _Call()
+            self._calls[key] = call
+            self.leaders += 1
+            return call, True
+
+    def finish(self, key, call, result=None, error=None):
+        """Publish the leader's result and wake up waiting duplicates"""
+        call.result = result
+        call.error = error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def do(self, key, fn, lookup=None):
+        """
+        Run fn() once per key across concurrent callers. Returns (result, shared)
+        where shared is True when the result came from another request.
+        lookup is used with the database lock: it returns the result stored by
+        a leader in another worker (e.g. from the shared answer cache), or None.
+        """
+        call, leader = self.begin(key)
+        if not leader:
+            return call.wait(self.timeout), True
+
+        result = None
+        error = None
+        shared = False
+        acquired = False
+        try:
+            if self.db_lock:
+                acquired = self.db_lock.acquire(key)
+                if not acquired and lookup:
+                    # Another worker is already asking the same question
+                    result = self.db_lock.wait_for_other_worker(key, lookup, self.timeout)
+                    shared = result is not None
+            if result is None:
+                result = fn()
+            return result, shared
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            if acquired:
+                self.db_lock.release(key)
+            self.finish(key, call, result=result, error=error)
+
+    def info(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {"in_flight": in_flight, "leaders": self.leaders, "followers": self.followers}
+
+
+class AsyncSingleFlight:
+    """
+    SingleFlight for the ASGI app: duplicates await the leader's future
+    instead of blocking a thread. The optional database lock is used the same
+    way, with its blocking calls moved off the event loop.
+    """
+
+    def __init__(self, timeout=30, db_lock=None):
+        self.timeout = timeout
+        self.db_lock = db_lock
+        self._calls = {}
+        self.leaders = 0
+        self.followers = 0
+
+    def begin(self, key):
+        """Register interest in key; returns (future, is_leader)"""
+        future = self._calls.get(key)
+        if future is not None:
+            self.followers += 1
+            return future, False
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self.leaders += 1
+        return future, True
+
+    async def wait(self, future):
+        """Await the leader's result"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise FlightTimeout("Timed out waiting for an identical in-flight request")
+
+    def finish(self, key, future, result=None, error=None):
+        """Publish the leader's result (or error) to waiting duplicates"""
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Mark the exception as retrieved in case nobody was waiting
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def do(self, key, fn, lookup=None):
+        """Await fn() once per key across concurrent callers; returns (result, shared)"""
+        future, leader = self.begin(key)
+        if not leader:
+            return await self.wait(future), True
+
+        acquired = False
+        try:
+            result = None
+            shared = False
+            if self.db_lock:
+                acquired = await asyncio.to_thread(self.db_lock.acquire, key)
+                if not acquired and lookup:
+                    result = await asyncio.to_thread(self.db_lock.wait_for_other_worker, key, lookup, self.timeout)
+                    shared = result is not None
+            if result is None:
+                result = await fn()
+            self.finish(key, future, result=result)
+            return result, shared
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            self.finish(key, future, error=e)
+            raise
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+            if acquired:
+                await asyncio.to_thread(self.db_lock.release, key)
+
+    def info(self):
+        return {"in_flight": len(self._calls), "leaders": self.leaders, "followers": self.followers}
+
+
+class DatabaseFlightLock:
+    """Cross-worker lock rows in the inflight_requests table, with expiry so a crashed worker can't block a key"""
+
+    def __init__(self, session_factory, model, ttl=60, poll_interval=0.2):
+        self.session_factory = session_factory
+        self.model = model
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+
+    def acquire(self, key):
+        """Try to take the lock for key; returns True on success"""
+        InflightRequest = self.model
+        db = self.session_factory()
+        now = time.time()
+        try:
+            db.add(InflightRequest(key=key, expires_at=now + self.ttl))
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+            # Take over a lock left behind by a crashed or stuck worker
+            taken = db.query(InflightRequest).filter(
+                InflightRequest.key == key, InflightRequest.expires_at < now
+            ).update({InflightRequest.expires_at: now + self.ttl}, synchronize_session=False)
+            db.commit()
+            return taken == 1
+        except Exception as e:
+            db.rollback()
+            logger.error("In-flight lock error: %s", str(e))
+            # Don't block the request on lock trouble
+            return True
+        finally:
+            db.close()
+
+    def release(self, key):
+        InflightRequest = self.model
+        db = self.session_factory()
+        try:
+            db.query(InflightRequest).filter(InflightRequest.key == key).delete(synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error("In-flight lock release error: %s", str(e))
+        finally:
+            db.close()
+
+    def is_held(self, key):
+        InflightRequest = self.model
+        db = self.session_factory()
+        try:
+            return db.query(InflightRequest.key).filter(
+                InflightRequest.key == key, InflightRequest.expires_at >= time.time()
+            ).first() is not None
+        finally:
+            db.close()
+
+    def wait_for_other_worker(self, key, lookup, timeout):
+        """
+        Poll lookup() while another worker holds the lock for key, until it
+        publishes a result or releases the lock. Returns the result or None.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            result = lookup()
+            if result is not None or not self.is_held(key):
+                return result
+        return None
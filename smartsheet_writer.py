@@ -0,0 +1,350 @@
+# smartsheet_writer.py
+import contextlib
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: the journal is only locked within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Put on the queue by stop() to wake the writer thread
+_WAKE = object()
+
+
+def pid_alive(pid):
+    if os.name != "posix":
+        return True  # os.kill would end the process on Windows
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+def is_retryable(error):
+    """True for rate limiting (429), server errors (5xx) and network failures"""
+    if getattr(error, "should_retry", False):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is None:
+        result = getattr(getattr(error, "error", None), "result", None)
+        status = getattr(result, "status_code", None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # smartsheet's UnexpectedRequestError is matched by name, so the SDK is only imported when a client is made
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ == "UnexpectedRequestError"
+
+
+class SmartsheetWriter:
+    """
+    Bounded queue of Smartsheet records drained by one background thread.
+    Records are sent in batches (one add_rows call per batch) once batch_size
+    rows are waiting or flush_interval seconds have passed. Failed batches are
+    retried with jittered exponential backoff, then spilled to a JSONL journal
+    that is replayed after the next successful send. A batch Smartsheet
+    rejects outright is resent a row at a time, so only the bad rows are dropped. Workers sharing a journal
+    take a file lock to append to it or claim it for replay.
+    """
+
+    def __init__(self, send_rows, max_queue=1000, batch_size=100, flush_interval=2.0,
+                 max_retries=4, backoff_base=0.5, journal_path="smartsheet_journal.jsonl", stop_timeout=5.0):
+        self.send_rows = send_rows
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.journal_path = journal_path
+        self.stop_timeout = stop_timeout
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._journal_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopping = threading.Event()
+        self._in_flight = []  # the batch the writer thread holds, until it is sent or journaled
+
+        self.stats = {
+            "enqueued": 0,
+            "sent_rows": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "retries": 0,
+            "failed_batches": 0,
+            "rejected_rows": 0,
+            "journaled_rows": 0,
+            "replayed_rows": 0,
+            "last_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0
+        }
+
+    def _count(self, name, value=1):
+        with self._stats_lock:
+            self.stats[name] += value
+
+    def _ensure_started(self):
+        # Start lazily and per process, since threads don't survive a gunicorn fork
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._stats_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="smartsheet-writer", daemon=True)
+            self._thread.start()
+
+    def enqueue(self, record):
+        """Queue a record without blocking; spills to the journal when the queue is full or the writer stopped"""
+        if self._stopping.is_set():
+            self._journal([record])
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+            self._count("enqueued")
+        except queue.Full:
+            logger.warning("Smartsheet queue full, writing record to journal")
+            self._journal([record])
+
+    def _next_batch(self):
+        """Block for the first record, then collect more until the batch is full or the window closes"""
+        batch = self._in_flight = []
+        try:
+            record = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while record is not _WAKE:
+            batch.append(record)
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0 or self._stopping.is_set():
+                break
+            try:
+                record = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        # Pick up anything journaled by a previous run
+        self._replay_journal()
+        while not self._stopping.is_set():
+            batch = self._next_batch()
+            if batch:
+                if self._send_with_retry(batch):
+                    self._in_flight = []
+                    if not self._stopping.is_set():
+                        self._replay_journal()
+                else:
+                    self._journal(batch)
+                    self._in_flight = []
+
+    def _send_with_retry(self, batch):
+        """Send one batch; returns True once it is sent or dealt with, False if it should be journaled"""
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            try:
+                self.send_rows(batch)
+            except Exception as e:
+                if not is_retryable(e):
+                    self._count("failed_batches")
+                    if len(batch) > 1:
+                        logger.warning("Smartsheet rejected batch of %d rows, sending them one at a time: %s",
+                                       len(batch), str(e))
+                        return self._send_singly(batch)
+                    logger.error("Smartsheet rejected row, dropping it: %s", str(e))
+                    self._count("rejected_rows")
+                    return True  # not worth retrying or journaling
+                if attempt == self.max_retries or self._stopping.is_set():
+                    logger.error("Smartsheet unavailable after %d retries: %s", attempt, str(e))
+                    self._count("failed_batches")
+                    return False
+                self._count("retries")
+                delay = self.backoff_base * (2 ** attempt)
+                # Cut short by stop(), which then journals the batch
+                if self._stopping.wait(delay / 2 + random.uniform(0, delay / 2)):
+                    self._count("failed_batches")
+                    return False
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                self.stats["sent_rows"] += len(batch)
+                self.stats["batches"] += 1
+                self.stats["last_batch_size"] = len(batch)
+                self.stats["last_flush_seconds"] = round(elapsed, 4)
+                self.stats["total_flush_seconds"] += elapsed
+            return True
+        return False
+
+    def _send_singly(self, batch):
+        """Send a rejected batch a row at a time, so one bad row doesn't cost the others"""
+        for i, record in enumerate(batch):
+            if not self._send_with_retry([record]):
+                # Smartsheet is unavailable now: keep this row and the rest for the replay
+                self._journal(batch[i:])
+                break
+        return True
+
+    @contextlib.contextmanager
+    def _locked_journal(self):
+        """Hold the journal lock of this process and, where available, the lock file shared by all workers"""
+        with self._journal_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(self.journal_path + ".lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _journal(self, records):
+        """Append records to the local journal so they survive outages and restarts"""
+        with self._locked_journal():
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+        self._count("journaled_rows", len(records))
+
+    def _claim_journal(self):
+        """
+        Move the journal, and any claim left by a worker that died mid-replay, to
+        this process's claim file; returns its path, or None if there is nothing to replay
+        """
+        replay_path = f"{self.journal_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.replay"
+        with self._locked_journal():
+            claimed = []
+            for path in glob.glob(glob.escape(self.journal_path) + ".*.replay"):
+                pid = path[len(self.journal_path) + 1:].split(".")[0]
+                if pid.isdigit() and int(pid) != os.getpid() and not pid_alive(int(pid)):
+                    claimed.append(path)
+            if os.path.exists(self.journal_path):
+                claimed.append(self.journal_path)
+            if not claimed:
+                return None
+            with open(replay_path, "a", encoding="utf-8") as out:
+                for path in claimed:
+                    with open(path, "r", encoding="utf-8") as f:
+                        out.write(f.read())
+                    os.remove(path)
+        return replay_path
+
+    def _replay_journal(self):
+        """Resend journaled records in batches; anything still failing goes back to the journal"""
+        replay_path = self._claim_journal()
+        if replay_path is None:
+            return
+
+        records = []
+        with open(replay_path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # e.g. the last line of a journal cut short by a crash
+                    logger.error("Skipping unreadable line %d of the Smartsheet journal: %r", number, line[:200])
+
+        for i in range(0, len(records), self.batch_size):
+            batch = records[i:i + self.batch_size]
+            if not self._send_with_retry(batch):
+                self._journal(records[i:])
+                break
+            self._count("replayed_rows", len(batch))
+        os.remove(replay_path)
+
+    def stop(self, timeout=None):
+        """
+        Stop the writer: the batch it holds is sent (without further retries) or
+        journaled, and whatever is still queued is journaled. Waits up to
+        `timeout` seconds (stop_timeout by default) for the thread.
+        """
+        timeout = self.stop_timeout if timeout is None else timeout
+        self._stopping.set()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            try:
+                self._queue.put_nowait(_WAKE)
+            except queue.Full:
+                pass  # the thread isn't waiting for records
+            thread.join(timeout)
+            if thread.is_alive():
+                # Still sending; journal its batch too, so it isn't lost when the process exits
+                # (it is sent twice if that send still succeeds)
+                logger.warning("Smartsheet writer did not stop within %.1f s, journaling its batch", timeout)
+                in_flight, self._in_flight = self._in_flight, []
+                if in_flight:
+                    self._journal(in_flight)
+        remaining = []
+        while True:
+            try:
+                record = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if record is not _WAKE:
+                remaining.append(record)
+        if remaining:
+            self._journal(remaining)
+
+    def metrics(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        batches = stats["batches"]
+        stats["queue_depth"] = self._queue.qsize()
+        stats["avg_batch_size"] = round(stats["sent_rows"] / batches, 2) if batches else 0.0
+        total_flush_seconds = stats.pop("total_flush_seconds")
+        stats["avg_flush_seconds"] = round(total_flush_seconds / batches, 4) if batches else 0.0
+        return stats
+
+
+class StubApiError(Exception):
+    """Error raised by StubSmartsheetClient, shaped like an HTTP error"""
+
+    def __init__(self, status_code):
+        super().__init__(f"Stub Smartsheet error {status_code}")
+        self.status_code = status_code
+
+
+class StubSmartsheetClient:
+    """
+    Local stand-in for smartsheet.Smartsheet that records rows in memory.
+    fail_times makes the next N add_rows calls fail with fail_status, and
+    error_rate makes any call fail with that probability; latency adds a
+    delay to every call.
+    """
+
+    def __init__(self, latency=0.0, fail_times=0, fail_status=503, error_rate=0.0):
+        self.latency = latency
+        self.fail_times = fail_times
+        self.fail_status = fail_status
+        self.error_rate = error_rate
+        self.rows = []
+        self.calls = 0
+        self.Sheets = self
+
+    def add_rows(self, sheet_id, rows):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.fail_times > 0:
+            self.fail_times -= 1
+            raise StubApiError(self.fail_status)
+        if self.error_rate and random.random() < self.error_rate:
+            raise StubApiError(self.fail_status)
+        self.rows.extend(rows)
+        return rows
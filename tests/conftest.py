@@ -0,0 +1,78 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# models and main read their settings when imported: point them at a throwaway
+# database and the offline backends, with the optional caches off
+_workdir = tempfile.mkdtemp(prefix="tests-")
+os.environ.update(
+    DATABASE_URL="sqlite:///" + os.path.join(_workdir, "app.db"),
+    LLM_BACKEND="fake",
+    SMARTSHEET_STUB="true",
+    SMARTSHEET_JOURNAL_PATH=os.path.join(_workdir, "smartsheet_journal.jsonl"),
+    ANSWER_CACHE_BACKEND="none",
+    SEMANTIC_CACHE_ENABLED="false",
+    FAQ_ENABLED="false",
+    CHAT_HISTORY_BACKEND="none",
+    WARM_UP_ENABLED="false",
+    CONTENT_RELOAD_INTERVAL="0",
+    AUTH_USERNAME="admin",
+    AUTH_PASSWORD="admin",
+    FLASK_SECRET_KEY="tests",
+    LOG_LEVEL="WARNING"
+)
+
+
+class FakeClock:
+    """Stands in for the time module of the code under test; advance() moves time forward"""
+
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """An empty SQLite database of its own for each test"""
+    engine = create_engine("sqlite:///" + str(tmp_path / "test.db"))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_factory(engine):
+    """Sessions on `engine`, with every table of models.py created"""
+    from models import Base
+
+    Base.metadata.create_all(engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+@pytest.fixture(scope="module")
+def main():
+    """The app module, imported once its tables exist in the test database"""
+    import models
+    models.init_db()
+    import main
+    return main
@@ -0,0 +1,154 @@
+# tests/test_answer_cache.py
+import pytest
+from sqlalchemy import event
+
+import answer_cache
+from answer_cache import SQLAnswerCache, create_answer_cache, make_key
+from models import CachedAnswer
+
+
+@pytest.fixture(params=["memory", "sql"])
+def make_cache(request, clock, monkeypatch):
+    monkeypatch.setattr(answer_cache, "time", clock)
+
+    def make(max_bytes=1000, ttl=3600):
+        if request.param == "sql":
+            session_factory = request.getfixturevalue("session_factory")
+            # Evict to exactly the cap, like the memory backend
+            return SQLAnswerCache(session_factory, CachedAnswer, max_bytes, ttl, evict_to=1.0)
+        return create_answer_cache("memory", max_bytes, ttl)
+    return make
+
+
+def test_key_ignores_case_spacing_and_trailing_punctuation():
+    assert make_key("BCC", "What is  GROW?", "v1", "m") == make_key("BCC", "what is grow", "v1", "m")
+    assert make_key("BCC", "What is GROW?", "v1", "m") != make_key("BCC", "What is GROW?", "v2", "m")
+    assert make_key("BCC", "What is GROW?", "v1", "m") != make_key("MI", "What is GROW?", "v1", "m")
+
+
+def test_get_returns_what_was_set(make_cache):
+    cache = make_cache()
+    assert cache.get("a") is None
+    cache.set("a", "answer a", program="BCC")
+    assert cache.get("a") == "answer a"
+    info = cache.info()
+    assert (info["hits"], info["misses"], info["entries"]) == (1, 1, 1)
+
+
+def test_least_recently_used_is_evicted_over_the_size_cap(make_cache, clock):
+    cache = make_cache(max_bytes=30)
+    for key in ("a", "b", "c"):
+        cache.set(key, key * 10)
+        clock.advance(1)
+    cache.get("a")  # a is now more recent than b
+    clock.advance(1)
+    cache.set("d", "d" * 10)
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in ("a", "c", "d")] == ["a" * 10, "c" * 10, "d" * 10]
+    info = cache.info()
+    assert info["evictions"] == 1
+    assert info["bytes"] <= 30
+
+
+def test_expired_entries_are_not_returned(make_cache, clock):
+    cache = make_cache(ttl=60)
+    cache.set("a", "answer")
+    clock.advance(61)
+    assert cache.get("a") is None
+    assert cache.info()["entries"] == 0
+
+
+def test_answer_larger_than_the_cache_is_not_stored(make_cache):
+    cache = make_cache(max_bytes=10)
+    cache.set("a", "x" * 11)
+    assert cache.get("a") is None
+
+
+def test_replacing_an_entry_keeps_the_size_right(make_cache):
+    cache = make_cache(max_bytes=100)
+    cache.set("a", "x" * 40)
+    cache.set("a", "y" * 20)
+    assert cache.get("a") == "y" * 20
+    assert cache.info()["bytes"] == 20
+
+
+def test_none_backend_disables_the_cache():
+    assert create_answer_cache("none", 1000, 60) is None
+
+
+@pytest.fixture
+def statements(engine):
+    """The SQL statements run on `engine` from here on"""
+    executed = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: executed.append(statement))
+    return executed
+
+
+@pytest.fixture
+def make_sql_cache(session_factory, clock, monkeypatch):
+    monkeypatch.setattr(answer_cache, "time", clock)
+    return lambda max_bytes=1000, **kwargs: SQLAnswerCache(session_factory, CachedAnswer, max_bytes, 3600, **kwargs)
+
+
+def last_used(session_factory, key):
+    with session_factory() as db:
+        return db.get(CachedAnswer, key).last_used_at
+
+
+def test_hits_are_written_back_in_batches(make_sql_cache, session_factory, statements, clock):
+    cache = make_sql_cache(touch_batch=3, touch_interval=60)
+    for key in ("a", "b", "c"):
+        cache.set(key, "answer")
+    set_at = clock.time()
+    clock.advance(1)
+    del statements[:]
+    updates = lambda: [statement for statement in statements if statement.startswith("UPDATE")]
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    assert not updates()
+    assert last_used(session_factory, "a") == set_at
+    cache.get("c")
+    assert len(updates()) == 1
+    assert [last_used(session_factory, key) for key in ("a", "b", "c")] == [clock.time()] * 3
+
+
+def test_hits_are_written_back_after_the_interval(make_sql_cache, session_factory, clock):
+    cache = make_sql_cache(touch_batch=100, touch_interval=30)
+    cache.set("a", "answer")
+    clock.advance(31)
+    cache.get("a")
+    assert last_used(session_factory, "a") == clock.time()
+
+
+def test_table_is_only_recounted_when_the_running_total_passes_the_cap(make_sql_cache, statements, clock):
+    cache = make_sql_cache(max_bytes=30, evict_interval=3600)
+    cache.set("a", "a" * 10)
+    recounts = lambda: len([statement for statement in statements if "sum(" in statement.lower()])
+    assert recounts() == 1
+    cache.set("b", "b" * 10)
+    cache.set("c", "c" * 10)
+    assert recounts() == 1
+    cache.set("d", "d" * 10)
+    assert recounts() == 2
+    # Evicted down to 90% of the cap, so the next set fits without another recount
+    cache.set("e", "e" * 10)
+    assert recounts() == 2
+    assert cache.info()["bytes"] == 30
+    assert [cache.get(key) is None for key in "abcde"] == [True, True, False, False, False]
+
+
+def test_entries_added_by_another_worker_are_evicted_on_schedule(make_sql_cache, session_factory, clock):
+    cache = make_sql_cache(max_bytes=30, evict_interval=60)
+    cache.set("a", "a" * 10)
+    clock.advance(1)
+    with session_factory() as db:  # another worker fills the table without this one noticing
+        for key in ("b", "c", "d"):
+            db.add(CachedAnswer(key=key, answer=key * 10, size=10, created_at=clock.time(), last_used_at=clock.time()))
+        db.commit()
+    cache.set("e", "e" * 10)
+    assert cache.info()["bytes"] == 50
+    clock.advance(60)
+    cache.set("f", "f" * 10)
+    assert cache.info()["bytes"] <= 30
+    assert cache.get("a") is None
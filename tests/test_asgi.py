@@ -0,0 +1,89 @@
+# tests/test_asgi.py
+import asyncio
+import json
+
+import pytest
+
+from llm_client import FakeBackend, LLMClient
+
+
+@pytest.fixture(scope="module")
+def asgi(main):
+    import asgi
+    return asgi
+
+
+@pytest.fixture
+def cookie(main):
+    """Cookie header of a logged-in user, whose session was set by the Flask routes"""
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Async", "email": "async@example.org"})
+    client.post("/login", data={"last_name": "Async", "email": "async@example.org"})
+    name = main.app.config["SESSION_COOKIE_NAME"]
+    return f"{name}={client.get_cookie(name).value}"
+
+
+async def post(app, path, body, cookie):
+    """Send one request through the ASGI app; returns (status, body text)"""
+    scope = {"type": "http", "asgi": {"version": "3.0", "spec_version": "2.4"}, "http_version": "1.1",
+             "method": "POST", "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"",
+             "root_path": "", "server": ("testserver", 80), "client": ("127.0.0.1", 1234),
+             "headers": [(b"content-type", b"application/json"), (b"cookie", cookie.encode())]}
+    received = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        if received:
+            return received.pop(0)
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    status = next(message["status"] for message in sent if message["type"] == "http.response.start")
+    text = b"".join(message.get("body", b"") for message in sent if message["type"] == "http.response.body")
+    return status, text.decode()
+
+
+def events(text):
+    """The (event, data) pairs of an SSE body"""
+    pairs = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        pairs.append((lines.get("event"), json.loads(lines["data"])))
+    return pairs
+
+
+def test_chat_stream_is_served_natively(main, asgi, cookie, monkeypatch):
+    backend = FakeBackend(reply="one two three four five six seven", stream_words=2)
+    monkeypatch.setattr(main, "llm_client", LLMClient(backend))
+    status, text = asyncio.run(post(asgi.app, "/chat/stream", {"message": "What is the GROW model?"}, cookie))
+    assert status == 200
+    pairs = events(text)
+    assert "".join(data["delta"] for event, data in pairs if event is None).strip() == backend.reply
+    assert pairs[-1] == ("done", {"reply": backend.reply})
+
+
+def test_chat_stream_needs_a_session_and_a_question(asgi, cookie):
+    assert asyncio.run(post(asgi.app, "/chat/stream", {"message": "hi"}, "session=bad"))[0] == 401
+    assert asyncio.run(post(asgi.app, "/chat/stream", {}, cookie))[0] == 400
+
+
+def test_identical_streams_share_one_model_call(main, asgi, cookie, monkeypatch):
+    backend = FakeBackend(latency=0.2)
+    monkeypatch.setattr(main, "llm_client", LLMClient(backend))
+
+    async def ask_twice():
+        question = {"message": "How do I give feedback?"}
+        return await asyncio.gather(*(post(asgi.app, "/chat/stream", question, cookie) for _ in range(2)))
+
+    results = asyncio.run(ask_twice())
+    assert backend.calls == 1
+    assert all(events(text)[-1] == ("done", {"reply": backend.reply}) for _, text in results)
+
+
+def test_model_outage_ends_the_stream_with_the_unavailable_reply(main, asgi, cookie, monkeypatch):
+    monkeypatch.setattr(main, "llm_client", LLMClient(FakeBackend(fail_times=10), max_retries=0))
+    _, text = asyncio.run(post(asgi.app, "/chat/stream", {"message": "What is resistance?"}, cookie))
+    assert events(text)[-1] == ("done", {"reply": main.LLM_UNAVAILABLE_REPLY})
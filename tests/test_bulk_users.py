@@ -0,0 +1,77 @@
+# tests/test_bulk_users.py
+import base64
+import io
+import json
+
+import pytest
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"admin:admin").decode()}
+
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def import_users(client, emails, program="BCC"):
+    body = "last_name,email,program\n" + "".join(f"Bulk,{email},{program}\n" for email in emails)
+    response = client.post("/import_users", headers=AUTH, data={"file": (io.BytesIO(body.encode()), "users.csv")},
+                           content_type="multipart/form-data")
+    assert response.status_code == 200
+    return ndjson(response)[-1]
+
+
+def test_import_then_delete_by_email(client):
+    emails = [f"delete{i}@example.org" for i in range(5)]
+    assert import_users(client, emails)["inserted"] == 5
+    response = client.post("/bulk_delete_users", headers=AUTH, query_string={"chunk_size": 2},
+                           json={"emails": emails + ["nobody@example.org"], "confirm": 6})
+    lines = ndjson(response)
+    assert len(lines) == 4  # three chunks of up to 2 emails, then the summary
+    assert lines[-1]["deleted"] == 5 and lines[-1]["errors"] == 1 and lines[-1]["done"]
+
+
+def test_delete_program_needs_the_program_as_confirmation(client):
+    import_users(client, ["safety1@example.org", "safety2@example.org"], program="Safety")
+    response = client.post("/bulk_delete_users", headers=AUTH, json={"program": "Safety", "confirm": 2})
+    assert response.status_code == 400
+    response = client.post("/bulk_delete_users", headers=AUTH, json={"program": "Safety", "confirm": "Safety"})
+    assert ndjson(response)[-1]["deleted"] >= 2
+
+
+def test_form_posts_are_refused(client):
+    # A cross-site form can send this with the browser's cached credentials; JSON needs a preflight
+    response = client.post("/bulk_delete_users", headers=AUTH, data={"program": "BCC", "confirm": "BCC"})
+    assert response.status_code == 415
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"emails": ["a@example.org", "b@example.org"]}, "confirm"),
+    ({"emails": ["a@example.org", "b@example.org"], "confirm": 1}, "confirm"),
+    ({"emails": ["a@example.org"], "confirm": True}, "confirm"),
+    ({"emails": "a@example.org", "confirm": 1}, "list"),
+    ({"emails": [1, 2], "confirm": 2}, "list"),
+    ({"program": "XX", "confirm": "XX"}, "Unknown program"),
+    ({}, "either"),
+    ({"emails": ["a@example.org"], "confirm": 1, "chunk_size": "ten"}, "chunk_size"),
+    ({"emails": ["a@example.org"], "confirm": 1, "chunk_size": 0}, "chunk_size"),
+    ({"emails": ["a@example.org"], "confirm": 1, "chunk_size": 2.5}, "chunk_size"),
+    ({"emails": ["a@example.org"], "confirm": 1, "chunk_size": 100000}, "chunk_size"),
+])
+def test_bad_requests_are_rejected_before_streaming(client, body, error):
+    response = client.post("/bulk_delete_users", headers=AUTH, json=body)
+    assert response.status_code == 400
+    assert error in response.get_json()["error"]
+
+
+def test_bad_chunk_size_in_the_query_string(client):
+    response = client.post("/bulk_delete_users", headers=AUTH, query_string={"chunk_size": "-1"},
+                           json={"emails": ["a@example.org"], "confirm": 1})
+    assert response.status_code == 400
+    response = client.post("/import_users", headers=AUTH, query_string={"chunk_size": "x"},
+                           data="last_name,email\n", content_type="text/csv")
+    assert response.status_code == 400
@@ -0,0 +1,52 @@
+# tests/test_content_index.py
+from content_index import ContentIndex, chunk_content, tokenize
+
+CONTENT = """The GROW model
+
+GROW stands for Goal, Reality, Options and Will. Coaches use it to structure a conversation.
+
+Giving feedback
+
+Feedback should be specific, timely and about behaviour rather than the person.
+
+Motivational interviewing
+
+Open questions, affirmations, reflections and summaries help people talk about change."""
+
+
+def test_tokenize_drops_stopwords_and_punctuation():
+    assert tokenize("What is the GROW model?") == ["grow", "model"]
+
+
+def test_short_paragraphs_are_merged_and_long_ones_split():
+    assert chunk_content(CONTENT, chunk_words=1000) == [CONTENT]
+    long_paragraph = "\n".join(f"line {i} " + "word " * 8 for i in range(30))
+    chunks = chunk_content(long_paragraph, chunk_words=50)
+    assert len(chunks) > 1
+    assert all(len(chunk.split()) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == long_paragraph.split()
+
+
+def test_best_matching_chunk_ranks_first():
+    index = ContentIndex.from_text(CONTENT, chunk_words=15)
+    best, _ = index.search("how do I give feedback?", top_k=1)[0]
+    assert "Feedback should be specific" in index.chunks[best]
+
+
+def test_select_stays_within_the_token_budget():
+    index = ContentIndex.from_text(CONTENT, chunk_words=15)
+    budget = min(index.chunk_tokens) + 1
+    selected = index.select("GROW feedback questions", top_k=5, token_budget=budget)
+    assert len(selected) == 1
+    assert sum(index.chunk_tokens[i] for i in selected) <= budget
+
+
+def test_select_returns_chunks_in_document_order():
+    index = ContentIndex.from_text(CONTENT, chunk_words=15)
+    selected = index.select("reflections feedback GROW", top_k=3, token_budget=10000)
+    assert selected == sorted(selected) and len(selected) == 3
+
+
+def test_unmatched_query_falls_back_to_the_opening_chunks():
+    index = ContentIndex.from_text(CONTENT, chunk_words=15)
+    assert index.select("zebra", top_k=2, token_budget=10000) == [0, 1]
@@ -0,0 +1,82 @@
+# tests/test_content_ingest.py
+import pytest
+
+from content_ingest import extract_docx, extract_pptx, find_sources, ingest, read_records, render_records, write_records
+
+
+def make_deck(path, slides):
+    """A .pptx with one title-and-content slide per (title, lines), plus a table on the last slide"""
+    pptx = pytest.importorskip("pptx")
+    from pptx.util import Inches
+
+    presentation = pptx.Presentation()
+    for title, lines in slides:
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = title
+        slide.placeholders[1].text_frame.text = "\n".join(lines)
+    table = slide.shapes.add_table(2, 2, Inches(1), Inches(5), Inches(4), Inches(1)).table
+    for row, cells in enumerate([("Step", "Question"), ("Goal", "What do you want?")]):
+        for column, text in enumerate(cells):
+            table.cell(row, column).text = text
+    presentation.save(str(path))
+
+
+def test_pptx_gives_one_record_per_slide(tmp_path):
+    path = tmp_path / "grow.pptx"
+    make_deck(path, [("The GROW model", ["Goal", "Reality", "Options", "Will"]), ("Feedback", ["Be specific"])])
+    records = extract_pptx(str(path))
+    assert records[0] == {"slide": 1, "title": "The GROW model", "text": "Goal\nReality\nOptions\nWill"}
+    assert records[1]["title"] == "Feedback"
+    assert records[1]["text"] == "Be specific\nStep | Question\nGoal | What do you want?"
+
+
+def test_docx_gives_one_record_per_heading(tmp_path):
+    docx = pytest.importorskip("docx")
+    document = docx.Document()
+    document.add_paragraph("An introduction before any heading.")
+    document.add_heading("Reflective listening", level=1)
+    document.add_paragraph("Repeat back what you heard.")
+    document.add_paragraph("")
+    document.add_heading("Open questions", level=2)
+    document.add_paragraph("Ask what and how.")
+    path = tmp_path / "mi.docx"
+    document.save(str(path))
+    assert extract_docx(str(path)) == [
+        {"slide": 1, "title": "", "text": "An introduction before any heading."},
+        {"slide": 2, "title": "Reflective listening", "text": "Repeat back what you heard."},
+        {"slide": 3, "title": "Open questions", "text": "Ask what and how."},
+    ]
+
+
+def test_only_changed_decks_are_extracted_again(tmp_path):
+    decks, cache = tmp_path / "decks", str(tmp_path / "cache")
+    decks.mkdir()
+    make_deck(decks / "a.pptx", [("A", ["first"])])
+    make_deck(decks / "b.pptx", [("B", ["second"])])
+    records, stats = ingest(str(decks), cache, workers=2)
+    assert (stats["files"], stats["extracted_files"], stats["cached_files"]) == (2, 2, 0)
+    assert [(record["deck"], record["title"]) for record in records] == [("a.pptx", "A"), ("b.pptx", "B")]
+
+    make_deck(decks / "b.pptx", [("B", ["second, revised"])])
+    again, stats = ingest(str(decks), cache, workers=2)
+    assert (stats["extracted_files"], stats["cached_files"]) == (1, 1)
+    assert again[0] == records[0] and "revised" in again[1]["text"]
+
+
+def test_a_broken_file_is_skipped(tmp_path):
+    make_deck(tmp_path / "good.pptx", [("Good", ["fine"])])
+    (tmp_path / "broken.pptx").write_bytes(b"not a zip file")
+    (tmp_path / "~$good.pptx").write_bytes(b"office lock file")
+    assert [path.rsplit("/", 1)[-1] for path in find_sources(str(tmp_path))] == ["broken.pptx", "good.pptx"]
+    records, stats = ingest(str(tmp_path), str(tmp_path / "cache"), workers=1)
+    assert stats["failed_files"] == 1 and [record["deck"] for record in records] == ["good.pptx"]
+
+
+def test_records_round_trip_to_program_content(tmp_path):
+    records = [{"deck": "a.pptx", "slide": 1, "title": "GROW", "text": "Goal\nReality", "extra": "dropped"},
+               {"deck": "a.pptx", "slide": 2, "title": "", "text": ""}]
+    path = str(tmp_path / "content.jsonl")
+    write_records(records, path)
+    assert read_records(path)[0] == {"deck": "a.pptx", "slide": 1, "title": "GROW", "text": "Goal\nReality"}
+    # Empty slides add nothing to the content
+    assert render_records(read_records(path)) == "GROW\nGoal\nReality"
@@ -0,0 +1,115 @@
+# tests/test_conversation_memory.py
+import pytest
+
+import conversation_memory
+from conversation_memory import ConversationStore, create_conversation_store, history_key, is_follow_up
+from models import ConversationTurn
+
+
+@pytest.fixture(params=["memory", "sql"])
+def make_store(request, clock, monkeypatch):
+    monkeypatch.setattr(conversation_memory, "time", clock)
+
+    def make(**kwargs):
+        if request.param == "sql":
+            session_factory = request.getfixturevalue("session_factory")
+            return create_conversation_store("sql", session_factory=session_factory, model=ConversationTurn, **kwargs)
+        return create_conversation_store("memory", **kwargs)
+    return make
+
+
+def questions(turns):
+    return [turn.question for turn in turns]
+
+
+def test_history_is_the_last_turns_oldest_first(make_store):
+    store = make_store(max_turns=3)
+    for i in range(5):
+        store.append(1, "BCC", f"question {i}", f"reply {i}")
+    assert questions(store.history(1, "BCC")) == ["question 2", "question 3", "question 4"]
+    assert store.history(1, "BCC")[-1].reply == "reply 4"
+
+
+def test_conversations_are_per_user_and_program(make_store):
+    store = make_store()
+    store.append(1, "BCC", "about BCC", "reply")
+    store.append(1, "MI", "about MI", "reply")
+    store.append(2, "BCC", "from user 2", "reply")
+    assert questions(store.history(1, "BCC")) == ["about BCC"]
+    assert questions(store.history(1, "MI")) == ["about MI"]
+    assert questions(store.history(2, "MI")) == []
+
+
+def test_conversation_is_forgotten_after_a_break(make_store, clock):
+    store = make_store(idle_ttl=60)
+    store.append(1, "BCC", "first", "reply")
+    clock.advance(30)
+    store.append(1, "BCC", "second", "reply")
+    clock.advance(61)
+    assert store.history(1, "BCC") == []
+    store.append(1, "BCC", "after the break", "reply")
+    assert questions(store.history(1, "BCC")) == ["after the break"]
+
+
+def test_long_turns_are_clipped(make_store):
+    store = make_store(max_chars=10)
+    store.append(1, "BCC", "q" * 50, "r" * 50)
+    turn = store.history(1, "BCC")[0]
+    assert (turn.question, turn.reply) == ("q" * 10, "r" * 10)
+    assert turn.tokens > 0
+
+
+def test_memory_store_drops_the_least_recently_used_conversation():
+    store = create_conversation_store("memory", max_sessions=2)
+    for user_id in (1, 2, 3):
+        store.append(user_id, "BCC", "question", "reply")
+    assert store.history(1, "BCC") == []
+    assert store.info()["evictions"] == 1
+
+
+def test_sql_store_keeps_at_most_max_turns_rows(session_factory):
+    store = create_conversation_store("sql", session_factory=session_factory, model=ConversationTurn, max_turns=2)
+    for i in range(5):
+        store.append(1, "BCC", f"question {i}", "reply")
+    assert store.info()["turns"] == 2
+
+
+def test_a_store_must_implement_history_and_append():
+    class Incomplete(ConversationStore):
+        def history(self, user_id, program):
+            return []
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_no_store_when_history_is_off():
+    assert create_conversation_store("none") is None
+
+
+@pytest.mark.parametrize("question", [
+    "Why is that?",
+    "why?",
+    "And for managers?",
+    "What about the second step?",
+    "Can you give me an example",
+    "Tell me more about them",
+])
+def test_follow_ups(question):
+    assert is_follow_up(question)
+
+
+@pytest.mark.parametrize("question", [
+    "What is the GROW model?",
+    "How do I give feedback to a new coach?",
+    "When should I use reflective listening?",
+])
+def test_standalone_questions(question):
+    assert not is_follow_up(question)
+
+
+def test_history_key():
+    turns = [conversation_memory.Turn("q", "r")]
+    assert history_key([]) == ""
+    assert history_key(turns) == history_key([conversation_memory.Turn("q", "r")])
+    assert history_key(turns) != history_key([conversation_memory.Turn("q", "other")])
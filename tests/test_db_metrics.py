@@ -0,0 +1,72 @@
+# tests/test_db_metrics.py
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from db_metrics import PoolMetrics, timed_pool_class
+
+
+@pytest.fixture
+def metrics(tmp_path):
+    metrics = PoolMetrics(slow_query_ms=10000)
+    engine = create_engine("sqlite:///" + str(tmp_path / "metrics.db"), poolclass=timed_pool_class(metrics),
+                           pool_size=1, max_overflow=0, pool_timeout=5)
+    metrics.install(engine)
+    metrics.engine = engine
+    yield metrics
+    engine.dispose()
+
+
+def test_queries_and_checkouts_are_counted(metrics):
+    seen = []
+    metrics.on_query = seen.append
+    with metrics.engine.connect() as conn:
+        conn.execute(text("select 1"))
+        conn.execute(text("select 2"))
+        assert metrics.checked_out == 1
+    stats = metrics.to_dict()
+    assert stats["queries"] == 2 and len(seen) == 2
+    assert stats["checkouts"] == 1 and stats["checked_out"] == 0 and stats["peak_checked_out"] == 1
+    assert stats["connections_opened"] == 1
+    assert stats["pool_size"] == 1 and stats["pool_max_overflow"] == 0
+
+
+def test_slow_queries_are_counted_and_logged(metrics, caplog):
+    metrics.slow_query_ms = 0
+    with metrics.engine.connect() as conn:
+        conn.execute(text("select   1"))
+    assert metrics.to_dict()["slow_queries"] == 1
+    assert "Slow query" in caplog.text and "select 1" in caplog.text
+
+
+def test_failed_query_leaves_no_start_time_behind(metrics):
+    with metrics.engine.connect() as conn:
+        for _ in range(3):
+            with pytest.raises(OperationalError):
+                conn.execute(text("select * from missing_table"))
+            conn.rollback()
+        assert conn.info.get("query_started") == []
+        conn.execute(text("select 1"))
+    # Only statements that completed are counted
+    assert metrics.to_dict()["queries"] == 1
+
+
+def test_time_waiting_for_a_connection_is_recorded(metrics):
+    held = metrics.engine.connect()
+    waited = threading.Thread(target=lambda: metrics.engine.connect().close())
+    waited.start()
+    time.sleep(0.1)
+    held.close()
+    waited.join()
+    assert metrics.to_dict()["checkout_wait_max_ms"] >= 50
+
+
+def test_requests_return_their_connections(main):
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Pool", "email": "pool@example.org"})
+    client.post("/login", data={"last_name": "Pool", "email": "pool@example.org"})
+    client.get("/set_program/MI")
+    assert main.pool_metrics.checked_out == 0
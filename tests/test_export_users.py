@@ -0,0 +1,68 @@
+# tests/test_export_users.py
+import base64
+import csv
+import gzip
+import io
+
+import pytest
+from sqlalchemy import select
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"admin:admin").decode()}
+
+
+@pytest.fixture(scope="module")
+def exported(main):
+    """Users in a program of their own, so other tests' users don't show up in the filtered export"""
+    db = main.session_factory()
+    try:
+        for i in range(7):
+            db.add(main.User(last_name=f"Export{i}", email=f"export{i}@example.org", visit_count=i,
+                             current_program="EXPORT"))
+        db.commit()
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def client(main):
+    return main.app.test_client()
+
+
+def rows(text):
+    return list(csv.reader(io.StringIO(text)))
+
+
+def test_export_is_streamed_with_only_the_exported_columns(client, exported):
+    response = client.get("/export_users", headers=AUTH, query_string={"program": "EXPORT"}, buffered=False)
+    assert response.is_streamed
+    table = rows(response.get_data(as_text=True))
+    assert table[0] == ["ID", "Last Name", "Email", "Visit Count", "Program"]
+    assert [row[1] for row in table[1:]] == [f"Export{i}" for i in range(7)]
+    assert table[1][2:] == ["export0@example.org", "0", "EXPORT"]
+
+
+def test_min_visits_filter(client, exported):
+    response = client.get("/export_users", headers=AUTH, query_string={"program": "EXPORT", "min_visits": 5})
+    assert [row[1] for row in rows(response.get_data(as_text=True))[1:]] == ["Export5", "Export6"]
+
+
+def test_gzip_export_has_the_same_rows(client, exported):
+    query = {"program": "EXPORT"}
+    plain = client.get("/export_users", headers=AUTH, query_string=query).get_data(as_text=True)
+    response = client.get("/export_users", headers=AUTH, query_string=dict(query, gzip="1"))
+    assert response.mimetype == "application/gzip"
+    assert gzip.decompress(response.get_data()).decode("utf-8") == plain
+
+
+def test_rows_are_read_and_sent_in_batches(main, exported, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_BATCH_SIZE", 3)
+    User = main.User
+    statement = select(User.id, User.last_name, User.email, User.visit_count, User.current_program).where(
+        User.current_program == "EXPORT").order_by(User.id)
+    chunks = list(main.iter_user_csv(statement))
+    # The header, then 7 rows in batches of 3, 3 and 1
+    assert [len(rows(chunk)) for chunk in chunks] == [1, 3, 3, 1]
+
+
+def test_export_needs_the_admin_login(client):
+    assert client.get("/export_users").status_code == 401
@@ -0,0 +1,56 @@
+# tests/test_faq.py
+import json
+
+import pytest
+
+from faq import FaqTier, heading_questions, heading_topic, merge_questions
+from semantic_cache import HashingEmbedder
+
+
+@pytest.mark.parametrize("heading, topic", [
+    ("Coaching Mindset", "Coaching Mindset"),
+    ("3. Coaching steps", "Coaching steps"),
+    ("Step 2: Open Questions.", "Open Questions"),
+    ("IV) Rolling with Resistance", "Rolling with Resistance"),
+    ("Coaching Skills: These skills are not linear!", "Coaching Skills"),
+    ("Change Talk vs. Sustain Talk", "Change Talk vs. Sustain Talk"),
+    ("Centering Script ", "Centering Script"),
+])
+def test_topic_headings_are_cleaned_up(heading, topic):
+    assert heading_topic(heading) == topic
+
+
+@pytest.mark.parametrize("heading", [
+    "Feedback is",
+    "Cultural Humility Promotes…",
+    "Coaching Can Take Many Forms",
+    "Utilizing a coach approach means:",
+    "What Supervisors are Saying",
+    "How We Listen",
+    "Slow down. Listen first",
+    "Guidelines for listening to the people you coach every day",
+])
+def test_headings_that_are_not_topics_are_skipped(heading):
+    assert heading_topic(heading) is None
+
+
+def test_heading_questions():
+    text = "*2. What is MI?\nSome text\n* Feedback Tips:\n*Feedback is\n- not a heading"
+    assert heading_questions(text) == ["What is MI?", "What does the program say about Feedback Tips?"]
+
+
+def test_faq_tier_matches_rewordings_but_not_negations(tmp_path):
+    (tmp_path / "BCC-v1.json").write_text(json.dumps({"program": "BCC", "content_version": "v1", "entries": [
+        {"question": "When should I use reflective listening?", "answer": "use it when"}
+    ]}))
+    tier = FaqTier(str(tmp_path))
+    assert tier.get("BCC", "v1", "when should I use reflective listening") == "use it when"
+    assert tier.get("BCC", "v1", "when should I use reflective listening skills") == "use it when"
+    assert tier.get("BCC", "v1", "when should I not use reflective listening") is None
+    assert tier.get("BCC", "v2", "when should I use reflective listening") is None
+
+
+def test_merge_keeps_a_question_and_its_negation():
+    questions = ["When should I use reflective listening?", "when should I use reflective listening",
+                 "When should I not use reflective listening?"]
+    assert merge_questions(questions, HashingEmbedder(), 0.85) == [questions[0], questions[2]]
@@ -0,0 +1,210 @@
+# tests/test_llm_client.py
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import llm_client
+from llm_client import CircuitBreaker, FakeApiError, FakeBackend, LLMClient, LLMUnavailable
+
+MESSAGES = [{"role": "user", "content": "What is the GROW model?"}]
+
+
+class ScriptedBackend(FakeBackend):
+    """FakeBackend whose calls take the given delays in turn (then no delay)"""
+
+    def __init__(self, delays, **kwargs):
+        super().__init__(**kwargs)
+        self.delays = list(delays)
+
+    def _next_call(self):
+        delay, fail = super()._next_call()
+        with self._lock:
+            return (self.delays.pop(0) if self.delays else 0.0), fail
+
+
+def make_client(backend, **kwargs):
+    kwargs.setdefault("backoff_base", 0.001)
+    kwargs.setdefault("timeout", 5)
+    return LLMClient(backend, **kwargs)
+
+
+# Circuit breaker
+
+def test_breaker_opens_after_threshold(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.opens == 1
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_lets_one_probe_through(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.allow()
+
+
+def test_breaker_failed_probe_opens_again(clock, monkeypatch):
+    monkeypatch.setattr(llm_client, "time", clock)
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opens == 2
+    clock.advance(29)
+    assert not breaker.allow()
+
+
+# Retries
+
+def test_retries_retryable_errors_then_succeeds():
+    backend = FakeBackend(fail_times=2, fail_status=503)
+    client = make_client(backend, max_retries=2)
+    completion = client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert completion.text == backend.reply
+    assert backend.calls == 3
+    assert client.stats["retries"] == 2
+    assert client.breaker.state == "closed"
+
+
+def test_gives_up_after_max_retries():
+    backend = FakeBackend(fail_times=10, fail_status=429)
+    client = make_client(backend, max_retries=2)
+    with pytest.raises(LLMUnavailable):
+        client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert backend.calls == 3
+    assert client.stats["failures"] == 1
+    assert client.breaker.failures == 1
+
+
+def test_does_not_retry_a_bad_request():
+    backend = FakeBackend(fail_times=1, fail_status=400)
+    client = make_client(backend, max_retries=2)
+    with pytest.raises(FakeApiError):
+        client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert backend.calls == 1
+    assert client.breaker.failures == 0
+
+
+def test_open_circuit_short_circuits_without_calling_the_model():
+    backend = FakeBackend(fail_times=10)
+    client = make_client(backend, max_retries=0, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))
+    with pytest.raises(LLMUnavailable):
+        client.complete("gpt-4o-mini", MESSAGES, 100)
+    with pytest.raises(LLMUnavailable, match="Circuit open"):
+        client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert backend.calls == 1
+    assert client.stats["short_circuited"] == 1
+
+
+def test_attempt_past_the_deadline_times_out():
+    client = make_client(ScriptedBackend([1.0, 1.0]), timeout=0.1, max_retries=1)
+    started = time.monotonic()
+    with pytest.raises(LLMUnavailable):
+        client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert time.monotonic() - started < 0.5
+    assert client.stats["timeouts"] >= 1
+
+
+def test_unhedged_calls_do_not_queue_behind_the_pool():
+    # More callers than pool workers, each well within the timeout: none should fail
+    client = make_client(FakeBackend(latency=0.3), timeout=0.5, max_retries=0, max_workers=2)
+    with ThreadPoolExecutor(max_workers=8) as callers:
+        results = list(callers.map(lambda _: client.complete("gpt-4o-mini", MESSAGES, 100), range(8)))
+    assert len(results) == 8
+    assert client.stats["timeouts"] == 0 and client.breaker.state == "closed"
+
+
+def test_time_queued_for_a_hedge_worker_does_not_count_against_the_deadline():
+    client = make_client(FakeBackend(latency=0.2), timeout=0.4, hedge_after=0.35, max_retries=0, max_workers=1)
+    with ThreadPoolExecutor(max_workers=3) as callers:
+        results = list(callers.map(lambda _: client.complete("gpt-4o-mini", MESSAGES, 100), range(3)))
+    assert len(results) == 3
+    assert client.stats["timeouts"] == 0 and client.stats["failures"] == 0
+
+
+def test_async_retries_then_succeeds():
+    backend = FakeBackend(fail_times=1, fail_status=502)
+    client = make_client(backend, max_retries=2)
+    completion = asyncio.run(client.acomplete("gpt-4o-mini", MESSAGES, 100))
+    assert completion.text == backend.reply
+    assert backend.calls == 2
+
+
+def test_stream_is_retried_before_the_first_chunk():
+    backend = FakeBackend(fail_times=1, fail_status=503)
+    client = make_client(backend, max_retries=1)
+    text = "".join(client.stream("gpt-4o-mini", MESSAGES, 100))
+    assert text.strip() == backend.reply
+    assert backend.calls == 2
+
+
+def test_async_stream_is_retried_before_the_first_chunk():
+    backend = FakeBackend(fail_times=1, fail_status=503)
+    client = make_client(backend, max_retries=1)
+
+    async def read():
+        return "".join([delta async for delta in await client.astream("gpt-4o-mini", MESSAGES, 100)])
+
+    assert asyncio.run(read()).strip() == backend.reply
+    assert backend.calls == 2
+
+
+# Hedging
+
+def test_slow_call_is_hedged_and_the_fast_one_wins():
+    backend = ScriptedBackend([1.0, 0.0])
+    client = make_client(backend, hedge_after=0.05, max_retries=0)
+    started = time.monotonic()
+    completion = client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert time.monotonic() - started < 0.5
+    assert completion.text == backend.reply
+    assert client.stats["hedged"] == 1
+    assert client.stats["hedge_wins"] == 1
+
+
+def test_fast_call_is_not_hedged():
+    backend = FakeBackend()
+    client = make_client(backend, hedge_after=0.5)
+    client.complete("gpt-4o-mini", MESSAGES, 100)
+    assert backend.calls == 1
+    assert client.stats["hedged"] == 0
+
+
+def test_async_hedge_cancels_the_slow_call():
+    backend = ScriptedBackend([1.0, 0.0])
+    client = make_client(backend, hedge_after=0.05, max_retries=0)
+    started = time.monotonic()
+    asyncio.run(client.acomplete("gpt-4o-mini", MESSAGES, 100))
+    assert time.monotonic() - started < 0.5
+    assert client.stats["hedge_wins"] == 1
+
+
+def test_p95_hedging_waits_for_enough_samples():
+    client = make_client(FakeBackend(), hedge_after="p95")
+    assert client._hedge_delay() is None
+    for _ in range(client.latency.min_samples):
+        client.latency.record(0.2)
+    assert client._hedge_delay() == pytest.approx(0.2)
@@ -0,0 +1,103 @@
+# tests/test_log_config.py
+import io
+import json
+import logging
+import threading
+
+import pytest
+
+import log_config
+from log_config import configure_logging, log_stats, request_id_var, stop_logging
+
+
+class GatedStream(io.StringIO):
+    """A log sink whose writes wait until the gate is opened, like a stalled pipe"""
+
+    def __init__(self):
+        super().__init__()
+        self.gate = threading.Event()
+        self.waiting = threading.Event()
+
+    def write(self, text):
+        self.waiting.set()
+        self.gate.wait(5)
+        return super().write(text)
+
+
+def lines(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+@pytest.fixture(autouse=True)
+def restore_logging():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield
+    stop_logging(timeout=1)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+    log_config._handler = log_config._output = None
+
+
+def test_records_are_written_as_json_by_the_listener():
+    stream = io.StringIO()
+    configure_logging(level="INFO", fmt="json", stream=stream)
+    token = request_id_var.set("req-1")
+    try:
+        logging.getLogger("tests").info("Answered %s in %d ms", "BCC", 12, extra={"program": "BCC"})
+        logging.getLogger("tests").debug("not at INFO")
+    finally:
+        request_id_var.reset(token)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logging.getLogger("tests").exception("Failed")
+    # Records still queued here are written by stop_logging, and keep the request id they were logged with
+    stop_logging()
+    first, second = lines(stream)
+    assert (first["message"], first["level"], first["request_id"], first["program"]) == \
+        ("Answered BCC in 12 ms", "INFO", "req-1", "BCC")
+    assert second["request_id"] is None and "ValueError: boom" in second["exception"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    stream = GatedStream()
+    configure_logging(level="INFO", stream=stream, queue_size=1)
+    logger = logging.getLogger("tests")
+    logger.info("taken by the listener, which is stuck writing it")
+    assert stream.waiting.wait(5)
+    logger.info("queued")
+    logger.info("dropped")
+    assert log_stats() == {"queued": 1, "dropped": 1}
+    stream.gate.set()
+
+
+def test_stop_writes_out_a_full_queue():
+    stream = GatedStream()
+    configure_logging(level="INFO", stream=stream, queue_size=1)
+    logger = logging.getLogger("tests")
+    logger.info("first")
+    assert stream.waiting.wait(5)
+    logger.info("second")
+    # The queue is full, so stop has to wait for room for its sentinel
+    stopper = threading.Thread(target=stop_logging)
+    stopper.start()
+    stream.gate.set()
+    stopper.join(5)
+    assert not stopper.is_alive()
+    logger.info("after stop")
+    assert [line["message"] for line in lines(stream)] == ["first", "second", "after stop"]
+
+
+def test_stop_gives_up_on_a_stuck_listener(capsys):
+    stream = GatedStream()
+    configure_logging(level="INFO", stream=stream, queue_size=1)
+    logging.getLogger("tests").info("stuck")
+    assert stream.waiting.wait(5)
+    logging.getLogger("tests").info("queued")
+    stop_logging(timeout=0.1)
+    assert "1 records not written" in capsys.readouterr().err
+    stream.gate.set()
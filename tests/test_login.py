@@ -0,0 +1,75 @@
+# tests/test_login.py
+import pytest
+from sqlalchemy import event
+
+from models import User
+
+
+@pytest.fixture
+def db(session_factory):
+    db = session_factory()
+    db.add(User(id=1, last_name="Login", email="login@example.org", visit_count=2))
+    db.commit()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def statements(engine):
+    """SQL statements sent to `engine` from now on"""
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(statement)
+    event.listen(engine, "before_cursor_execute", record)
+    yield sent
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def test_login_is_one_update_returning_the_user(db, statements):
+    row = User.record_login(db, "Login", "login@example.org")
+    assert (row.id, row.email, row.last_name) == (1, "login@example.org", "Login")
+    assert len(statements) == 1 and statements[0].lstrip().upper().startswith("UPDATE")
+    assert db.get(User, 1).visit_count == 3
+
+
+def test_login_with_unknown_credentials_changes_nothing(db):
+    assert User.record_login(db, "Other", "login@example.org") is None
+    assert User.record_login(db, "Login", "nobody@example.org") is None
+    assert db.get(User, 1).visit_count == 2
+
+
+def test_null_visit_count_is_counted_from_zero(db):
+    db.add(User(id=2, last_name="Legacy", email="legacy@example.org"))
+    db.commit()
+    db.query(User).filter(User.id == 2).update({User.visit_count: None})
+    db.commit()
+    User.record_login(db, "Legacy", "legacy@example.org")
+    assert db.get(User, 2).visit_count == 1
+
+
+def test_program_switch_is_one_update(db, statements):
+    assert User.set_current_program(db, 1, "MI")
+    assert len(statements) == 1 and statements[0].lstrip().upper().startswith("UPDATE")
+    db.expire_all()
+    assert db.get(User, 1).current_program == "MI"
+    assert not User.set_current_program(db, 99, "MI")
+
+
+def test_login_and_set_program_routes(main):
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Route", "email": "route@example.org"})
+    for _ in range(2):
+        response = client.post("/login", data={"last_name": "Route", "email": "route@example.org"})
+        assert response.status_code == 302 and response.location.endswith("/program_select")
+    response = client.get("/set_program/MI")
+    assert response.status_code == 302
+    db = main.session_factory()
+    try:
+        user = db.query(User).filter(User.email == "route@example.org").one()
+        assert (user.visit_count, user.current_program) == (2, "MI")
+    finally:
+        db.close()
+    with client.session_transaction() as session:
+        assert session["current_program"] == "MI" and session["user_id"] == user.id
+    assert client.post("/login", data={"last_name": "Nobody", "email": "route@example.org"}).status_code == 400
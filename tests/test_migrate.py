@@ -0,0 +1,149 @@
+# tests/test_migrate.py
+import sys
+
+import pytest
+from sqlalchemy import inspect, text
+
+import migrate
+from migrate import AddColumn, Backfill, CreateIndex, Migration, MigrationError, MigrationRunner
+from models import User
+
+
+@pytest.fixture
+def legacy_engine(engine):
+    """A users table as the first version of the app created it, with a few users"""
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                          "last_name TEXT NOT NULL, email TEXT NOT NULL UNIQUE)"))
+        for i in range(25):
+            conn.execute(text("INSERT INTO users (last_name, email) VALUES (:last_name, :email)"),
+                         {"last_name": f"User{i}", "email": f"user{i}@example.org"})
+    return engine
+
+
+def columns(engine, table_name):
+    return {column["name"] for column in inspect(engine).get_columns(table_name)}
+
+
+def indexes(engine, table_name):
+    return {index["name"] for index in inspect(engine).get_indexes(table_name)}
+
+
+def test_upgrades_a_legacy_users_table(legacy_engine):
+    runner = MigrationRunner(legacy_engine, batch_size=10)
+    assert runner.check(runner.pending()) == []
+    applied = runner.run()
+
+    assert applied == [migration.version for migration in migrate.MIGRATIONS]
+    assert {"visit_count", "current_program"} <= columns(legacy_engine, "users")
+    assert {"ix_users_last_name", "ix_users_email_prefix", "ix_users_visit_count_id",
+            "ix_users_email_last_name"} <= indexes(legacy_engine, "users")
+    with legacy_engine.connect() as conn:
+        rows = conn.execute(text("SELECT visit_count, current_program FROM users")).all()
+    assert len(rows) == 25
+    assert set(rows) == {(0, "BCC")}
+    for table_name in ("answer_cache", "inflight_requests", "chat_quotas", "conversation_turns"):
+        assert inspect(legacy_engine).has_table(table_name)
+
+
+def test_second_run_does_nothing(legacy_engine):
+    MigrationRunner(legacy_engine).run()
+    runner = MigrationRunner(legacy_engine)
+    assert runner.pending() == []
+    assert runner.run() == []
+
+
+def test_run_reports_what_each_step_did(legacy_engine):
+    runner = MigrationRunner(legacy_engine)
+    runner.run(target=3)
+    report = {version: steps for version, _, steps in runner.report}
+    assert sorted(report) == [1, 2, 3]
+    assert report[1] == [("create table users", "exists, skipped")]
+    assert report[3][0] == ("ALTER TABLE users ADD COLUMN visit_count INTEGER DEFAULT 0", "added")
+    assert [result for _, result in report[3][2:]] == ["built"] * 4
+
+
+def test_fresh_database(engine):
+    MigrationRunner(engine).run()
+    assert "visit_count" in columns(engine, "users")
+    assert "ix_users_visit_count_id" in indexes(engine, "users")
+
+
+def test_index_on_a_missing_column_is_caught_before_anything_runs(legacy_engine):
+    runner = MigrationRunner(legacy_engine, [
+        Migration(1, "add last_name index", [CreateIndex(User, "ix_users_last_name")]),
+        Migration(2, "visit count index", [CreateIndex(User, "ix_users_visit_count_id")])
+    ])
+    problems = runner.check(runner.pending())
+    assert len(problems) == 1 and "users.visit_count" in problems[0]
+    with pytest.raises(MigrationError, match="Nothing applied"):
+        runner.run()
+    assert "ix_users_last_name" not in indexes(legacy_engine, "users")
+    assert runner.applied() == {}
+
+
+def test_column_added_by_an_earlier_step_satisfies_the_check(legacy_engine):
+    runner = MigrationRunner(legacy_engine, [
+        Migration(1, "visit count", [AddColumn("users", "visit_count", "INTEGER DEFAULT 0")]),
+        Migration(2, "visit count index", [CreateIndex(User, "ix_users_visit_count_id")])
+    ])
+    assert runner.check(runner.pending()) == []
+
+
+def test_create_index_checks_its_columns_when_applied(legacy_engine):
+    with pytest.raises(MigrationError, match="visit_count"):
+        CreateIndex(User, "ix_users_visit_count_id").apply(legacy_engine, 100)
+
+
+class FailingStep:
+    def label(self, bind):
+        return "failing step"
+
+    describe = label
+
+    def estimate(self, bind):
+        return 0
+
+    def requires(self):
+        return []
+
+    def provides(self):
+        return []
+
+    def apply(self, bind, batch_size):
+        raise RuntimeError("disk full")
+
+
+def test_failed_migration_says_where_and_resumes(legacy_engine):
+    add_column = AddColumn("users", "visit_count", "INTEGER DEFAULT 0")
+    runner = MigrationRunner(legacy_engine, [Migration(1, "visit count", [add_column, FailingStep()])])
+    with pytest.raises(MigrationError, match="step 2 of 2, failing step") as failure:
+        runner.run()
+    assert failure.value.completed == [(add_column.label(legacy_engine), "added")]
+    assert runner.applied() == {}
+
+    # Run again without the failing step: the column is already there and is skipped
+    runner = MigrationRunner(legacy_engine, [Migration(1, "visit count", [add_column])])
+    runner.run()
+    assert runner.report[0][2] == [(add_column.label(legacy_engine), "exists, skipped")]
+    assert 1 in runner.applied()
+
+
+def test_backfill_updates_in_batches(legacy_engine):
+    AddColumn("users", "visit_count", "INTEGER").apply(legacy_engine, 10)
+    result = Backfill("users", "visit_count = 0", "visit_count IS NULL").apply(legacy_engine, 10)
+    assert result == "25 rows in 3 batches"
+    with legacy_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM users WHERE visit_count IS NULL")).scalar() == 0
+
+
+def test_dry_run_lists_steps_and_changes_nothing(legacy_engine, monkeypatch, capsys):
+    monkeypatch.setattr(migrate, "engine", legacy_engine)
+    monkeypatch.setattr(sys, "argv", ["migrate.py", "--dry-run"])
+    migrate.main()
+    output = capsys.readouterr().out
+    assert "ADD COLUMN visit_count" in output
+    assert "Problems" not in output
+    assert "visit_count" not in columns(legacy_engine, "users")
+    assert not inspect(legacy_engine).has_table("schema_migrations")
+
@@ -0,0 +1,83 @@
+# tests/test_program_registry.py
+import json
+import os
+
+import pytest
+
+from program_registry import Program, ProgramRegistry
+
+
+def write(path, text):
+    """Write a content file and move its mtime on, as a later edit would"""
+    stat = os.stat(path) if os.path.exists(path) else None
+    path.write_text(text, encoding="utf-8")
+    if stat is not None:
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.fixture
+def make_registry(tmp_path):
+    def make(filename="bcc.txt", text="The GROW model has four steps."):
+        write(tmp_path / filename, text)
+        program = Program("BCC", "Building Coaching Competency", [filename], "gpt-4o-mini", 2000, 3, 100,
+                          base_dir=str(tmp_path))
+        return ProgramRegistry([program]), program, tmp_path / filename
+    return make
+
+
+def test_content_loads_on_first_use(make_registry):
+    registry, program, _ = make_registry()
+    assert not program.loaded
+    assert "GROW" in program.content
+    assert registry.get("BCC") is program and registry.find("bcc") is program
+
+
+def test_changed_file_publishes_a_new_version(make_registry):
+    registry, program, path = make_registry()
+    old = program.snapshot
+    write(path, "The GROW model has four steps: goal, reality, options, will.")
+    assert registry.reload_changed() == ["BCC"]
+    assert program.version != old.version
+    assert "options" in program.content
+    assert program.reloads == 1
+
+
+def test_readers_keep_the_snapshot_they_hold(make_registry):
+    registry, program, path = make_registry()
+    held = program.snapshot
+    content, version, index = held.content, held.version, held.index
+    write(path, "Completely different content about feedback.")
+    registry.reload_changed()
+    assert program.snapshot is not held
+    # A request that took the old snapshot before the swap still sees all of it
+    assert (held.content, held.version, held.index) == (content, version, index)
+    assert "GROW" in held.content
+
+
+def test_unchanged_or_merely_touched_file_keeps_the_snapshot(make_registry):
+    registry, program, path = make_registry()
+    held = program.snapshot
+    assert registry.reload_changed() == []
+    write(path, path.read_text(encoding="utf-8"))
+    assert registry.reload_changed() == []
+    assert program.snapshot is held and program.reloads == 0
+
+
+def test_failed_parse_keeps_the_previous_snapshot(make_registry):
+    record = json.dumps({"title": "GROW", "text": "The GROW model has four steps."})
+    registry, program, path = make_registry("bcc.jsonl", record + "\n")
+    held = program.snapshot
+    write(path, record + '\n{"title": "cut sh')
+    assert registry.reload_changed() == []
+    assert program.snapshot is held
+    # Once the file is fixed the change is picked up
+    write(path, record + "\n" + json.dumps({"title": "Feedback", "text": "Be specific."}) + "\n")
+    assert registry.reload_changed() == ["BCC"]
+    assert "Be specific." in program.content
+
+
+def test_programs_not_yet_loaded_are_not_reloaded(make_registry):
+    registry, program, path = make_registry()
+    write(path, "New content.")
+    assert registry.reload_changed() == []
+    assert not program.loaded
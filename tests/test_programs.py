@@ -0,0 +1,66 @@
+# tests/test_programs.py
+import base64
+import json
+
+import pytest
+
+from program_registry import ProgramRegistry
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"admin:admin").decode()}
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    path = tmp_path / "programs.json"
+    path.write_text(json.dumps({
+        "defaults": {"model": "gpt-4o-mini", "token_budget": 2000, "top_k": 6, "quota": 300},
+        "programs": [
+            {"code": "BCC", "name": "Building Coaching Competency", "content_files": ["bcc.txt"]},
+            {"code": "NEW", "name": "A New Program", "content_files": ["new.txt"], "quota": 50, "top_k": 3},
+            {"code": "OLD", "name": "A Retired Program", "content_files": [], "enabled": False}
+        ]
+    }), encoding="utf-8")
+    (tmp_path / "new.txt").write_text("Content of the new program.", encoding="utf-8")
+    return str(path)
+
+
+def test_entries_override_settings_which_override_defaults(manifest, tmp_path):
+    registry = ProgramRegistry.from_manifest(manifest, settings={"model": "gpt-4o", "top_k": None, "quota": 100})
+    bcc, new = registry.get("BCC"), registry.get("NEW")
+    assert (bcc.model, bcc.top_k, bcc.quota) == ("gpt-4o", 6, 100)
+    assert (new.model, new.top_k, new.quota) == ("gpt-4o", 3, 50)
+    assert new.title == "A New Program (NEW)"
+    # Content files are relative to the manifest
+    assert new.content == "Content of the new program."
+    assert [program.code for program in registry.enabled()] == ["BCC", "NEW"]
+    assert registry.find("new") is new and "OLD" in registry and registry.get("new") is None
+
+
+@pytest.fixture
+def client(main, manifest, monkeypatch):
+    monkeypatch.setattr(main, "programs", ProgramRegistry.from_manifest(manifest))
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Programs", "email": "programs@example.org"})
+    client.post("/login", data={"last_name": "Programs", "email": "programs@example.org"})
+    return client
+
+
+def test_export_page_lists_the_registry_programs(client):
+    html = client.get("/export", headers=AUTH).get_data(as_text=True)
+    for code in ("BCC", "NEW", "OLD"):
+        assert f'<option value="{code}">' in html
+    assert '<option value="MI">' not in html
+
+
+def test_a_program_from_the_manifest_gets_its_pages_without_code_changes(client):
+    assert "A New Program" in client.get("/program_select").get_data(as_text=True)
+    response = client.get("/set_program/NEW")
+    assert response.location.endswith("/program/NEW")
+    assert "A New Program" in client.get("/program/NEW").get_data(as_text=True)
+    assert client.get("/index_new").location.endswith("/program/NEW")
+
+
+def test_disabled_and_unknown_programs_go_back_to_the_selection(client):
+    assert "A Retired Program" not in client.get("/program_select").get_data(as_text=True)
+    for path in ("/set_program/OLD", "/program/OLD", "/set_program/XX", "/program/XX", "/index_xx"):
+        assert client.get(path).location.endswith("/program_select"), path
@@ -0,0 +1,99 @@
+# tests/test_prompt_builder.py
+from types import SimpleNamespace
+
+from content_index import ContentIndex
+from conversation_memory import Turn
+from prompt_builder import MESSAGE_OVERHEAD_TOKENS, PromptBuilder
+
+CONTENT = "\n\n".join(f"Section {i}. " + " ".join(f"topic{i} detail{j}" for j in range(40)) for i in range(8))
+
+
+def program():
+    return SimpleNamespace(code="BCC", name="Building Coaching Competency", token_budget=2000, top_k=2)
+
+
+def snapshot(content=CONTENT, version="v1"):
+    return SimpleNamespace(index=ContentIndex.from_text(content, chunk_words=60), version=version)
+
+
+def test_prefix_is_only_the_instructions_by_default():
+    prompt = PromptBuilder().build(program(), snapshot(), "tell me about topic3")
+    assert prompt.messages[0]["content"].startswith("You are an assistant")
+    assert "Section" not in prompt.messages[0]["content"]
+
+
+def test_prefix_holds_the_opening_content_and_is_identical_across_questions():
+    builder = PromptBuilder(input_budget=5000, prefix_content_tokens=300)
+    content = snapshot()
+    first = builder.build(program(), content, "tell me about topic5")
+    second = builder.build(program(), content, "and what about topic6 then")
+    prefix = first.messages[0]["content"]
+    assert prefix == second.messages[0]["content"]
+    assert "Section 0." in prefix and "Section 7." not in prefix
+
+    _, tokens, pinned = builder.prefix(program(), content)
+    assert pinned and tokens <= 300
+    # Pinned chunks are not retrieved a second time, but count as sources of the answer
+    assert set(pinned) <= set(first.chunk_ids)
+    assert not any(f"Section {i}." in first.messages[1]["content"] for i in pinned)
+
+
+def test_prefix_is_rebuilt_when_the_content_changes():
+    builder = PromptBuilder(prefix_content_tokens=300)
+    old = builder.build(program(), snapshot(), "topic1").messages[0]["content"]
+    new = builder.build(program(), snapshot(CONTENT.replace("Section 0.", "Overview."), "v2"), "topic1")
+    assert old != new.messages[0]["content"] and "Overview." in new.messages[0]["content"]
+
+
+def test_pinned_content_counts_against_the_input_budget():
+    builder = PromptBuilder(input_budget=5000, prefix_content_tokens=300)
+    prompt = builder.build(program(), snapshot(), "topic4")
+    _, prefix_tokens, _ = builder.prefix(program(), snapshot())
+    assert prompt.input_tokens > prefix_tokens
+
+
+def turns(count):
+    """Short questions with long replies, so a note of the questions is much cheaper than a turn"""
+    return [Turn(f"question {i} about coaching", f"reply {i} " + "answer " * 60) for i in range(count)]
+
+
+def test_history_that_fits_is_kept_whole():
+    history = turns(3)
+    messages, tokens, kept = PromptBuilder().fit_history(history, 10000)
+    assert kept == 3
+    assert [m["role"] for m in messages] == ["user", "assistant"] * 3
+    assert tokens == sum(turn.tokens + 2 * MESSAGE_OVERHEAD_TOKENS for turn in history)
+
+
+def test_older_turns_are_reduced_to_a_note_of_their_questions():
+    history = turns(6)
+    per_turn = history[0].tokens + 2 * MESSAGE_OVERHEAD_TOKENS
+    budget = 2 * per_turn + 60
+    messages, tokens, kept = PromptBuilder().fit_history(history, budget)
+    assert kept == 2
+    assert tokens <= budget
+    note = messages[0]
+    assert note["role"] == "system" and "question 0" in note["content"] and "question 3" in note["content"]
+    # The most recent turns are the ones kept whole, in order
+    assert messages[1]["content"].startswith("question 4") and messages[-1]["content"].startswith("reply 5")
+    assert "answer" not in note["content"]
+
+
+def test_note_is_dropped_when_it_does_not_fit():
+    history = turns(4)
+    per_turn = history[0].tokens + 2 * MESSAGE_OVERHEAD_TOKENS
+    messages, tokens, kept = PromptBuilder().fit_history(history, per_turn + 5)
+    assert kept == 1 and len(messages) == 2
+    assert tokens == per_turn
+
+
+def test_nothing_fits_a_zero_budget():
+    assert PromptBuilder().fit_history(turns(2), 0) == ([], 0, 0)
+
+
+def test_standalone_question_is_asked_without_the_conversation():
+    history = turns(2)
+    standalone = PromptBuilder().build(program(), snapshot(), "What is the GROW model?", history)
+    assert standalone.history_turns == 0 and not standalone.follow_up
+    follow_up = PromptBuilder().build(program(), snapshot(), "Can you give an example of that?", history)
+    assert follow_up.history_turns == 2 and follow_up.follow_up
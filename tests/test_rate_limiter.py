@@ -0,0 +1,73 @@
+# tests/test_rate_limiter.py
+import pytest
+
+import rate_limiter
+from models import ChatQuota
+from rate_limiter import create_rate_limiter, parse_limits
+
+
+@pytest.fixture(params=["memory", "sql"])
+def make_limiter(request, clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "time", clock)
+
+    def make(**kwargs):
+        if request.param == "sql":
+            session_factory = request.getfixturevalue("session_factory")
+            return create_rate_limiter("sql", session_factory=session_factory, model=ChatQuota, **kwargs)
+        return create_rate_limiter("memory", **kwargs)
+    return make
+
+
+def test_bucket_allows_the_limit_then_denies(make_limiter):
+    limiter = make_limiter(default_limit=3, window=3600)
+    assert [limiter.consume(1, "BCC") for _ in range(4)] == [(True, 2), (True, 1), (True, 0), (False, 0)]
+
+
+def test_buckets_are_per_user_and_program(make_limiter):
+    limiter = make_limiter(default_limit=1, window=3600)
+    assert limiter.consume(1, "BCC")[0]
+    assert not limiter.consume(1, "BCC")[0]
+    assert limiter.consume(1, "MI")[0]
+    assert limiter.consume(2, "BCC")[0]
+
+
+def test_bucket_refills_over_the_window(make_limiter, clock):
+    limiter = make_limiter(default_limit=4, window=400)
+    for _ in range(4):
+        limiter.consume(1, "BCC")
+    assert not limiter.consume(1, "BCC")[0]
+    clock.advance(100)  # a quarter of the window: one token back
+    assert limiter.consume(1, "BCC") == (True, 0)
+    assert not limiter.consume(1, "BCC")[0]
+
+
+def test_refill_is_capped_at_the_limit(make_limiter, clock):
+    limiter = make_limiter(default_limit=2, window=100)
+    limiter.consume(1, "BCC")
+    clock.advance(10000)
+    assert limiter.consume(1, "BCC") == (True, 1)
+
+
+def test_per_program_limits(make_limiter):
+    limiter = make_limiter(default_limit=5, window=3600, limits=parse_limits("MI=1, Safety = 2"))
+    assert limiter.consume(1, "MI") == (True, 0)
+    assert not limiter.consume(1, "MI")[0]
+    assert limiter.consume(1, "Safety") == (True, 1)
+    assert limiter.consume(1, "BCC") == (True, 4)
+
+
+def test_memory_limiter_drops_idle_buckets():
+    limiter = create_rate_limiter("memory", default_limit=1, window=3600, max_buckets=2)
+    for user_id in (1, 2, 3):
+        limiter.consume(user_id, "BCC")
+    # User 1's bucket was dropped, so it starts full again
+    assert limiter.consume(1, "BCC")[0]
+    assert not limiter.consume(3, "BCC")[0]
+
+
+def test_a_limiter_must_implement_consume():
+    class Incomplete(rate_limiter.TokenBucketLimiter):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,92 @@
+# tests/test_request_metrics.py
+import time
+
+import pytest
+
+from llm_client import FakeBackend, LLMClient
+from request_metrics import RequestMetrics
+
+
+def count(histogram, **labels):
+    """Observations in the series with these labels"""
+    series = histogram._series.get(tuple(sorted(labels.items())))
+    return sum(series[:-1]) if series else 0
+
+
+def total(histogram, **labels):
+    """Sum of the observed values in the series with these labels"""
+    series = histogram._series.get(tuple(sorted(labels.items())))
+    return series[-1] if series else 0.0
+
+
+def test_spans_are_recorded_against_the_current_request():
+    metrics = RequestMetrics()
+    token = metrics.start("/chat")
+    with metrics.span("llm"):
+        pass
+    metrics.record_query()
+    trace = metrics.finish(token, 200, "POST")
+    assert [phase for phase, _ in trace.spans] == ["llm"]
+    assert trace.queries == 1
+    assert count(metrics.phases, route="/chat", phase="llm") == 1
+    assert count(metrics.requests, route="/chat", method="POST", status="200") == 1
+
+
+def test_span_outside_a_request_is_background():
+    metrics = RequestMetrics()
+    with metrics.span("reload"):
+        pass
+    assert count(metrics.phases, route="background", phase="reload") == 1
+
+
+def test_streamed_body_is_traced_and_timed_as_part_of_its_request():
+    metrics = RequestMetrics()
+
+    def body():
+        with metrics.span("llm"):
+            time.sleep(0.05)
+            yield "a"
+        yield "b"
+
+    token = metrics.start("/chat/stream")
+    trace = metrics.defer()
+    chunks = metrics.traced(trace, body(), 200, "POST")
+    metrics.finish(token, 200, "POST")
+    # Nothing is recorded when the headers go out
+    assert count(metrics.requests, route="/chat/stream", method="POST", status="200") == 0
+    assert list(chunks) == ["a", "b"]
+    assert count(metrics.phases, route="/chat/stream", phase="llm") == 1
+    assert count(metrics.phases, route="background", phase="llm") == 0
+    assert count(metrics.requests, route="/chat/stream", method="POST", status="200") == 1
+    assert total(metrics.requests, route="/chat/stream", method="POST", status="200") >= 0.05
+
+
+def test_streamed_body_closed_early_is_still_recorded():
+    metrics = RequestMetrics()
+    token = metrics.start("/chat/stream")
+    chunks = metrics.traced(metrics.defer(), (chunk for chunk in "ab"), 200)
+    metrics.finish(token, 200)
+    next(chunks)
+    chunks.close()
+    assert count(metrics.requests, route="/chat/stream", method="GET", status="200") == 1
+
+
+@pytest.fixture
+def client(main):
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Metrics", "email": "metrics@example.org"})
+    client.post("/login", data={"last_name": "Metrics", "email": "metrics@example.org"})
+    return client
+
+
+def test_chat_stream_phases_belong_to_the_route(main, client, monkeypatch):
+    monkeypatch.setattr(main, "llm_client", LLMClient(FakeBackend(latency=0.05)))
+    monkeypatch.setattr(main, "request_metrics", RequestMetrics())
+    response = client.post("/chat/stream", json={"message": "What is the GROW model?"})
+    assert "event: done" in response.get_data(as_text=True)
+    metrics = main.request_metrics
+    for phase in ("quota", "prompt", "smartsheet_enqueue"):
+        assert count(metrics.phases, route="/chat/stream", phase=phase) == 1, phase
+    assert not [key for key in metrics.phases._series if ("route", "background") in key]
+    # Timed until the last event, so it covers the model call
+    assert total(metrics.requests, route="/chat/stream", method="POST", status="200") >= 0.05
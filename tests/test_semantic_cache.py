@@ -0,0 +1,94 @@
+# tests/test_semantic_cache.py
+import pytest
+
+import semantic_cache
+from semantic_cache import HashingEmbedder, SemanticCache, negations
+
+
+@pytest.fixture
+def make_cache(clock, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "time", clock)
+    return lambda **kwargs: SemanticCache(**dict({"threshold": 0.85}, **kwargs))
+
+
+def test_reworded_question_gets_the_stored_answer(make_cache):
+    cache = make_cache()
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW answer")
+    assert cache.get("BCC", "v1", "what's the grow model") == "GROW answer"
+    assert cache.info()["hits"] == 1
+
+
+def test_different_question_program_or_version_misses(make_cache):
+    cache = make_cache()
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW answer")
+    assert cache.get("BCC", "v1", "How do I give feedback?") is None
+    assert cache.get("MI", "v1", "What is the GROW model?") is None
+    assert cache.get("BCC", "v2", "What is the GROW model?") is None
+
+
+def test_negated_question_never_gets_the_answer_to_the_positive_one(make_cache):
+    cache = make_cache()
+    embedder = HashingEmbedder()
+    positive, negative = "when should I use reflective listening", "when should I not use reflective listening"
+    # Close enough to pass the threshold on similarity alone
+    assert float(embedder.embed(positive) @ embedder.embed(negative)) >= 0.85
+    cache.set("BCC", "v1", positive, "use it when")
+    assert cache.get("BCC", "v1", negative) is None
+    assert cache.get("BCC", "v1", "when shouldn't I use reflective listening") is None
+    # Storing the negated question adds an entry instead of replacing the positive one
+    cache.set("BCC", "v1", negative, "avoid it when")
+    assert cache.get("BCC", "v1", "when should I never use reflective listening") is None
+    assert cache.get("BCC", "v1", "When should I NOT use reflective listening?") == "avoid it when"
+    assert cache.get("BCC", "v1", positive) == "use it when"
+    assert cache.info()["entries"] == 2
+
+
+def test_negations():
+    assert negations("Why don't my questions work?") == {"not"}
+    assert negations("I cannot and will never") == {"not", "never"}
+    assert negations("What is cultural humility?") == frozenset()
+
+
+def test_least_recently_used_entry_is_evicted_at_capacity(make_cache, clock):
+    cache = make_cache(capacity=2)
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW")
+    clock.advance(1)
+    cache.set("BCC", "v1", "How do I give feedback?", "feedback")
+    clock.advance(1)
+    cache.get("BCC", "v1", "What is the GROW model?")
+    clock.advance(1)
+    cache.set("BCC", "v1", "What is cultural humility?", "humility")
+    assert cache.get("BCC", "v1", "How do I give feedback?") is None
+    assert cache.get("BCC", "v1", "What is the GROW model?") == "GROW"
+    assert cache.info()["evictions"] == 1
+
+
+def test_expired_entries_miss(make_cache, clock):
+    cache = make_cache(ttl=60)
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW")
+    clock.advance(61)
+    assert cache.get("BCC", "v1", "What is the GROW model?") is None
+
+
+def test_entries_are_saved_and_loaded_from_the_cache_dir(make_cache, tmp_path):
+    path = str(tmp_path / "semantic")
+    cache = make_cache(path=path)
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW")
+    cache.set("BCC", "v1", "when should I not use reflective listening", "avoid it when")
+    cache.save()
+    assert (tmp_path / "semantic" / "BCC.npz").exists()
+
+    restarted = make_cache(path=path)
+    assert restarted.info()["entries"] == 2
+    assert restarted.get("BCC", "v1", "what's the grow model") == "GROW"
+    # Negations are worked out again from the saved questions
+    assert restarted.get("BCC", "v1", "when should I use reflective listening") is None
+
+
+def test_saves_every_few_new_entries(make_cache, tmp_path):
+    path = tmp_path / "semantic"
+    cache = make_cache(path=str(path), save_every=2)
+    cache.set("BCC", "v1", "What is the GROW model?", "GROW")
+    assert not path.exists()
+    cache.set("BCC", "v1", "How do I give feedback?", "feedback")
+    assert (path / "BCC.npz").exists()
@@ -0,0 +1,95 @@
+# tests/test_single_flight.py
+import threading
+import time
+
+import pytest
+
+from single_flight import FlightTimeout, SingleFlight
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+def run_concurrently(flights, key, fn, callers):
+    """Call flights.do(key, fn) from `callers` threads; returns their (result, shared) or exception"""
+    results = [None] * callers
+
+    def call(i):
+        try:
+            results[i] = flights.do(key, fn)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def test_concurrent_duplicates_share_one_call():
+    flights = SingleFlight(timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return "answer"
+
+    threads, results = run_concurrently(flights, "key", fn, 5)
+    wait_until(lambda: flights.info()["followers"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert all(result == "answer" for result, _ in results)
+    assert flights.info() == {"in_flight": 0, "leaders": 1, "followers": 4}
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight(timeout=5)
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    threads, results = run_concurrently(flights, "key", fn, 3)
+    wait_until(lambda: flights.info()["followers"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.info()["in_flight"] == 0
+
+
+def test_different_keys_are_not_coalesced():
+    flights = SingleFlight(timeout=5)
+    assert flights.do("a", lambda: 1) == (1, False)
+    assert flights.do("b", lambda: 2) == (2, False)
+    assert flights.info()["leaders"] == 2
+
+
+def test_finished_call_is_not_reused():
+    flights = SingleFlight(timeout=5)
+    answers = iter(["first", "second"])
+    assert flights.do("key", lambda: next(answers)) == ("first", False)
+    assert flights.do("key", lambda: next(answers)) == ("second", False)
+
+
+def test_follower_gives_up_after_timeout():
+    flights = SingleFlight(timeout=0.05)
+    call, leader = flights.begin("key")
+    assert leader
+    with pytest.raises(FlightTimeout):
+        flights.do("key", lambda: "never called")
+    flights.finish("key", call, result="late")
+    assert flights.info()["in_flight"] == 0
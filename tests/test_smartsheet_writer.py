@@ -0,0 +1,213 @@
+# tests/test_smartsheet_writer.py
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from smartsheet_writer import SmartsheetWriter, StubApiError, StubSmartsheetClient, is_retryable
+
+
+def wait_until(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.005)
+
+
+def journal_records(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "journal.jsonl")
+
+
+@pytest.fixture
+def make_writer(journal_path):
+    writers = []
+
+    def make(send_rows, **kwargs):
+        kwargs.setdefault("flush_interval", 0.02)
+        kwargs.setdefault("backoff_base", 0.001)
+        writer = SmartsheetWriter(send_rows, journal_path=journal_path, **kwargs)
+        writers.append(writer)
+        return writer
+    yield make
+    for writer in writers:
+        writer.stop(timeout=1)
+
+
+def stub_sender(client):
+    return lambda rows: client.Sheets.add_rows(1, rows)
+
+
+def test_retryable_errors():
+    assert is_retryable(StubApiError(429))
+    assert is_retryable(StubApiError(503))
+    assert is_retryable(ConnectionError())
+    assert not is_retryable(StubApiError(400))
+    assert not is_retryable(ValueError())
+
+
+def test_records_are_sent_in_batches(make_writer):
+    client = StubSmartsheetClient()
+    writer = make_writer(stub_sender(client), batch_size=10, flush_interval=0.5)
+    for i in range(25):
+        writer.enqueue({"i": i})
+    wait_until(lambda: len(client.rows) == 25)
+    assert client.calls == 3
+    assert writer.metrics()["batches"] == 3
+
+
+def test_failed_batch_is_retried(make_writer, journal_path):
+    client = StubSmartsheetClient(fail_times=2, fail_status=503)
+    writer = make_writer(stub_sender(client), max_retries=3)
+    writer.enqueue({"i": 1})
+    wait_until(lambda: client.rows)
+    assert client.calls == 3
+    assert writer.metrics()["retries"] == 2
+    assert journal_records(journal_path) == []
+
+
+def test_rejected_batch_is_dropped_not_journaled(make_writer, journal_path):
+    client = StubSmartsheetClient(fail_times=1, fail_status=400)
+    writer = make_writer(stub_sender(client))
+    writer.enqueue({"i": 1})
+    wait_until(lambda: writer.metrics()["failed_batches"] == 1)
+    assert client.calls == 1
+    assert journal_records(journal_path) == []
+
+
+def reject_bad_rows(client):
+    """Sender that refuses any batch containing a row marked bad, the way Smartsheet refuses a whole call"""
+    def send(rows):
+        if any(row.get("bad") for row in rows):
+            raise StubApiError(400)
+        return client.Sheets.add_rows(1, rows)
+    return send
+
+
+def test_rejected_batch_is_resent_a_row_at_a_time(make_writer, journal_path):
+    client = StubSmartsheetClient()
+    writer = make_writer(reject_bad_rows(client), batch_size=4, flush_interval=0.5)
+    for record in [{"i": 0}, {"i": 1, "bad": True}, {"i": 2}, {"i": 3}]:
+        writer.enqueue(record)
+    wait_until(lambda: len(client.rows) == 3)
+    assert [row["i"] for row in client.rows] == [0, 2, 3]
+    assert writer.metrics()["rejected_rows"] == 1
+    assert journal_records(journal_path) == []
+
+
+def test_rows_not_yet_resent_are_journaled_when_smartsheet_goes_down(make_writer, journal_path):
+    client = StubSmartsheetClient()
+    send_bad_rows = reject_bad_rows(client)
+
+    def send(rows):
+        if len(rows) == 1 and rows[0]["i"] == 2:
+            client.fail_times = 100  # an outage starts
+        return send_bad_rows(rows)
+
+    writer = make_writer(send, batch_size=4, flush_interval=0.5, max_retries=1)
+    for record in [{"i": 0}, {"i": 1, "bad": True}, {"i": 2}, {"i": 3}]:
+        writer.enqueue(record)
+    wait_until(lambda: len(journal_records(journal_path)) == 2)
+    assert [row["i"] for row in client.rows] == [0]
+    assert journal_records(journal_path) == [{"i": 2}, {"i": 3}]
+
+
+def test_batch_is_journaled_after_retries_and_replayed_after_the_next_success(make_writer, journal_path):
+    client = StubSmartsheetClient(fail_times=3, fail_status=503)
+    writer = make_writer(stub_sender(client), max_retries=2)
+    writer.enqueue({"i": 1})
+    wait_until(lambda: journal_records(journal_path) == [{"i": 1}])
+    writer.enqueue({"i": 2})
+    wait_until(lambda: len(client.rows) == 2)
+    assert client.rows == [{"i": 2}, {"i": 1}]
+    assert writer.metrics()["replayed_rows"] == 1
+    assert not os.path.exists(journal_path)
+
+
+def test_journal_left_by_a_previous_run_is_replayed(make_writer, journal_path):
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.write('{"i": 1}\n{"i": 2}\n')
+    client = StubSmartsheetClient()
+    writer = make_writer(stub_sender(client))
+    writer.enqueue({"i": 3})
+    wait_until(lambda: len(client.rows) == 3)
+    assert sorted(row["i"] for row in client.rows) == [1, 2, 3]
+
+
+def test_unreadable_journal_lines_are_skipped(make_writer, journal_path):
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.write('{"i": 1}\n{"i": 2}\n{"i": 3, "na')  # cut short by a crash
+    client = StubSmartsheetClient()
+    writer = make_writer(stub_sender(client))
+    writer.enqueue({"i": 4})
+    wait_until(lambda: len(client.rows) == 3)
+    assert sorted(row["i"] for row in client.rows) == [1, 2, 4]
+    assert not [name for name in os.listdir(os.path.dirname(journal_path)) if name.endswith(".replay")]
+
+
+def test_claim_left_by_a_dead_worker_is_replayed(make_writer, journal_path):
+    with open(f"{journal_path}.999999999.abcd.replay", "w", encoding="utf-8") as f:
+        f.write('{"i": 1}\n')
+    client = StubSmartsheetClient()
+    writer = make_writer(stub_sender(client))
+    writer.enqueue({"i": 2})
+    wait_until(lambda: len(client.rows) == 2)
+    assert not [name for name in os.listdir(os.path.dirname(journal_path)) if name.endswith(".replay")]
+
+
+def test_full_queue_spills_to_the_journal(make_writer, journal_path):
+    release = threading.Event()
+    writer = make_writer(lambda rows: release.wait(5), max_queue=1, batch_size=1)
+    writer.enqueue({"i": 1})
+    wait_until(lambda: writer.metrics()["queue_depth"] == 0)  # taken by the writer thread
+    writer.enqueue({"i": 2})
+    writer.enqueue({"i": 3})
+    assert journal_records(journal_path) == [{"i": 3}]
+    release.set()
+
+
+def test_stop_sends_the_batch_the_writer_holds(make_writer, journal_path):
+    client = StubSmartsheetClient()
+    # A long window: the records sit in the writer's batch until stop()
+    writer = make_writer(stub_sender(client), batch_size=100, flush_interval=10)
+    for i in range(5):
+        writer.enqueue({"i": i})
+    wait_until(lambda: writer.metrics()["queue_depth"] == 0)
+    writer.stop(timeout=2)
+    assert len(client.rows) == 5
+    assert journal_records(journal_path) == []
+
+
+def test_stop_journals_what_could_not_be_sent(make_writer, journal_path):
+    client = StubSmartsheetClient(fail_times=100, fail_status=503)
+    writer = make_writer(stub_sender(client), batch_size=2, backoff_base=10)
+    for i in range(5):
+        writer.enqueue({"i": i})
+    wait_until(lambda: client.calls >= 1)
+    started = time.monotonic()
+    writer.stop(timeout=2)
+    assert time.monotonic() - started < 1  # the backoff is cut short
+    assert sorted(record["i"] for record in journal_records(journal_path)) == [0, 1, 2, 3, 4]
+
+
+def test_stop_journals_the_batch_of_a_stuck_writer(make_writer, journal_path):
+    release = threading.Event()
+    writer = make_writer(lambda rows: release.wait(5), batch_size=2)
+    for i in range(3):
+        writer.enqueue({"i": i})
+    wait_until(lambda: writer.metrics()["queue_depth"] == 1)
+    writer.stop(timeout=0.1)
+    release.set()
+    assert sorted(record["i"] for record in journal_records(journal_path)) == [0, 1, 2]
+    writer.enqueue({"i": 3})
+    assert journal_records(journal_path)[-1] == {"i": 3}
@@ -0,0 +1,80 @@
+# tests/test_startup.py
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+import serve
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_CHECK = """
+import json, sys
+import sqlalchemy
+import asgi
+engine = sqlalchemy.create_engine(sys.argv[1])
+print(json.dumps({"modules": [name for name in ("openai", "smartsheet", "uvicorn", "waitress") if name in sys.modules],
+                  "tables": sqlalchemy.inspect(engine).get_table_names()}))
+"""
+
+
+def test_importing_the_app_loads_no_sdks_and_touches_no_schema(tmp_path):
+    database_url = "sqlite:///" + str(tmp_path / "cold.db")
+    env = dict(os.environ, DATABASE_URL=database_url, LLM_BACKEND="openai", OPENAI_API_KEY="sk-test",
+               SMARTSHEET_STUB="false", SMARTSHEET_ACCESS_TOKEN="token", SMARTSHEET_SHEET_ID="1")
+    result = subprocess.run([sys.executable, "-c", IMPORT_CHECK, database_url], cwd=ROOT, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    loaded = json.loads(result.stdout.strip().splitlines()[-1])
+    # The model and Smartsheet SDKs load on first use; the server is chosen by serve.py
+    assert loaded["modules"] == []
+    # Tables are created by migrate.py at deploy time, not by importing the app
+    assert loaded["tables"] == []
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    """Record what serve.run() starts instead of starting it"""
+    import models
+    import uvicorn
+    import waitress
+
+    calls = []
+    monkeypatch.setattr(uvicorn, "run", lambda app, **kwargs: calls.append(("uvicorn", app, kwargs)))
+    monkeypatch.setattr(waitress, "serve", lambda app, **kwargs: calls.append(("waitress", app, kwargs)))
+    monkeypatch.setattr(models, "init_db", lambda: calls.append(("init_db",)))
+    for name in ("SERVER_MODE", "DB_INIT_ON_START", "WEB_CONCURRENCY"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("PORT", "8123")
+    return calls
+
+
+def test_asgi_mode_runs_uvicorn_without_schema_work(calls):
+    serve.run()
+    assert [call[:2] for call in calls] == [("uvicorn", "asgi:app")]
+    assert calls[0][2]["port"] == 8123 and calls[0][2]["workers"] == 1
+
+
+def test_schema_is_applied_first_when_asked(calls, monkeypatch):
+    monkeypatch.setenv("DB_INIT_ON_START", "true")
+    serve.run()
+    assert [call[0] for call in calls] == ["init_db", "uvicorn"]
+
+
+def test_wsgi_mode_serves_the_flask_app_and_starts_the_warm_up(main, calls, monkeypatch):
+    warm_ups = []
+    monkeypatch.setattr(main, "start_warm_up", lambda: warm_ups.append(1))
+    monkeypatch.setenv("SERVER_MODE", "wsgi")
+    monkeypatch.setenv("WSGI_THREADS", "4")
+    serve.run()
+    assert calls == [("waitress", main.app, {"host": "0.0.0.0", "port": 8123, "threads": 4})]
+    assert warm_ups == [1]
+
+
+def test_warm_up_times_each_step(main, monkeypatch):
+    monkeypatch.setattr(main, "warm_up_state", {"started": True, "done": False, "seconds": {}})
+    main.warm_up()
+    assert main.warm_up_state["done"]
+    assert set(main.warm_up_state["seconds"]) == {"database", "content", "llm_client", "smartsheet"}
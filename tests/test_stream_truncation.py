@@ -0,0 +1,124 @@
+# tests/test_stream_truncation.py
+import json
+
+import pytest
+
+from llm_client import FakeBackend, LLMClient
+
+
+class ChunkedBackend(FakeBackend):
+    """Streams the reply `chunk_chars` characters at a time and notes whether the stream was cancelled"""
+
+    def __init__(self, reply, chunk_chars):
+        super().__init__(reply=reply)
+        self.chunk_chars = chunk_chars
+        self.sent = 0
+        self.closed_early = False
+
+    def stream(self, model, messages, max_tokens, timeout):
+        try:
+            for i in range(0, len(self.reply), self.chunk_chars):
+                self.sent += 1
+                yield self.reply[i:i + self.chunk_chars]
+        except GeneratorExit:
+            self.closed_early = True
+            raise
+
+
+@pytest.fixture
+def client(main):
+    client = main.app.test_client()
+    client.post("/register", data={"last_name": "Stream", "email": "stream@example.org"})
+    client.post("/login", data={"last_name": "Stream", "email": "stream@example.org"})
+    return client
+
+
+@pytest.fixture
+def use_backend(main, monkeypatch):
+    def use(backend):
+        monkeypatch.setattr(main, "llm_client", LLMClient(backend, backoff_base=0.001))
+        return backend
+    return use
+
+
+def stream_chat(client, question):
+    """POST /chat/stream; returns (the deltas joined, the final reply)"""
+    response = client.post("/chat/stream", json={"message": question})
+    assert response.status_code == 200
+    deltas, reply = [], None
+    for event in response.get_data(as_text=True).split("\n\n"):
+        lines = event.splitlines()
+        if not lines:
+            continue
+        data = json.loads(lines[-1][len("data: "):])
+        if lines[0] == "event: done":
+            reply = data["reply"]
+        else:
+            deltas.append(data["delta"])
+    return "".join(deltas), reply
+
+
+def words(count, word="word"):
+    return " ".join([word] * count)
+
+
+def test_short_reply_is_streamed_whole(client, use_backend):
+    backend = use_backend(ChunkedBackend("A short answer. It has two sentences.", chunk_chars=6))
+    streamed, reply = stream_chat(client, "short question")
+    assert reply == streamed.strip() == backend.reply
+    assert not backend.closed_early
+
+
+def test_reply_under_the_limit_is_not_cut(main, client, use_backend):
+    reply = f"{words(main.REPLY_TRUNCATE_WORDS + 50)} first sentence. {words(100)} second sentence."
+    use_backend(ChunkedBackend(reply, chunk_chars=40))
+    streamed, final = stream_chat(client, "medium question")
+    assert final == streamed.strip() == reply == main.truncate_reply(reply)
+
+
+def test_stream_stops_at_the_first_sentence_end_after_the_truncate_words(main, client, use_backend):
+    reply = f"{words(main.REPLY_TRUNCATE_WORDS + 10)} last kept sentence. {words(600, 'dropped')}."
+    backend = use_backend(ChunkedBackend(reply, chunk_chars=40))
+    streamed, final = stream_chat(client, "long question")
+    assert final.endswith("last kept sentence.")
+    assert final == main.truncate_reply(reply)
+    assert "dropped" not in streamed
+    # The upstream stream is cancelled once the reply passes the word limit
+    assert backend.closed_early
+    assert backend.sent < len(reply) / 40 * 0.75
+
+
+def test_stream_without_sentence_ends_stops_after_the_truncate_words(main, client, use_backend):
+    reply = words(main.REPLY_WORD_LIMIT + 200) + " "
+    use_backend(ChunkedBackend(reply, chunk_chars=20))
+    streamed, final = stream_chat(client, "rambling question")
+    assert len(final.split()) == main.REPLY_TRUNCATE_WORDS
+    assert final == streamed.strip() == main.truncate_reply(reply)
+
+
+def test_words_split_across_chunks_are_counted_once(main, client, use_backend):
+    # An early sentence end that a double count would stop at
+    early = main.REPLY_TRUNCATE_WORDS - 20
+    reply = f"{words(early, 'elephant')} early stop. {words(30, 'elephant')} real stop. {words(400, 'tail')}."
+    use_backend(ChunkedBackend(reply, chunk_chars=5))
+    _, final = stream_chat(client, "split words question")
+    assert final.endswith("real stop.")
+
+
+@pytest.mark.parametrize("chunk_chars", [1, 7, 64, 10000])
+@pytest.mark.parametrize("reply_words, sentence_at", [(200, 150), (450, 320), (520, 320), (520, 510), (900, 0)])
+def test_stream_and_chat_cut_the_same_reply_the_same_way(main, client, use_backend, chunk_chars,
+                                                         reply_words, sentence_at):
+    reply = words(reply_words).split()
+    if sentence_at:
+        reply[sentence_at - 1] += "."
+    reply = " ".join(reply)
+    use_backend(ChunkedBackend(reply, chunk_chars=chunk_chars))
+    streamed, final = stream_chat(client, f"question {chunk_chars} {reply_words} {sentence_at}")
+    assert final == streamed.strip() == main.truncate_reply(reply)
+
+
+def test_truncate_reply_ends_on_a_sentence(main):
+    reply = f"{words(main.REPLY_TRUNCATE_WORDS + 5)} end here. {words(main.REPLY_WORD_LIMIT)}."
+    assert main.truncate_reply(reply).endswith("end here.")
+    assert main.truncate_reply("Short. Reply.") == "Short. Reply."
@@ -0,0 +1,74 @@
+# tests/test_users_page.py
+import base64
+
+import pytest
+
+from models import User
+
+AUTH = {"Authorization": "Basic " + base64.b64encode(b"admin:admin").decode()}
+
+
+@pytest.fixture
+def db(main, session_factory):
+    """A fresh database holding users 1..5, with tied visit counts"""
+    db = session_factory()
+    for i, visits in enumerate([3, 1, 3, 0, 3], 1):
+        db.add(User(id=i, last_name=f"Page{i}", email=f"page{i}@example.org", visit_count=visits))
+    db.add(User(id=6, last_name="Under_score", email="under_score@example.org", visit_count=0))
+    db.add(User(id=7, last_name="Underxscore", email="underxscore@example.org", visit_count=2))
+    db.commit()
+    yield db
+    db.close()
+
+
+def all_pages(main, db, **kwargs):
+    """Follow next cursors to the end; returns the pages of user ids"""
+    pages = []
+    after = None
+    while True:
+        rows, after = main.query_users_page(db, after=after, **kwargs)
+        pages.append([row.id for row in rows])
+        if after is None:
+            return pages
+
+
+def test_pages_by_id_cover_every_user_once(main, db):
+    assert all_pages(main, db, limit=3) == [[1, 2, 3], [4, 5, 6], [7]]
+
+
+def test_full_last_page_has_no_next_cursor(main, db):
+    rows, after = main.query_users_page(db, limit=7)
+    assert len(rows) == 7 and after is None
+    rows, after = main.query_users_page(db, limit=6)
+    assert after == "6"
+
+
+def test_visit_sort_pages_through_ties(main, db):
+    # Most visits first, ties broken by id; a page boundary inside the tie loses or repeats nobody
+    pages = all_pages(main, db, sort="visits", limit=2)
+    assert pages == [[5, 3], [1, 7], [2, 6], [4]]
+
+
+def test_search_by_email_prefix_or_last_name(main, db):
+    assert [row.id for row in main.query_users_page(db, search="page1")[0]] == [1]
+    assert [row.id for row in main.query_users_page(db, search="Page4")[0]] == [4]
+    # LIKE wildcards in the search are matched literally
+    assert [row.id for row in main.query_users_page(db, search="under_")[0]] == [6]
+    assert main.query_users_page(db, search="%")[0] == []
+
+
+def test_bad_cursor(main, db):
+    with pytest.raises(ValueError):
+        main.query_users_page(db, sort="visits", after="nonsense")
+
+
+def test_json_api_pages_and_rejects_bad_cursors(main):
+    client = main.app.test_client()
+    for i in range(2):
+        client.post("/register", data={"last_name": "Api", "email": f"api{i}@example.org"})
+    body = client.get("/api/users", headers=AUTH, query_string={"limit": 1}).get_json()
+    assert len(body["users"]) == 1 and body["next"]
+    following = client.get("/api/users", headers=AUTH, query_string={"limit": 1, "after": body["next"]}).get_json()
+    assert following["users"][0]["id"] > body["users"][0]["id"]
+    response = client.get("/api/users", headers=AUTH, query_string={"after": "x"})
+    assert response.status_code == 400